@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Times coin selection against the number of coins an account has, for the value index based
+`CoinSelector` and the `CoinChooserPrivacy` coin chooser it is used in place of for larger
+numbers of coins. The coins are mostly dust, as in a faucet wallet.
+
+    python3 contrib/benchmark_coin_selection.py [maximum_coin_count]
+
+The coin chooser is only timed for smaller numbers of coins, as it takes too long otherwise.
+"""
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple
+
+CONTRIB_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(CONTRIB_PATH, ".."))
+
+from bitcoinx import PrivateKey, Script
+
+from electrumsv.coinchooser import CoinChooserPrivacy, CoinSelector, CoinValueIndex
+from electrumsv.constants import ScriptType
+from electrumsv.networks import Net
+from electrumsv.transaction import NO_SIGNATURE, XPublicKey, XTxInput, XTxOutput
+from electrumsv.types import TxoKeyType
+
+COIN_COUNTS = [ 1000, 10000, 50000, 100000, 200000 ]
+MAXIMUM_CHOOSER_COIN_COUNT = 10000
+DUST_THRESHOLD = 546
+# The payment amounts, as in the faucet's payments, and then one paid with thousands of coins.
+PAYMENT_AMOUNTS = [ 50000, 2000000 ]
+
+PRIVATE_KEY = PrivateKey.from_random()
+X_PUBKEY = XPublicKey.from_hex(PRIVATE_KEY.public_key.to_hex())
+OUTPUT_SCRIPT = PRIVATE_KEY.public_key.to_address(coin=Net.COIN).to_script()
+
+
+class BenchCoin(NamedTuple):
+    value: int
+    key: TxoKeyType
+
+
+def fee_estimator(size: int) -> int:
+    return size // 2
+
+
+def make_coins(coin_count: int) -> List[BenchCoin]:
+    rng = random.Random(coin_count)
+    # A few larger coins amongst the dust.
+    values = [ rng.randrange(600, 1500) for i in range(coin_count - 10) ] + \
+        [ rng.randrange(100000, 200000) for i in range(10) ]
+    return [ BenchCoin(value, TxoKeyType(n.to_bytes(32, "little"), 0))
+        for n, value in enumerate(values) ]
+
+
+def make_tx_input(coin: BenchCoin) -> XTxInput:
+    return XTxInput(prev_hash=coin.key.tx_hash, prev_idx=coin.key.tx_index,
+        script_sig=Script(), sequence=0xffffffff, threshold=1, script_type=ScriptType.P2PKH,
+        signatures=[ NO_SIGNATURE ], x_pubkeys=[ X_PUBKEY ], value=coin.value, keyinstance_id=1)
+
+
+def time_call(func: Callable[[], object]) -> float:
+    start_time = time.perf_counter()
+    func()
+    return time.perf_counter() - start_time
+
+
+def benchmark(coin_count: int) -> None:
+    coins = make_coins(coin_count)
+    coins_by_key: Dict[TxoKeyType, BenchCoin] = { coin.key: coin for coin in coins }
+    input_size = make_tx_input(coins[0]).estimated_size()
+    change_outs = [ XTxOutput(0, OUTPUT_SCRIPT) ]
+
+    index = CoinValueIndex()
+    def build_index() -> None:
+        for coin in coins:
+            index.add(coin.value, coin.key)
+        len(index)
+    print(f"{coin_count:>7} coins: index built in {time_call(build_index):.3f}s")
+
+    for amount in PAYMENT_AMOUNTS:
+        outputs = [ XTxOutput(amount, OUTPUT_SCRIPT) ]
+        selection: List[BenchCoin] = []
+        def select() -> None:
+            selection[:] = CoinSelector().select_coins(
+                (coins_by_key[key] for _value, key in index.iter_descending()),
+                lambda coin: input_size, outputs, change_outs[0].estimated_size(),
+                fee_estimator, DUST_THRESHOLD)
+        selector_time = time_call(select)
+
+        chooser_text = "-"
+        if coin_count <= MAXIMUM_CHOOSER_COIN_COUNT:
+            tx_inputs = [ make_tx_input(coin) for coin in coins ]
+            chooser_time = time_call(lambda: CoinChooserPrivacy().make_tx(tx_inputs, outputs,
+                change_outs, fee_estimator, DUST_THRESHOLD))
+            chooser_text = f"{chooser_time:.3f}s"
+        print(f"    {amount:>8} sats: {len(selection):>5} coins selected in "
+            f"{selector_time:.4f}s, coin chooser {chooser_text}")
+
+    # The index after the selected coins are spent and the change is received.
+    def update_index() -> None:
+        for coin in selection:
+            index.remove(coin.value, coin.key)
+        index.add(1000, TxoKeyType(bytes(32), 1))
+        len(index)
+    print(f"    index updated for a payment in {time_call(update_index):.4f}s")
+
+
+def main() -> None:
+    maximum_coin_count = int(sys.argv[1]) if len(sys.argv) > 1 else COIN_COUNTS[-1]
+    for coin_count in COIN_COUNTS:
+        if coin_count <= maximum_coin_count:
+            benchmark(coin_count)
+
+
+if __name__ == "__main__":
+    main()
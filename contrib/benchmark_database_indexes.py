@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Times the account-level wallet database queries with and without the secondary indexes added
+in migration 27, against a synthetic wallet.
+
+    python3 contrib/benchmark_database_indexes.py [delta_count]
+
+The default of one million transaction deltas takes a while to populate.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+CONTRIB_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(CONTRIB_PATH, ".."))
+
+from electrumsv.constants import DATABASE_EXT, KeyInstanceFlag, TxBytesEncoding, TxFlags
+from electrumsv.wallet_database import migration
+from electrumsv.wallet_database.migrations import migration_0027_secondary_indexes
+from electrumsv.wallet_database.tables import (TransactionDeltaTable, TransactionOutputTable,
+    TransactionTable)
+
+ACCOUNT_COUNT = 10
+DELTAS_PER_TRANSACTION = 2
+DELTAS_PER_KEY = 5
+
+INDEX_NAMES = [ "idx_KeyInstances_account_id", "idx_TransactionDeltas_tx_hash",
+    "idx_TransactionOutputs_keyinstance_id", "idx_Transactions_flags" ]
+
+
+def populate(db: sqlite3.Connection, delta_count: int) -> None:
+    key_count = max(delta_count // DELTAS_PER_KEY, ACCOUNT_COUNT)
+    tx_count = max(delta_count // DELTAS_PER_TRANSACTION, 1)
+    timestamp = int(time.time())
+
+    db.execute("INSERT INTO MasterKeys (masterkey_id, parent_masterkey_id, derivation_type, "
+        "derivation_data, date_created, date_updated) VALUES (1, NULL, 1, x'00', ?, ?)",
+        (timestamp, timestamp))
+    db.executemany("INSERT INTO Accounts (account_id, default_masterkey_id, default_script_type, "
+        "account_name, date_created, date_updated) VALUES (?, 1, 1, 'bench', ?, ?)",
+        [ (account_id, timestamp, timestamp) for account_id in range(1, ACCOUNT_COUNT+1) ])
+    db.executemany("INSERT INTO KeyInstances (keyinstance_id, account_id, masterkey_id, "
+        "derivation_type, derivation_data, script_type, flags, date_created, date_updated) "
+        "VALUES (?, ?, 1, 1, x'00', 1, ?, ?, ?)",
+        [ (key_id, key_id % ACCOUNT_COUNT + 1, KeyInstanceFlag.IS_ACTIVE, timestamp, timestamp)
+            for key_id in range(1, key_count+1) ])
+
+    tx_hashes = [ os.urandom(32) for i in range(tx_count) ]
+    db.executemany("INSERT INTO Transactions (tx_hash, block_height, flags, date_created, "
+        "date_updated) VALUES (?, ?, ?, ?, ?)",
+        [ (tx_hash, i, TxFlags.StateSettled | TxFlags.HasByteData, timestamp, timestamp)
+            for i, tx_hash in enumerate(tx_hashes) ])
+    # The transaction bytes are stored separately from the metadata since migration 28.
+    db.executemany("INSERT INTO TransactionBytes (tx_hash, encoding, tx_data) VALUES (?, ?, ?)",
+        [ (tx_hash, TxBytesEncoding.RAW, os.urandom(250)) for tx_hash in tx_hashes ])
+
+    rng = random.Random(1)
+    delta_rows = set()
+    while len(delta_rows) < delta_count:
+        delta_rows.add((rng.randint(1, key_count), tx_hashes[rng.randrange(tx_count)]))
+    db.executemany("INSERT INTO TransactionDeltas (keyinstance_id, tx_hash, value_delta, "
+        "date_created, date_updated) VALUES (?, ?, ?, ?, ?)",
+        [ (key_id, tx_hash, 1000, timestamp, timestamp) for key_id, tx_hash in delta_rows ])
+    db.executemany("INSERT INTO TransactionOutputs (tx_hash, tx_index, value, keyinstance_id, "
+        "flags, date_created, date_updated) VALUES (?, ?, 1000, ?, 0, ?, ?)",
+        [ (tx_hash, i, key_id, timestamp, timestamp)
+            for i, (key_id, tx_hash) in enumerate(delta_rows) ])
+
+
+def get_queries(db: sqlite3.Connection):
+    tx_hash = db.execute("SELECT tx_hash FROM Transactions LIMIT 1").fetchone()[0]
+    tx_count = db.execute("SELECT COUNT(*) FROM Transactions").fetchone()[0]
+    mask = TxFlags.STATE_MASK
+    return [
+        ("history", TransactionDeltaTable.READ_HISTORY_SQL, [1]),
+        ("key summary", TransactionDeltaTable.READ_KEY_SUMMARY_SQL, [1]),
+        ("candidate used keys", TransactionDeltaTable.READ_CANDIDATE_USED_KEYS, [1]),
+        ("deltas for transaction", TransactionDeltaTable.READ_SQL, [tx_hash]),
+        ("outputs for key", TransactionOutputTable.READ_SQL +" WHERE keyinstance_id=?", [1]),
+        ("dispatched transactions", TransactionTable.READ_METADATA_MANY_BASE_SQL +
+            " WHERE (flags&?)=?", [mask, TxFlags.StateDispatched]),
+        ("settled transactions above height", "SELECT tx_hash FROM Transactions "
+            "WHERE flags=? AND block_height>?",
+            [TxFlags.StateSettled | TxFlags.HasByteData, tx_count // 2]),
+        ("account transactions", TransactionTable.READ_METADATA_MANY_BASE_SQL +
+            " INNER JOIN AccountTransactions ATX USING(tx_hash) WHERE ATX.account_id=?", [1]),
+    ]
+
+
+def run_queries(db: sqlite3.Connection):
+    results = {}
+    for name, query, params in get_queries(db):
+        plan = [ row[3] for row in db.execute("EXPLAIN QUERY PLAN "+ query, params) ]
+        time_start = time.time()
+        db.execute(query, params).fetchall()
+        results[name] = (time.time() - time_start, plan)
+    return results
+
+
+def main() -> None:
+    delta_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    wallet_path = os.path.join(tempfile.mkdtemp(), "benchmark_wallet")
+    migration.create_database_file(wallet_path)
+    db = sqlite3.connect(wallet_path + DATABASE_EXT, isolation_level=None)
+    for index_name in INDEX_NAMES:
+        db.execute(f"DROP INDEX {index_name}")
+
+    print(f"Populating wallet with {delta_count} transaction deltas")
+    with db:
+        db.execute("begin")
+        populate(db, delta_count)
+    before = run_queries(db)
+
+    time_start = time.time()
+    with db:
+        db.execute("begin")
+        migration_0027_secondary_indexes.execute(db)
+    print(f"Migration took {time.time() - time_start:.2f} seconds")
+    after = run_queries(db)
+    db.close()
+
+    for name, (before_time, before_plan) in before.items():
+        after_time, after_plan = after[name]
+        print(f"{name}: {before_time*1000:.1f} ms -> {after_time*1000:.1f} ms")
+        print(f"  before: {'; '.join(before_plan)}")
+        print(f"  after:  {'; '.join(after_plan)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,16 +23,19 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import bisect
 from collections import defaultdict, namedtuple
+import itertools
 from math import floor, log10
-from typing import List
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 from bitcoinx import sha256
 
 from .bitcoin import COIN
 from .logs import logs
-from .transaction import Transaction, XTxOutput
+from .transaction import Transaction, TransactionSizeEstimator, XTxOutput
 from .exceptions import NotEnoughFunds
+from .types import TxoKeyType
 
 
 logger = logs.get_logger("coinchooser")
@@ -118,9 +121,10 @@ class CoinChooserBase:
         max_change = max(max(output_amounts) * 1.25, 0.02 * COIN)
 
         # Use N change outputs
+        tx_fee = tx.get_fee()
         for n in range(1, count + 1):
             # How much is left if we add this many change outputs?
-            change_amount = max(0, tx.get_fee() - fee_estimator(n))
+            change_amount = max(0, tx_fee - fee_estimator(n))
             if change_amount // n <= max_change:
                 break
 
@@ -184,14 +188,15 @@ class CoinChooserBase:
         # Copy the ouputs so when adding change we don't modify "outputs"
         tx = Transaction.from_io([], outputs)
         # Size of the transaction with no inputs and no change
-        base_size = tx.estimated_size()
+        size_estimator = TransactionSizeEstimator.from_transaction(tx)
         spent_amount = tx.output_value()
 
         def sufficient_funds(buckets):
             '''Given a list of buckets, return True if it has enough
             value to pay for the transaction'''
             total_input = sum(bucket.value for bucket in buckets)
-            total_size = sum(bucket.size for bucket in buckets) + base_size
+            total_size = size_estimator.size_with(sum(len(bucket.coins) for bucket in buckets),
+                sum(bucket.size for bucket in buckets))
             return total_input >= spent_amount + fee_estimator(total_size)
 
         # Collect the coins into buckets, choose a subset of the buckets
@@ -200,11 +205,13 @@ class CoinChooserBase:
                                       self.penalty_func(tx))
 
         tx.inputs.extend(coin for b in buckets for coin in b.coins)
-        tx_size = base_size + sum(bucket.size for bucket in buckets)
+        for bucket in buckets:
+            size_estimator.add_input(bucket.size, len(bucket.coins))
 
         # This takes a count of change outputs and returns a tx fee;
         change_output_size = change_outs[0].estimated_size()
-        fee = lambda count: fee_estimator(tx_size + count * change_output_size)
+        fee = lambda count: fee_estimator(size_estimator.size_with(output_count=count,
+            output_size=count * change_output_size))
         change, dust = self.change_outputs(tx, change_outs, fee, dust_threshold)
         tx.outputs.extend(change)
 
@@ -283,3 +290,209 @@ class CoinChooserPrivacy(CoinChooserRandom):
             return badness
 
         return penalty
+
+
+# Accounts spending at least this many coins select them with `CoinSelector`, as the work done by
+# `CoinChooserPrivacy` grows with the number of coins.
+MINIMUM_SELECTOR_COIN_COUNT = 1000
+# Up to this many changes are applied to the value index individually, more are applied in bulk.
+INDEX_BULK_CHANGE_COUNT = 1000
+
+
+class CoinValueIndex:
+    """
+    The keys of an account's coins ordered by value. Changes are applied when the index is next
+    read, so that adding or removing large numbers of coins at once, as when an account is
+    loaded, does not cost a re-sort for every coin.
+    """
+
+    def __init__(self) -> None:
+        self._entries: List[Tuple[int, TxoKeyType]] = []
+        self._added: List[Tuple[int, TxoKeyType]] = []
+        self._removed: Set[Tuple[int, TxoKeyType]] = set()
+
+    def __len__(self) -> int:
+        self._apply_changes()
+        return len(self._entries)
+
+    def add(self, value: int, key: TxoKeyType) -> None:
+        entry = (value, key)
+        # A coin that is re-added before the index is read is still present.
+        if entry in self._removed:
+            self._removed.remove(entry)
+        else:
+            self._added.append(entry)
+
+    def remove(self, value: int, key: TxoKeyType) -> None:
+        self._removed.add((value, key))
+
+    def iter_descending(self) -> Iterator[Tuple[int, TxoKeyType]]:
+        "The index must not be changed while this is being iterated over."
+        self._apply_changes()
+        return reversed(self._entries)
+
+    def _apply_changes(self) -> None:
+        entries = self._entries
+        if len(self._removed) > INDEX_BULK_CHANGE_COUNT:
+            self._entries = entries = [ e for e in entries if e not in self._removed ]
+            self._added = [ e for e in self._added if e not in self._removed ]
+        else:
+            for entry in self._removed:
+                i = bisect.bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+                else:
+                    self._added.remove(entry)
+        self._removed.clear()
+
+        if len(self._added) > INDEX_BULK_CHANGE_COUNT:
+            # Sorting merges the existing run of entries with the sorted added entries.
+            self._added.sort()
+            entries.extend(self._added)
+            entries.sort()
+        else:
+            for entry in self._added:
+                bisect.insort(entries, entry)
+        self._added.clear()
+
+
+def branch_and_bound(values: List[int], target: int, upper_bound: int,
+        max_tries: int) -> Optional[List[int]]:
+    """
+    Search for the subset of the values, which must be positive and in descending order, with
+    the smallest total that is within the target and upper bound. The search gives up after the
+    given number of steps. The indexes of the values in the subset are returned.
+    """
+    available = sum(values)
+    if available < target:
+        return None
+
+    best_selection: Optional[List[int]] = None
+    best_total = upper_bound + 1
+    selection: List[int] = []
+    total = 0
+    index = 0
+    for _i in range(max_tries):
+        backtrack = False
+        if total + available < target or total >= best_total:
+            backtrack = True
+        elif total >= target:
+            best_selection = selection.copy()
+            best_total = total
+            if total == target:
+                break
+            backtrack = True
+
+        if backtrack:
+            if not selection:
+                break
+            # Restore the values after the last included value to what is available, and take
+            # the branch that omits it.
+            index -= 1
+            while index > selection[-1]:
+                available += values[index]
+                index -= 1
+            total -= values[index]
+            selection.pop()
+        else:
+            available -= values[index]
+            # Omitting a value and then including the next one when it is the same value would
+            # only repeat the search already done.
+            if not selection or index - 1 == selection[-1] or values[index] != values[index - 1]:
+                selection.append(index)
+                total += values[index]
+        index += 1
+    return best_selection
+
+
+class CoinSelector(CoinChooserBase):
+    """
+    Selects coins from those ordered by value, doing a bounded amount of work however many coins
+    an account has. The largest coins are searched for a selection that pays for the outputs
+    without needing change, and if there is none the largest coins are accumulated until there
+    are enough of them.
+
+    Unlike `CoinChooserPrivacy`, this does not try to spend all the coins of a key together, as
+    that requires looking at every coin.
+    """
+
+    def __init__(self, max_tries: int=100000, max_search_coins: int=1000) -> None:
+        self._max_tries = max_tries
+        self._max_search_coins = max_search_coins
+
+    def select_coins(self, coins: Iterable[Any], get_input_size: Callable[[Any], int],
+            outputs: List[XTxOutput], change_output_size: int, fee_estimator: Callable[[int], int],
+            dust_threshold: int) -> List[Any]:
+        """
+        Select from the given coins, which must be in descending order of value. Only as many
+        coins are read as are needed. Raises `NotEnoughFunds` if there are not enough coins.
+        """
+        size_estimator = TransactionSizeEstimator()
+        for output in outputs:
+            size_estimator.add_output(output.estimated_size())
+        spent_amount = sum(output.value for output in outputs)
+        base_fee = fee_estimator(size_estimator.size())
+        target = spent_amount + base_fee
+
+        # The value of each coin less the fee for spending it.
+        input_fees: Dict[int, int] = {}
+        def get_effective_value(coin: Any) -> int:
+            input_size = get_input_size(coin)
+            fee = input_fees.get(input_size)
+            if fee is None:
+                fee = input_fees[input_size] = \
+                    fee_estimator(size_estimator.size() + input_size) - base_fee
+            return coin.value - fee
+
+        def sufficient_funds(selection: List[Any]) -> bool:
+            total_size = size_estimator.size_with(len(selection),
+                sum(get_input_size(coin) for coin in selection))
+            return sum(coin.value for coin in selection) >= spent_amount + \
+                fee_estimator(total_size)
+
+        coins = iter(coins)
+        candidates: List[Any] = []
+        values: List[int] = []
+        for coin in itertools.islice(coins, self._max_search_coins):
+            value = get_effective_value(coin)
+            # The remaining coins are worth less than the cost of spending them.
+            if value <= 0:
+                break
+            candidates.append(coin)
+            values.append(value)
+
+        # A selection that exceeds the target by less than this would have its change dropped
+        # as dust, or cost more to create and spend than it is worth.
+        change_fee = fee_estimator(size_estimator.size() + change_output_size) - base_fee
+        indexes = branch_and_bound(values, target, target + change_fee + dust_threshold,
+            self._max_tries)
+        if indexes is not None:
+            selection = [ candidates[i] for i in indexes ]
+            # The effective values do not account for the input count varint size.
+            if sufficient_funds(selection):
+                logger.debug("selected %d coins without change", len(selection))
+                return selection
+
+        selection = []
+        total_value = 0
+        total_input_size = 0
+        for coin in itertools.chain(candidates, coins):
+            if get_effective_value(coin) <= 0:
+                break
+            selection.append(coin)
+            total_value += coin.value
+            total_input_size += get_input_size(coin)
+            total_size = size_estimator.size_with(len(selection), total_input_size)
+            if total_value >= spent_amount + fee_estimator(total_size):
+                logger.debug("selected %d largest coins", len(selection))
+                return selection
+        raise NotEnoughFunds()
+
+    def keys(self, coins):
+        # The coins are already selected, so each is its own bucket.
+        return range(len(coins))
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+        if not sufficient_funds(buckets):
+            raise NotEnoughFunds()
+        return buckets
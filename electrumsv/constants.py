@@ -22,7 +22,7 @@ class StorageKind(IntEnum):
 
 DATABASE_EXT = ".sqlite"
 MIGRATION_FIRST = 22
-MIGRATION_CURRENT = 26
+MIGRATION_CURRENT = 28
 
 class TxFlags(IntFlag):
     Unset = 0
@@ -85,6 +85,12 @@ class TxFlags(IntFlag):
         return f"TxFlags({'|'.join(names)})"
 
 
+class TxBytesEncoding(IntEnum):
+    # How the transaction bytes are stored in the `TransactionBytes` table.
+    RAW = 0
+    ZLIB = 1
+
+
 # All these states can only be set if there is transaction data present.
 TRANSACTION_FLAGS = (TxFlags.StateSettled, TxFlags.StateDispatched, TxFlags.StateReceived,
     TxFlags.StateCleared, TxFlags.StateSigned)
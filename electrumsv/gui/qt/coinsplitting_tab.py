@@ -1,5 +1,5 @@
 import threading
-from typing import Optional
+from typing import Optional, Set
 import weakref
 
 from PyQt5.QtCore import Qt, pyqtSignal, QUrl
@@ -150,7 +150,8 @@ class CoinSplittingTab(QWidget):
         self.split_stage = STAGE_PREPARING
         self.new_transaction_cv = threading.Condition()
 
-        self._main_window._wallet.register_callback(self._on_wallet_event, ['transaction_added'])
+        self._main_window._wallet.register_callback(self._on_wallet_event,
+            ['transaction_added', 'transactions_added'])
         self.waiting_dialog = SplitWaitingDialog(self._main_window.reference(), self,
             self._split_prepare_task, on_done=self._on_split_prepare_done,
             on_cancel=self._on_split_abort)
@@ -280,23 +281,29 @@ class CoinSplittingTab(QWidget):
 
     def _on_wallet_event(self, event, *args) -> None:
         if event == 'transaction_added':
-            if self.receiving_script_template is None:
-                return
+            # args = (tx_hash, tx, involved_account_ids, external)
+            self._on_transaction_added(args[1], args[2])
+        elif event == 'transactions_added':
+            # args = ([ (tx_hash, tx, involved_account_ids), ... ], external)
+            for _tx_hash, tx, account_ids in args[0]:
+                self._on_transaction_added(tx, account_ids)
+
+    def _on_transaction_added(self, tx: Transaction, account_ids: Set[int]) -> None:
+        if self.receiving_script_template is None:
+            return
 
-            if self._account_id not in args[2]:
-                return
+        if self._account_id not in account_ids:
+            return
 
-            our_script = self.receiving_script_template.to_script_bytes()
-            # args = (tx_hash, tx, involved_account_ids, external)
-            tx: Transaction = args[1]
-            for tx_output in tx.outputs:
-                if tx_output.script_pubkey == our_script:
-                    extra_text = _("Dust from BSV faucet")
-                    self._wallet.set_transaction_label(tx.hash(), f"{TX_DESC_PREFIX}: {extra_text}")
-                    # Notify the progress dialog task thread.
-                    with self.new_transaction_cv:
-                        self.new_transaction_cv.notify()
-                    break
+        our_script = self.receiving_script_template.to_script_bytes()
+        for tx_output in tx.outputs:
+            if tx_output.script_pubkey == our_script:
+                extra_text = _("Dust from BSV faucet")
+                self._wallet.set_transaction_label(tx.hash(), f"{TX_DESC_PREFIX}: {extra_text}")
+                # Notify the progress dialog task thread.
+                with self.new_transaction_cv:
+                    self.new_transaction_cv.notify()
+                break
 
     def update_layout(self) -> None:
         if self._account is None:
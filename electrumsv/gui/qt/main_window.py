@@ -213,6 +213,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         self._wallet.register_callback(self._on_transaction_state_change,
             ['transaction_state_change'])
         self._wallet.register_callback(self._on_transaction_added, ['transaction_added'])
+        self._wallet.register_callback(self._on_transactions_added, ['transactions_added'])
         self._wallet.register_callback(self._on_transaction_deleted, ['transaction_deleted'])
 
         self.load_wallet()
@@ -320,6 +321,24 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
 
         self.transaction_added_signal.emit(tx_hash, tx, account_ids)
 
+    def _on_transactions_added(self, event_name: str,
+            transactions: List[Tuple[bytes, Transaction, Set[int]]], is_external: bool) -> None:
+        wallet_account_ids = self._wallet.get_account_ids()
+        self._logger.debug("_on_transactions_added %s %d %s", wallet_account_ids,
+            len(transactions), is_external)
+        need_update = False
+        for tx_hash, tx, account_ids in transactions:
+            if wallet_account_ids & account_ids and is_external:
+                self.tx_notifications.append(tx)
+            need_update = need_update or self._account_id in account_ids
+        if is_external and len(self.tx_notifications):
+            self.notify_transactions_signal.emit()
+        if need_update:
+            self.need_update.set()
+
+        for tx_hash, tx, account_ids in transactions:
+            self.transaction_added_signal.emit(tx_hash, tx, account_ids)
+
     def _on_transaction_deleted(self, event_name: str, account_id: int, tx_hash: bytes) -> None:
         self.transaction_deleted_signal.emit(account_id, tx_hash)
 
@@ -1619,16 +1638,22 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         maximum_txcachesize_label = QLabel()
         hits_label = QLabel()
         misses_label = QLabel()
+        unknown_avoided_label = QLabel()
+        unknown_made_label = QLabel()
 
         def update_txcachesizes():
             nonlocal current_txcachesize_label, maximum_txcachesize_label
-            nonlocal hits_label, misses_label
+            nonlocal hits_label, misses_label, unknown_avoided_label, unknown_made_label
             cache = self._wallet._transaction_cache._txdata_cache
             current_size, max_size = cache.get_sizes()
             current_txcachesize_label.setText(str(current_size))
             maximum_txcachesize_label.setText(str(max_size))
             hits_label.setText(str(cache.hits))
             misses_label.setText(str(cache.misses))
+            avoided_count, made_count = \
+                self._wallet._transaction_cache.get_missing_cache_stats()
+            unknown_avoided_label.setText(str(avoided_count))
+            unknown_made_label.setText(str(made_count))
         update_txcachesizes()
 
         memory_usage_form = FormSectionWidget(minimum_label_width=100)
@@ -1637,6 +1662,9 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
         memory_usage_form.add_row(_("Maximum usage"), maximum_txcachesize_label)
         memory_usage_form.add_row(_("Cache hits"), hits_label)
         memory_usage_form.add_row(_("Cache misses"), misses_label)
+        memory_usage_form.add_title(_("Unknown transaction lookups"))
+        memory_usage_form.add_row(_("Avoided"), unknown_avoided_label)
+        memory_usage_form.add_row(_("Made"), unknown_made_label)
         vbox.addWidget(memory_usage_form)
         vbox.addStretch(1)
         vbox.addLayout(Buttons(CloseButton(dialog)))
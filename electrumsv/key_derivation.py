@@ -0,0 +1,154 @@
+"""
+Key derivation for large numbers of keys, as needed when restoring a wallet or extending the
+gap limit. The derivation of a run of keys is split into chunks that are derived in worker
+processes, so that it scales with the available cores rather than being limited to one thread.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import threading
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+from bitcoinx import bip32_key_from_string, P2PK_Output, PublicKey, sha256
+
+from .constants import DerivationType, ScriptType
+from .keystore import Old_KeyStore, Xpub
+from .logs import logs
+from .networks import Net
+
+
+logger = logs.get_logger("key-derivation")
+
+# Fewer keys than this are derived on the calling thread, as it is faster than handing the work
+# off to other processes.
+MINIMUM_PROCESS_KEY_COUNT = 2000
+# The number of keys each worker process derives at a time.
+KEY_CHUNK_SIZE = 1000
+
+DerivableKeystoreTypes = Union[Xpub, Old_KeyStore]
+
+
+class DerivationSource(NamedTuple):
+    "The master public key of a keystore, in a form that can be passed to worker processes."
+    derivation_type: DerivationType
+    master_public_key: str
+
+
+class DerivedKeys(NamedTuple):
+    """
+    A run of derived keys in compact form. The public keys and scripts are each of a fixed size
+    for a run, so the entry for the n'th key is at `n * size` in the given bytes. The scripts and
+    script hashes are only present if a script type was given when deriving the keys.
+    """
+    public_key_size: int
+    public_keys: bytes
+    script_size: int
+    scripts: bytes
+    script_hashes: bytes
+
+    def get_public_keys(self) -> List[PublicKey]:
+        size = self.public_key_size
+        if size == 0:
+            return []
+        return [ PublicKey.from_bytes(self.public_keys[i:i+size])
+            for i in range(0, len(self.public_keys), size) ]
+
+    def get_scripts(self) -> List[bytes]:
+        size = self.script_size
+        if size == 0:
+            return []
+        return [ self.scripts[i:i+size] for i in range(0, len(self.scripts), size) ]
+
+    def get_script_hashes(self) -> List[bytes]:
+        return [ self.script_hashes[i:i+32] for i in range(0, len(self.script_hashes), 32) ]
+
+
+def get_derivation_source(keystore: DerivableKeystoreTypes) -> DerivationSource:
+    if isinstance(keystore, Old_KeyStore):
+        return DerivationSource(DerivationType.ELECTRUM_OLD, keystore.mpk)
+    assert keystore.xpub is not None
+    return DerivationSource(DerivationType.BIP32, keystore.xpub)
+
+
+def pack_derived_keys(public_keys: Sequence[PublicKey],
+        script_type: Optional[ScriptType]=None) -> DerivedKeys:
+    public_key_bytes = [ public_key.to_bytes() for public_key in public_keys ]
+    script_bytes: List[bytes] = []
+    if script_type == ScriptType.P2PKH:
+        script_bytes = [ public_key.to_address(coin=Net.COIN).to_script_bytes()
+            for public_key in public_keys ]
+    elif script_type == ScriptType.P2PK:
+        script_bytes = [ P2PK_Output(public_key, Net.COIN).to_script_bytes()
+            for public_key in public_keys ]
+    else:
+        assert script_type is None, f"unsupported script type {script_type}"
+    return DerivedKeys(len(public_key_bytes[0]) if public_key_bytes else 0,
+        b''.join(public_key_bytes), len(script_bytes[0]) if script_bytes else 0,
+        b''.join(script_bytes), b''.join(sha256(script) for script in script_bytes))
+
+
+def derive_keys(source: DerivationSource, parent_path: Sequence[int], indexes: Sequence[int],
+        script_type: Optional[ScriptType]=None) -> DerivedKeys:
+    "Derive the given child keys of the parent path. This is run in the worker processes."
+    public_keys: List[PublicKey]
+    if source.derivation_type == DerivationType.ELECTRUM_OLD:
+        public_keys = Old_KeyStore.get_pubkeys_from_mpk(source.master_public_key, parent_path,
+            indexes)
+    else:
+        node = bip32_key_from_string(source.master_public_key)
+        for n in parent_path:
+            node = node.child_safe(n)
+        public_keys = [ node.child_safe(n) for n in indexes ]
+    return pack_derived_keys(public_keys, script_type)
+
+
+def join_derived_keys(runs: Sequence[DerivedKeys]) -> DerivedKeys:
+    return DerivedKeys(runs[0].public_key_size, b''.join(r.public_keys for r in runs),
+        runs[0].script_size, b''.join(r.scripts for r in runs),
+        b''.join(r.script_hashes for r in runs))
+
+
+class KeyDerivationEngine:
+    """
+    Derives runs of keys, using a pool of worker processes for larger runs. The pool is only
+    started when first needed, and its workers are spawned rather than forked, as forking a
+    process with other running threads can leave the locks those threads hold unreleasable.
+    """
+
+    def __init__(self, max_workers: Optional[int]=None) -> None:
+        self._max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self._max_workers,
+                    mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def derive_keys(self, keystore: DerivableKeystoreTypes, parent_path: Sequence[int],
+            indexes: Sequence[int], script_type: Optional[ScriptType]=None) -> DerivedKeys:
+        """
+        Derive the given child keys of the parent path, and the scripts for them if a script type
+        is given. The results are in the same order as the indexes.
+        """
+        if len(indexes) < MINIMUM_PROCESS_KEY_COUNT:
+            # The keystore keeps the parsed parent nodes, so this is the fastest way to derive
+            # any keys it has derived the parent of before.
+            return pack_derived_keys(keystore.derive_pubkeys(parent_path, indexes), script_type)
+
+        source = get_derivation_source(keystore)
+        parent_path = tuple(parent_path)
+        chunks = [ list(indexes[i:i+KEY_CHUNK_SIZE])
+            for i in range(0, len(indexes), KEY_CHUNK_SIZE) ]
+        logger.debug("deriving %d keys in %d chunks", len(indexes), len(chunks))
+        runs = self._get_executor().map(derive_keys, itertools.repeat(source),
+            itertools.repeat(parent_path), chunks, itertools.repeat(script_type))
+        return join_derived_keys(list(runs))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
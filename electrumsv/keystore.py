@@ -22,9 +22,10 @@
 # SOFTWARE.
 
 from collections import defaultdict
+from functools import lru_cache
 import hashlib
 import json
-from typing import Any, cast, Dict, List, Optional, Sequence, Tuple, Union
+from typing import Any, cast, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from unicodedata import normalize
 
 from bitcoinx import (
@@ -42,12 +43,19 @@ from .exceptions import InvalidPassword, OverloadedMultisigKeystore, Incompatibl
 from .logs import logs
 from .mnemonic import Mnemonic, load_wordlist
 from .networks import Net
+from .signing import SigningEngine
 from .transaction import Transaction, XPublicKey, XPublicKeyType
 from .wallet_database.tables import KeyInstanceRow, MasterKeyRow
 
 
 logger = logs.get_logger("keystore")
 
+
+@lru_cache(maxsize=64)
+def _parse_xpub(xpub: str) -> BIP32PublicKey:
+    return bip32_key_from_string(xpub)
+
+
 class KeyStore:
     derivation_type = DerivationType.NONE
     label: Optional[str] = None
@@ -137,6 +145,46 @@ class KeyStore:
         raise NotImplementedError
 
 
+class SigningSession:
+    """
+    Signing with a software keystore, where the password is checked and the key data decrypted
+    once for any number of inputs and transactions. The keystore keeps what it decrypts or
+    derives for the session in `secrets`, and all of it is discarded when the session is closed.
+    Python gives no way to overwrite the memory of the immutable values involved, so discarding
+    them is the best that can be done.
+    """
+
+    def __init__(self, keystore: 'Software_KeyStore', password: str) -> None:
+        # Raise if password is not correct.
+        keystore.check_password(password)
+        self._keystore = keystore
+        self.password: Optional[str] = password
+        self.secrets: Dict[Any, Any] = {}
+        self._private_keys: Dict[XPublicKey, Tuple[bytes, bool]] = {}
+
+    def __enter__(self) -> 'SigningSession':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def is_closed(self) -> bool:
+        return self.password is None
+
+    def close(self) -> None:
+        self.password = None
+        self.secrets.clear()
+        self._private_keys.clear()
+
+    def get_private_key_from_xpubkey(self, x_pubkey: XPublicKey) -> Tuple[bytes, bool]:
+        assert self.password is not None, "signing session is closed"
+        private_key = self._private_keys.get(x_pubkey)
+        if private_key is None:
+            private_key = self._keystore.get_session_private_key(self, x_pubkey)
+            self._private_keys[x_pubkey] = private_key
+        return private_key
+
+
 class Software_KeyStore(KeyStore):
     def __init__(self, row: Optional[MasterKeyRow]=None) -> None:
         KeyStore.__init__(self, row)
@@ -157,20 +205,32 @@ class Software_KeyStore(KeyStore):
     def check_password(self, password: Optional[str]) -> None:
         raise NotImplementedError
 
-    def sign_transaction(self, tx: Transaction, password: str) -> None:
+    def create_signing_session(self, password: str) -> SigningSession:
+        "Raises `InvalidPassword` if the password is not correct."
+        return SigningSession(self, password)
+
+    def get_session_private_key(self, session: SigningSession,
+            x_pubkey: XPublicKey) -> Tuple[bytes, bool]:
+        return self.get_private_key_from_xpubkey(x_pubkey, cast(str, session.password))
+
+    def sign_transaction(self, tx: Transaction, password: str,
+            session: Optional[SigningSession]=None, engine: Optional[SigningEngine]=None) -> None:
         if self.is_watching_only():
             return
-        # Raise if password is not correct.
-        self.check_password(password)
+        if session is None:
+            with self.create_signing_session(password) as session:
+                self.sign_transaction(tx, password, session, engine)
+            return
+
         # Add private keys
         keypairs: Dict[XPublicKey, Tuple[bytes, bool]] = {}
         for txin in tx.inputs:
             for x_pubkey in txin.unused_x_pubkeys():
-                if self.is_signature_candidate(x_pubkey):
-                    keypairs[x_pubkey] = self.get_private_key_from_xpubkey(x_pubkey, password)
+                if x_pubkey not in keypairs and self.is_signature_candidate(x_pubkey):
+                    keypairs[x_pubkey] = session.get_private_key_from_xpubkey(x_pubkey)
         # Sign
         if keypairs:
-            tx.sign(keypairs)
+            tx.sign(keypairs, engine)
 
 
 class Imported_KeyStore(Software_KeyStore):
@@ -359,7 +419,10 @@ class DerivablePaths:
 class Xpub(DerivablePaths):
     def __init__(self) -> None:
         self.xpub: Optional[str] = None
-        self._child_xpubs: Dict[Sequence[int], str] = {}
+        # The parsed nodes for each parent path keys are derived from. Parsing the extended key
+        # string and deriving the intermediate nodes is most of the cost of deriving a key.
+        self._child_nodes: Dict[Sequence[int], BIP32PublicKey] = {}
+        self._child_nodes_xpub: Optional[str] = None
 
     def get_master_public_key(self) -> Optional[str]:
         return self.xpub
@@ -367,20 +430,32 @@ class Xpub(DerivablePaths):
     def get_fingerprint(self) -> bytes:
         return bip32_key_from_string(self.xpub).fingerprint()
 
+    def _get_child_node(self, parent_path: Sequence[int]) -> BIP32PublicKey:
+        parent_path = tuple(parent_path)
+        if self._child_nodes_xpub != self.xpub:
+            self._child_nodes = {}
+            self._child_nodes_xpub = self.xpub
+        node = self._child_nodes.get(parent_path)
+        if node is None:
+            if len(parent_path):
+                node = self._get_child_node(parent_path[:-1]).child_safe(parent_path[-1])
+            else:
+                node = bip32_key_from_string(self.xpub)
+            self._child_nodes[parent_path] = node
+        return node
+
     def derive_pubkey(self, derivation_path: Sequence[int]) -> PublicKey:
-        parent_path = derivation_path[:-1]
-        xpub = self._child_xpubs.get(parent_path)
-        if xpub is None:
-            xpubkey = bip32_key_from_string(self.xpub)
-            for n in parent_path:
-                xpubkey = xpubkey.child_safe(n)
-            xpub = xpubkey.to_extended_key_string()
-            self._child_xpubs[parent_path] = xpub
-        return self.get_pubkey_from_xpub(xpub, derivation_path[-1:])
+        return self._get_child_node(derivation_path[:-1]).child_safe(derivation_path[-1])
+
+    def derive_pubkeys(self, parent_path: Sequence[int], indexes: Iterable[int]) \
+            -> List[PublicKey]:
+        "The public keys for the given child indexes of the parent path, in the same order."
+        node = self._get_child_node(parent_path)
+        return [ node.child_safe(n) for n in indexes ]
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub: str, sequence: Sequence[int]) -> PublicKey:
-        pubkey = bip32_key_from_string(xpub)
+        pubkey = _parse_xpub(xpub)
         for n in sequence:
             pubkey = pubkey.child_safe(n)
         return pubkey
@@ -484,6 +559,26 @@ class BIP32_KeyStore(Deterministic_KeyStore, Xpub):
         derivation_path = x_pubkey.derivation_path()
         return self.get_private_key(derivation_path, password)
 
+    def get_session_private_key(self, session: SigningSession,
+            x_pubkey: XPublicKey) -> Tuple[bytes, bool]:
+        derivation_path = x_pubkey.derivation_path()
+        node = self._get_session_node(session, tuple(derivation_path[:-1]))
+        return node.child_safe(derivation_path[-1]).to_bytes(), True
+
+    def _get_session_node(self, session: SigningSession,
+            parent_path: Tuple[int, ...]) -> BIP32PrivateKey:
+        # The master private key and the intermediate nodes are decrypted and derived once.
+        node = session.secrets.get(parent_path)
+        if node is None:
+            if len(parent_path):
+                node = self._get_session_node(session, parent_path[:-1]).child_safe(
+                    parent_path[-1])
+            else:
+                node = bip32_key_from_string(
+                    self.get_master_private_key(cast(str, session.password)))
+            session.secrets[parent_path] = node
+        return node
+
     # If we do not do this it falls through to the the base KeyStore method, not Xpub.
     def is_signature_candidate(self, x_pubkey: XPublicKey) -> bool:
         return Xpub.is_signature_candidate(self, x_pubkey)
@@ -592,6 +687,22 @@ class Old_KeyStore(DerivablePaths, Deterministic_KeyStore):
         assert len(derivation_path) == 2
         return self.get_pubkey_from_mpk(self.mpk, derivation_path)
 
+    def derive_pubkeys(self, parent_path: Sequence[int], indexes: Iterable[int]) \
+            -> List[PublicKey]:
+        "The public keys for the given child indexes of the parent path, in the same order."
+        return self.get_pubkeys_from_mpk(self.mpk, parent_path, indexes)
+
+    @classmethod
+    def get_pubkeys_from_mpk(cls, mpk: str, parent_path: Sequence[int],
+            indexes: Iterable[int]) -> List[PublicKey]:
+        assert len(parent_path) == 1
+        master_public_key = cls._mpk_to_PublicKey(mpk)
+        public_keys: List[PublicKey] = []
+        for n in indexes:
+            z = cls.get_sequence(mpk, (parent_path[0], n))
+            public_keys.append(master_public_key.add(int_to_be_bytes(z, 32)))
+        return public_keys
+
     def get_private_key_from_stretched_exponent(self, derivation_path: Sequence[int],
             secexp) -> bytes:
         assert len(derivation_path) == 2
@@ -614,6 +725,17 @@ class Old_KeyStore(DerivablePaths, Deterministic_KeyStore):
         assert self.mpk == mpk.hex()
         return self.get_private_key(path, password)
 
+    def get_session_private_key(self, session: SigningSession,
+            x_pubkey: XPublicKey) -> Tuple[bytes, bool]:
+        mpk, path = x_pubkey.old_keystore_mpk_and_path()
+        assert self.mpk == mpk.hex()
+        # Stretching the seed is by design the most expensive part of getting a private key.
+        secexp = session.secrets.get("secexp")
+        if secexp is None:
+            secexp = self.stretch_key(self._get_hex_seed_bytes(session.password))
+            session.secrets["secexp"] = secexp
+        return self.get_private_key_from_stretched_exponent(path, secexp), False
+
     def check_seed(self, seed) -> None:
         secexp = self.stretch_key(seed)
         master_private_key = PrivateKey(int_to_be_bytes(secexp, 32))
@@ -31,7 +31,7 @@ import re
 import ssl
 import stat
 import time
-from typing import Any, Dict, List, Optional, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 
 import certifi
 from aiorpcx import (
@@ -45,7 +45,6 @@ from bitcoinx import (
 )
 
 from .app_state import app_state
-from .bitcoin import scripthash_hex
 from .constants import TxFlags
 from .i18n import _
 from .logs import logs
@@ -63,6 +62,7 @@ logger = logs.get_logger("network")
 HEADER_SIZE = 80
 ONE_MINUTE = 60
 ONE_DAY = 24 * 3600
+TRANSACTION_BATCH_SIZE = 500
 HEADERS_SUBSCRIBE = 'blockchain.headers.subscribe'
 REQUEST_MERKLE_PROOF = 'blockchain.transaction.get_merkle'
 SCRIPTHASH_HISTORY = 'blockchain.scripthash.get_history'
@@ -123,10 +123,11 @@ def _require_string(obj):
     return obj
 
 
-def _history_status(history) -> Optional[str]:
+def _history_status(history: List[Tuple[bytes, int]]) -> Optional[str]:
     if not history:
         return None
-    status = ''.join(f'{tx_id}:{tx_height}:' for tx_id, tx_height in history)
+    status = ''.join(f'{hash_to_hex_str(tx_hash)}:{tx_height}:'
+        for tx_hash, tx_height in history)
     return sha256(status.encode()).hex()
 
 
@@ -624,12 +625,14 @@ class SVSession(RPCSession):
         result = await self.request_history(script_hash)
         self.logger.debug(f'received history of {keyinstance_id} length {len(result)}')
         try:
-            history = [(item['tx_hash'], item['height']) for item in result]
-            tx_fees = {item['tx_hash']: item['fee'] for item in result if 'fee' in item}
+            # The wallet works with transaction hashes, the hex ids are only used by the server.
+            history = [(hex_str_to_hash(item['tx_hash']), item['height']) for item in result]
+            tx_fees = {tx_hash: item['fee'] for (tx_hash, _height), item in zip(history, result)
+                if 'fee' in item}
             # Check that txids are unique
             assert len(set(tx_hash for tx_hash, tx_height in history)) == len(history), \
                 f'server history for {keyinstance_id} has duplicate transactions'
-        except (AssertionError, KeyError) as e:
+        except (AssertionError, KeyError, ValueError) as e:
             self._network._on_status_queue.put_nowait((script_hash, status))  # re-queue
             raise DisconnectSessionError(f'bad history returned: {e}')
 
@@ -1116,6 +1119,9 @@ class Network(TriggeredCallbacks):
         had_timeout = False
         session = await self._main_session()
         session.logger.debug(f'requesting {len(missing_hashes)} missing transactions')
+        # The received transactions are added to the wallet in batches, as the per-transaction
+        # overhead dominates when restoring wallets with many transactions.
+        received_transactions: List[Tuple[bytes, Transaction, TxFlags]] = []
         async with TaskGroup() as group:
             tasks = {}
             for tx_hash in missing_hashes:
@@ -1138,8 +1144,18 @@ class Network(TriggeredCallbacks):
                     logger.exception(e)
                     logger.error(f'fetching transaction {tx_id}: {e}')
                 else:
-                    wallet.add_transaction(tx_hash, tx, TxFlags.StateCleared | TxFlags.HasByteData,
-                        True)
+                    received_transactions.append((tx_hash, tx,
+                        TxFlags.StateCleared | TxFlags.HasByteData))
+
+                if len(received_transactions) >= TRANSACTION_BATCH_SIZE or \
+                        len(received_transactions) and not tasks:
+                    try:
+                        await wallet.add_transactions_async(received_transactions, True)
+                    except Exception:
+                        # A failure to add a batch should not cancel the outstanding requests.
+                        logger.exception("adding %d received transactions",
+                            len(received_transactions))
+                    received_transactions = []
         return had_timeout
 
     def _available_servers(self, protocol):
@@ -1241,8 +1257,8 @@ class Network(TriggeredCallbacks):
         while True:
             session.logger.info(f'subscribing to {len(additional_keys):,d} new keys for {account}')
             # Do in reverse to require fewer account re-sync loops
-            pairs = [ (k, script_type, scripthash_hex(script)) for k in additional_keys
-                for script_type, script in account.get_possible_scripts_for_id(k) ]
+            pairs = [ (k, script_type, hash_to_hex_str(script_hash)) for k in additional_keys
+                for script_type, script_hash in account.get_possible_script_hashes_for_id(k) ]
             pairs.reverse()
             await session.subscribe_to_triples(account, pairs)
             additional_keys = await account.new_activated_keys()
@@ -1255,8 +1271,8 @@ class Network(TriggeredCallbacks):
             session = await self._main_session()
             session.logger.info(f'unsubscribing from {len(keys):,d} '+
                 f'deactivated keys for {account}')
-            pairs = [ (k, script_type, scripthash_hex(script)) for k in keys
-                for script_type, script in account.get_possible_scripts_for_id(k) ]
+            pairs = [ (k, script_type, hash_to_hex_str(script_hash)) for k in keys
+                for script_type, script_hash in account.get_possible_script_hashes_for_id(k) ]
             await session.unsubscribe_from_pairs(account, pairs)
 
     async def _maintain_wallet(self, wallet: 'Wallet') -> None:
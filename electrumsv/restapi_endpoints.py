@@ -1,5 +1,5 @@
 """This is designed with extensibility in mind - see examples/applications/restapi. """
-from typing import Dict, List
+from typing import Any, Dict, List
 
 from aiohttp import web
 
@@ -52,7 +52,13 @@ class DefaultEndpoints(HandlerUtils):
 
     async def status(self, request):
         return good_response({"status": "success",
-                              "network": f"{get_network_type()}"})
+                              "network": f"{get_network_type()}",
+                              "database": self._get_database_stats()})
+
+    def _get_database_stats(self) -> Dict[str, Any]:
+        """The write queue metrics for each loaded wallet's database, keyed by wallet name."""
+        return { wallet.name(): wallet.get_db_context().get_stats()
+            for wallet in list(self.app_state.daemon.wallets.values()) }
 
     async def ping(self, request):
         return good_response({"value": "pong"})
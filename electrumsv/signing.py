@@ -0,0 +1,77 @@
+"""
+Signing for transactions with large numbers of inputs, like payout batches. The signature hashes
+are calculated by the caller, and signing them is split into chunks that are signed in worker
+processes, so that it scales with the available cores rather than being limited to one thread.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import threading
+from typing import List, Optional, Sequence
+
+from bitcoinx import pack_byte, PrivateKey
+
+from .logs import logs
+
+
+logger = logs.get_logger("signing")
+
+# Fewer signatures than this are made on the calling thread, as it is faster than handing the work
+# off to other processes.
+MINIMUM_PROCESS_SIGNATURE_COUNT = 1000
+# The number of signatures each worker process makes at a time.
+SIGNATURE_CHUNK_SIZE = 250
+
+
+def sign_hashes(private_keys: Sequence[bytes], hashes: Sequence[bytes],
+        hash_type: int) -> List[bytes]:
+    """
+    Sign each signature hash with the private key at the same position, and return the DER
+    signatures with the hash type appended. This is run in the worker processes.
+    """
+    assert len(private_keys) == len(hashes)
+    hash_type_byte = pack_byte(hash_type)
+    return [ PrivateKey(private_key).sign(sighash, None) + hash_type_byte
+        for private_key, sighash in zip(private_keys, hashes) ]
+
+
+class SigningEngine:
+    """
+    Signs runs of signature hashes, using a pool of worker processes for larger runs. The pool is
+    only started when first needed, and its workers are spawned rather than forked, as forking a
+    process with other running threads can leave the locks those threads hold unreleasable.
+    """
+
+    def __init__(self, max_workers: Optional[int]=None) -> None:
+        self._max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self._max_workers,
+                    mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def sign_hashes(self, private_keys: Sequence[bytes], hashes: Sequence[bytes],
+            hash_type: int) -> List[bytes]:
+        "The signatures are in the same order as the signature hashes."
+        assert len(private_keys) == len(hashes)
+        if len(hashes) < MINIMUM_PROCESS_SIGNATURE_COUNT:
+            return sign_hashes(private_keys, hashes, hash_type)
+
+        key_chunks = [ private_keys[i:i+SIGNATURE_CHUNK_SIZE]
+            for i in range(0, len(private_keys), SIGNATURE_CHUNK_SIZE) ]
+        hash_chunks = [ hashes[i:i+SIGNATURE_CHUNK_SIZE]
+            for i in range(0, len(hashes), SIGNATURE_CHUNK_SIZE) ]
+        logger.debug("making %d signatures in %d chunks", len(hashes), len(hash_chunks))
+        runs = self._get_executor().map(sign_hashes, key_chunks, hash_chunks,
+            itertools.repeat(hash_type))
+        return list(itertools.chain.from_iterable(runs))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -43,6 +43,7 @@ import zlib
 from bitcoinx import DecryptionError, hash_to_hex_str, hex_str_to_hash, PrivateKey, PublicKey
 from bitcoinx.address import P2PKH_Address, P2SH_Address
 
+from .app_state import app_state
 from .bitcoin import is_address_valid, address_from_string
 from .constants import (CHANGE_SUBPATH, DATABASE_EXT, DerivationType, MIGRATION_CURRENT,
     MIGRATION_FIRST, RECEIVING_SUBPATH, ScriptType, StorageKind, TxFlags, TransactionOutputFlag,
@@ -55,8 +56,8 @@ from .logs import logs
 from .networks import Net
 from .transaction import Transaction, classify_tx_output, parse_script_sig
 from .wallet_database import (AccountTable, TxData, DatabaseContext, migration,
-    KeyInstanceTable, MasterKeyTable, PaymentRequestTable, TransactionDeltaTable,
-    TransactionOutputTable, TransactionTable, WalletDataTable)
+    KeyInstanceTable, MasterKeyTable, PaymentRequestTable, SqliteConnectionProfile,
+    TransactionDeltaTable, TransactionOutputTable, TransactionTable, WalletDataTable)
 from .wallet_database.tables import (AccountRow, KeyInstanceRow, MasterKeyRow,
     PaymentRequestRow, TransactionDeltaRow, TransactionOutputRow, TransactionRow,
     WalletDataRow)
@@ -286,7 +287,15 @@ class DatabaseStore(AbstractStore):
     def open_database(self) -> None:
         # This table is unencrypted. If anything is to be encrypted in it, it is encrypted
         # manually before storage.
-        self._db_context = DatabaseContext(self._path)
+        profile: Optional[SqliteConnectionProfile] = None
+        write_queue_size: Optional[int] = None
+        # There is no application config when the storage is used outside of the application.
+        config = getattr(app_state, "config", None)
+        if config is not None:
+            profile = SqliteConnectionProfile.from_config(config)
+            write_queue_size = max(0, int(config.get("sqlite_write_queue_size",
+                DatabaseContext.WRITE_QUEUE_SIZE)))
+        self._db_context = DatabaseContext(self._path, write_queue_size, profile)
         self._table = WalletDataTable(self._db_context)
 
     def close_database(self) -> None:
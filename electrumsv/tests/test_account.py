@@ -6,7 +6,8 @@ from bitcoinx import Script
 from electrumsv.app_state import app_state
 from electrumsv.bitcoin import ScriptTemplate
 from electrumsv.constants import DerivationType, KeyInstanceFlag, ScriptType, TransactionOutputFlag
-from electrumsv.wallet import AbstractAccount
+from electrumsv.wallet import AbstractAccount, AccountHistory
+from electrumsv.wallet_database import TxData
 from electrumsv.wallet_database.tables import AccountRow, KeyInstanceRow, TransactionOutputRow
 
 
@@ -14,6 +15,9 @@ class CustomAccount(AbstractAccount):
     def _load_sync_state(self) -> None:
         pass
 
+    def _load_history(self) -> None:
+        self._history = AccountHistory()
+
     def get_script_template_for_id(self, keyinstance_id: int,
             script_type: Optional[ScriptType]=None) -> ScriptTemplate:
         return MockScriptTemplate()
@@ -35,12 +39,19 @@ class MockScriptTemplate:
 class MockWallet:
     def __init__(self) -> None:
         self._transaction_cache = unittest.mock.Mock()
+        self._transaction_cache.get_metadata.return_value = TxData(height=1, date_added=1)
         self._db_context = unittest.mock.Mock()
         self._storage = unittest.mock.Mock()
 
     def name(self) -> str:
         return "MockWallet.name"
 
+    def add_key_script_routes(self, account, keyinstance_ids) -> None:
+        pass
+
+    def remove_key_script_routes(self, account_id, keyinstance_ids) -> None:
+        pass
+
 
 class MockAppState(object):
     async_ = None
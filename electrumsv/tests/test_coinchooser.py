@@ -0,0 +1,107 @@
+from typing import List, NamedTuple
+
+from bitcoinx import Script
+import pytest
+
+from electrumsv import coinchooser
+from electrumsv.coinchooser import branch_and_bound, CoinSelector, CoinValueIndex
+from electrumsv.exceptions import NotEnoughFunds
+from electrumsv.transaction import XTxOutput
+from electrumsv.types import TxoKeyType
+
+
+OUTPUT_SCRIPT = Script(bytes.fromhex("76a914") + bytes(20) + bytes.fromhex("88ac"))
+INPUT_SIZE = 148
+DUST_THRESHOLD = 546
+
+
+class MockCoin(NamedTuple):
+    value: int
+    index: int
+
+
+def _key(n: int) -> TxoKeyType:
+    return TxoKeyType(bytes(32), n)
+
+
+def _fee_estimator(size: int) -> int:
+    return size
+
+
+def _select(values: List[int], amount: int, **kwargs) -> List[MockCoin]:
+    coins = sorted((MockCoin(value, i) for i, value in enumerate(values)), reverse=True)
+    return CoinSelector(**kwargs).select_coins(coins, lambda coin: INPUT_SIZE,
+        [ XTxOutput(amount, OUTPUT_SCRIPT) ], 34, _fee_estimator, DUST_THRESHOLD)
+
+
+@pytest.mark.parametrize("bulk", (False, True))
+def test_value_index(bulk, monkeypatch) -> None:
+    if bulk:
+        monkeypatch.setattr(coinchooser, "INDEX_BULK_CHANGE_COUNT", 0)
+    index = CoinValueIndex()
+    for n, value in enumerate([ 500, 100, 300, 100 ]):
+        index.add(value, _key(n))
+    assert [ (500, _key(0)), (300, _key(2)), (100, _key(3)), (100, _key(1)) ] == \
+        list(index.iter_descending())
+
+    # Changes made before the index is read again are applied together.
+    index.remove(300, _key(2))
+    index.add(200, _key(4))
+    index.remove(200, _key(4))
+    index.remove(500, _key(0))
+    index.add(500, _key(0))
+    assert [ (500, _key(0)), (100, _key(3)), (100, _key(1)) ] == list(index.iter_descending())
+    assert 3 == len(index)
+
+
+def test_branch_and_bound() -> None:
+    values = [ 90, 50, 40, 30, 20, 10 ]
+    # The exact match is found, rather than the first selection that is sufficient.
+    assert [ 1, 4 ] == branch_and_bound(values, 70, 75, 1000)
+    assert [ 0 ] == branch_and_bound(values, 85, 95, 1000)
+    assert branch_and_bound(values, 300, 310, 1000) is None
+    # The smallest total over the target is accepted where no exact match exists.
+    assert 100 == sum(values[i] for i in branch_and_bound(values, 93, 110, 1000))
+    assert branch_and_bound(values, 93, 96, 1000) is None
+    # The search is abandoned after the given number of tries.
+    assert [ 20 ] == branch_and_bound([ 7 ] * 20 + [ 5 ], 5, 5, 1000)
+    assert branch_and_bound([ 7 ] * 20 + [ 5 ], 5, 5, 10) is None
+
+
+def test_select_coins_without_change() -> None:
+    fee = 10 + 34 + INPUT_SIZE * 2
+    values = [ 100000, 50000 + INPUT_SIZE, 30000 + INPUT_SIZE, 2000 ]
+    selection = _select(values, 80000 - fee + 2 * INPUT_SIZE)
+    assert [ 1, 2 ] == sorted(coin.index for coin in selection)
+
+
+def test_select_coins_accumulates_largest() -> None:
+    values = [ 1000 ] * 50 + [ 5000 ] * 3
+    selection = _select(values, 20000, max_search_coins=10, max_tries=100)
+    # The three largest coins and enough of the smaller coins to cover the fees.
+    assert 5000 == selection[2].value and 1000 == selection[3].value
+    total_value = sum(coin.value for coin in selection)
+    total_size = 10 + 34 + INPUT_SIZE * len(selection)
+    assert total_value >= 20000 + _fee_estimator(total_size)
+    assert total_value - 1000 < 20000 + _fee_estimator(total_size - INPUT_SIZE)
+
+
+def test_select_coins_not_enough_funds() -> None:
+    with pytest.raises(NotEnoughFunds):
+        _select([ 1000, 2000 ], 5000)
+    # Coins that are worth less than the fee to spend them are never selected.
+    with pytest.raises(NotEnoughFunds):
+        _select([ 10000 ] + [ 100 ] * 1000, 10000)
+
+
+def test_select_coins_reads_only_needed_coins() -> None:
+    consumed = []
+    def coins():
+        for n in range(100000):
+            consumed.append(n)
+            yield MockCoin(100000 - n, n)
+    selection = CoinSelector(max_search_coins=20).select_coins(coins(),
+        lambda coin: INPUT_SIZE, [ XTxOutput(150000, OUTPUT_SCRIPT) ], 34, _fee_estimator,
+        DUST_THRESHOLD)
+    assert 2 == len(selection)
+    assert 20 == len(consumed)
@@ -0,0 +1,69 @@
+from bitcoinx import P2PK_Output, sha256
+import pytest
+
+from electrumsv import key_derivation
+from electrumsv.constants import DerivationType, ScriptType
+from electrumsv.key_derivation import (derive_keys, DerivationSource, get_derivation_source,
+    KeyDerivationEngine)
+from electrumsv.keystore import BIP32_KeyStore, Old_KeyStore
+from electrumsv.networks import Net
+
+
+XPUB = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+    'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+
+
+def test_derive_keys_bip32() -> None:
+    keystore = BIP32_KeyStore({'xpub': XPUB})
+    source = get_derivation_source(keystore)
+    assert DerivationSource(DerivationType.BIP32, XPUB) == source
+
+    derived_keys = derive_keys(source, (1,), [ 4, 2, 9 ], ScriptType.P2PKH)
+    public_keys = [ keystore.derive_pubkey((1, n)) for n in (4, 2, 9) ]
+    scripts = [ public_key.to_address(coin=Net.COIN).to_script_bytes()
+        for public_key in public_keys ]
+    assert 33 == derived_keys.public_key_size
+    assert public_keys == derived_keys.get_public_keys()
+    assert scripts == derived_keys.get_scripts()
+    assert [ sha256(script) for script in scripts ] == derived_keys.get_script_hashes()
+
+
+def test_derive_keys_old() -> None:
+    keystore = Old_KeyStore.from_seed('ee6ea9eceaf649640051a4c305ac5c59')
+    derived_keys = derive_keys(get_derivation_source(keystore), (0,), range(3), ScriptType.P2PK)
+    public_keys = [ keystore.derive_pubkey((0, n)) for n in range(3) ]
+    assert 65 == derived_keys.public_key_size
+    assert public_keys == derived_keys.get_public_keys()
+    assert not any(public_key.is_compressed() for public_key in derived_keys.get_public_keys())
+    assert [ P2PK_Output(public_key, Net.COIN).to_script_bytes()
+        for public_key in public_keys ] == derived_keys.get_scripts()
+
+
+def test_derive_keys_without_scripts() -> None:
+    derived_keys = derive_keys(DerivationSource(DerivationType.BIP32, XPUB), (0,), range(2))
+    assert 2 == len(derived_keys.get_public_keys())
+    assert [] == derived_keys.get_scripts()
+    assert [] == derived_keys.get_script_hashes()
+    with pytest.raises(AssertionError):
+        derive_keys(DerivationSource(DerivationType.BIP32, XPUB), (0,), range(2),
+            ScriptType.MULTISIG_P2SH)
+
+
+def test_engine_derives_in_chunks(monkeypatch) -> None:
+    keystore = BIP32_KeyStore({'xpub': XPUB})
+    indexes = list(range(5, 30))
+    expected_keys = derive_keys(get_derivation_source(keystore), (0,), indexes, ScriptType.P2PKH)
+
+    engine = KeyDerivationEngine(max_workers=2)
+    try:
+        # Small runs are derived on the calling thread.
+        assert expected_keys == engine.derive_keys(keystore, (0,), indexes, ScriptType.P2PKH)
+        assert engine._executor is None
+
+        monkeypatch.setattr(key_derivation, "MINIMUM_PROCESS_KEY_COUNT", 10)
+        monkeypatch.setattr(key_derivation, "KEY_CHUNK_SIZE", 7)
+        assert expected_keys == engine.derive_keys(keystore, (0,), indexes, ScriptType.P2PKH)
+        assert engine._executor is not None
+    finally:
+        engine.shutdown()
+    assert engine._executor is None
@@ -1,13 +1,14 @@
 import pytest
 
-from bitcoinx import PublicKey, PrivateKey
+from bitcoinx import BIP32PrivateKey, PublicKey, PrivateKey
 
 from electrumsv.exceptions import InvalidPassword, IncompatibleWalletError
 from electrumsv.keystore import (
-    Imported_KeyStore, Old_KeyStore, BIP32_KeyStore, from_bip39_seed,
+    Imported_KeyStore, Old_KeyStore, BIP32_KeyStore, from_bip39_seed, Xpub,
     from_master_key, from_seed
 )
-from electrumsv.crypto import pw_encode
+from electrumsv import keystore as keystore_module
+from electrumsv.crypto import pw_decode, pw_encode
 from electrumsv.networks import Net, SVMainnet, SVTestnet
 from electrumsv.transaction import XPublicKey
 
@@ -41,6 +42,11 @@ class TestOld_KeyStore:
         pubkey = Old_KeyStore.get_pubkey_from_mpk(*args)
         assert pubkey.to_hex() == pubkey_hex
 
+    def test_derive_pubkeys(self):
+        keystore = Old_KeyStore.from_seed('ee6ea9eceaf649640051a4c305ac5c59')
+        assert keystore.derive_pubkeys((1,), [ 5, 2 ]) == [ keystore.derive_pubkey((1, 5)),
+            keystore.derive_pubkey((1, 2)) ]
+
     def test_get_seed(self):
         seed = 'ee6ea9eceaf649640051a4c305ac5c59'
         keystore = Old_KeyStore.from_seed(seed)
@@ -58,6 +64,30 @@ class TestOld_KeyStore:
         assert result == (bytes.fromhex(
             '81279e4fe405363eb56e686726d450fe4a76a1d83b64311d7618b845683aab4a'), False)
 
+    def test_signing_session(self, monkeypatch):
+        keystore = Old_KeyStore.from_seed('ee6ea9eceaf649640051a4c305ac5c59')
+        keystore.update_password('password')
+        stretch_calls = []
+        stretch_key = Old_KeyStore.stretch_key
+        def _stretch_key(seed):
+            stretch_calls.append(seed)
+            return stretch_key(seed)
+        monkeypatch.setattr(keystore, "stretch_key", _stretch_key)
+
+        with pytest.raises(InvalidPassword):
+            keystore.create_signing_session('guess')
+        paths = [ (0, 10), (1, 2) ]
+        expected_keys = [ keystore.get_private_key(path, 'password') for path in paths ]
+        with keystore.create_signing_session('password') as session:
+            stretch_calls.clear()
+            assert expected_keys == [ session.get_private_key_from_xpubkey(
+                keystore.get_xpubkey(path)) for path in paths ]
+            # The seed is only stretched the once for all the keys.
+            assert 1 == len(stretch_calls)
+            assert 'secexp' in session.secrets
+        assert session.is_closed()
+        assert {} == session.secrets
+
     def test_check_seed(self):
         seed = 'ee6ea9eceaf649640051a4c305ac5c59'
         keystore = Old_KeyStore.from_seed(seed)
@@ -249,6 +279,33 @@ class TestBIP32_KeyStore:
                                          '9ec51ce4c3337a7de2a13'), True)
 
 
+    def test_signing_session(self, monkeypatch):
+        xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
+                'qYiSB7mHvg6kEsrd2ZtnHRJ61sZhSN4jZ2T8wxA4T75BE4QQZ1')
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        password = 'password'
+        keystore = BIP32_KeyStore({'xprv': pw_encode(xprv, password), 'xpub': xpub})
+        paths = [ (0, n) for n in range(5) ] + [ (1, 2, 3) ]
+        expected_keys = [ keystore.get_private_key(path, password) for path in paths ]
+
+        decode_calls = []
+        def _pw_decode(data, password):
+            decode_calls.append(data)
+            return pw_decode(data, password)
+        monkeypatch.setattr(keystore_module, "pw_decode", _pw_decode)
+
+        with keystore.create_signing_session(password) as session:
+            assert expected_keys == [ session.get_private_key_from_xpubkey(
+                keystore.get_xpubkey(path)) for path in paths ]
+            # Once to check the password and once for the master private key.
+            assert 2 == len(decode_calls)
+            assert { (), (0,), (1,), (1, 2) } == set(session.secrets)
+        assert session.is_closed()
+        assert {} == session.secrets
+        with pytest.raises(AssertionError):
+            session.get_private_key_from_xpubkey(keystore.get_xpubkey((0, 0)))
+
     @pytest.mark.parametrize("password", ('Password', None))
     def test_check_password(self, password):
         xprv = ('xprv9s21ZrQH143K4XLpSd2berkCzJTXDv68rusDQFiQGSqa1ZmVXnYzYpTQ9'
@@ -279,6 +336,21 @@ class TestXPub:
         pubkey = keystore.derive_pubkey((for_change, n))
         assert pubkey == XPublicKey.from_hex(pubkey_hex).to_public_key()
 
+    def test_derive_pubkeys(self):
+        xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
+                'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
+        keystore = BIP32_KeyStore({'xpub': xpub})
+        pubkeys = keystore.derive_pubkeys((1,), range(3, 6))
+        assert pubkeys == [ keystore.derive_pubkey((1, n)) for n in range(3, 6) ]
+        assert pubkeys[2] == XPublicKey.from_hex(
+            '033177256871768b5ee8e031647f3727e63d1b62c8d776d9b422a367fd8e721bd3').to_public_key()
+        assert keystore.derive_pubkeys((1, 2), [ 7 ]) == [ keystore.derive_pubkey((1, 2, 7)) ]
+
+        # The parsed nodes are for the current extended public key.
+        keystore.add_xprv(BIP32PrivateKey.from_seed(b'x' * 32, Net.COIN))
+        assert keystore.derive_pubkeys((1,), [ 5 ]) == [
+            Xpub.get_pubkey_from_xpub(keystore.xpub, (1, 5)) ]
+
     def test_xpubkey(self):
         xpub = ('xpub661MyMwAqRbcH1RHYeZc1zgwYLJ1dNozE8npCe81pnNYtN6e5KsF6cmt17Fv8w'
                 'GvJrRiv6Kewm8ggBG6N3XajhoioH3stUmLRi53tk46CiA')
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import threading
+from typing import List
+
+from bitcoinx import hash_to_hex_str
+
+from electrumsv import network
+from electrumsv.constants import TxFlags
+from electrumsv.network import Network
+from electrumsv.transaction import Transaction
+
+from .test_wallet_database import tx_hex_1, tx_hex_2, tx_hex_3, tx_hex_4
+
+
+class MockSession:
+    def __init__(self, tx_hexes: List[str]) -> None:
+        self.logger = logging.getLogger("MockSession")
+        self._tx_hexes = { hash_to_hex_str(Transaction.from_hex(tx_hex).hash()): tx_hex
+            for tx_hex in tx_hexes }
+
+    async def request_tx(self, tx_id: str) -> str:
+        return self._tx_hexes[tx_id]
+
+
+class MockWallet:
+    def __init__(self, fail_first_batch: bool=False) -> None:
+        self.request_count = 0
+        self.response_count = 0
+        self.progress_event = threading.Event()
+        self.batches: List[List[bytes]] = []
+        self._fail_first_batch = fail_first_batch
+
+    async def add_transactions_async(self, transactions, external: bool) -> None:
+        assert external
+        assert all(flags == TxFlags.StateCleared | TxFlags.HasByteData
+            for _tx_hash, _tx, flags in transactions)
+        self.batches.append([ tx_hash for tx_hash, _tx, _flags in transactions ])
+        if self._fail_first_batch and len(self.batches) == 1:
+            raise Exception("the batch failed")
+
+
+def _request_transactions(wallet: MockWallet) -> List[bytes]:
+    tx_hexes = [ tx_hex_1, tx_hex_2, tx_hex_3, tx_hex_4 ]
+    tx_hashes = [ Transaction.from_hex(tx_hex).hash() for tx_hex in tx_hexes ]
+    session = MockSession(tx_hexes)
+    class MockNetwork:
+        async def _main_session(self) -> MockSession:
+            return session
+    loop = asyncio.new_event_loop()
+    try:
+        had_timeout = loop.run_until_complete(
+            Network._request_transactions(MockNetwork(), wallet, tx_hashes))
+    finally:
+        loop.close()
+    assert not had_timeout
+    assert wallet.request_count == wallet.response_count == len(tx_hashes)
+    return tx_hashes
+
+
+def test_request_transactions_batches(monkeypatch) -> None:
+    monkeypatch.setattr(network, "TRANSACTION_BATCH_SIZE", 3)
+    wallet = MockWallet()
+    tx_hashes = _request_transactions(wallet)
+    # A full batch is added as soon as it is received, and the remainder when nothing is left.
+    assert [ 3, 1 ] == [ len(batch) for batch in wallet.batches ]
+    assert set(tx_hashes) == set(tx_hash for batch in wallet.batches for tx_hash in batch)
+
+
+def test_request_transactions_failed_batch(monkeypatch) -> None:
+    monkeypatch.setattr(network, "TRANSACTION_BATCH_SIZE", 2)
+    wallet = MockWallet(fail_first_batch=True)
+    _request_transactions(wallet)
+    # The failure is logged and does not stop the later batches.
+    assert [ 2, 2 ] == [ len(batch) for batch in wallet.batches ]
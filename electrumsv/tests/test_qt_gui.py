@@ -1,6 +1,7 @@
 import os
 from typing import Optional
 import unittest
+import unittest.mock
 
 from electrumsv.i18n import _
 from electrumsv.bitcoin import COINBASE_MATURITY
@@ -105,3 +106,54 @@ class HistoryListTests(unittest.TestCase):
         self.assertNotEqual("...", time_string)
         self.assertEqual(time_string, get_tx_desc(TxStatus.FINAL, 1))
         self.assertEqual(_("unknown"), get_tx_desc(TxStatus.FINAL, False))
+
+
+class WalletEventTests(unittest.TestCase):
+    def test_main_window_transactions_added(self) -> None:
+        from electrumsv.gui.qt.main_window import ElectrumWindow
+
+        window = MockWhatever()
+        window._wallet = MockWhatever()
+        window._wallet.get_account_ids = lambda: { 1, 2 }
+        window._account_id = 1
+        window._logger = unittest.mock.Mock()
+        window.tx_notifications = []
+        window.notify_transactions_signal = unittest.mock.Mock()
+        window.need_update = unittest.mock.Mock()
+        window.transaction_added_signal = unittest.mock.Mock()
+
+        tx_1, tx_2, tx_3 = MockWhatever(), MockWhatever(), MockWhatever()
+        transactions = [ (b'1', tx_1, { 1 }), (b'2', tx_2, { 2 }), (b'3', tx_3, set()) ]
+        ElectrumWindow._on_transactions_added(window, 'transactions_added', transactions, True)
+
+        # The batch results in one notification and one update.
+        self.assertEqual([ tx_1, tx_2 ], window.tx_notifications)
+        window.notify_transactions_signal.emit.assert_called_once_with()
+        window.need_update.set.assert_called_once_with()
+        self.assertEqual([ unittest.mock.call(*t) for t in transactions ],
+            window.transaction_added_signal.emit.call_args_list)
+
+        # Transactions that are not external, or for other accounts, do neither.
+        window.tx_notifications = []
+        window.notify_transactions_signal.reset_mock()
+        window.need_update.reset_mock()
+        ElectrumWindow._on_transactions_added(window, 'transactions_added',
+            [ (b'2', tx_2, { 2 }) ], False)
+        self.assertEqual([], window.tx_notifications)
+        window.notify_transactions_signal.emit.assert_not_called()
+        window.need_update.set.assert_not_called()
+
+    def test_coinsplitting_tab_transactions_added(self) -> None:
+        from electrumsv.gui.qt.coinsplitting_tab import CoinSplittingTab
+
+        tab = MockWhatever()
+        tab._on_transaction_added = unittest.mock.Mock()
+        tx_1, tx_2 = MockWhatever(), MockWhatever()
+        CoinSplittingTab._on_wallet_event(tab, 'transactions_added',
+            [ (b'1', tx_1, { 1 }), (b'2', tx_2, { 2 }) ], True)
+        self.assertEqual([ unittest.mock.call(tx_1, { 1 }), unittest.mock.call(tx_2, { 2 }) ],
+            tab._on_transaction_added.call_args_list)
+
+        tab._on_transaction_added.reset_mock()
+        CoinSplittingTab._on_wallet_event(tab, 'transaction_added', b'1', tx_1, { 1 }, True)
+        tab._on_transaction_added.assert_called_once_with(tx_1, { 1 })
@@ -0,0 +1,43 @@
+from bitcoinx import PrivateKey, sha256
+
+from electrumsv import signing
+from electrumsv.signing import sign_hashes, SigningEngine
+
+
+HASH_TYPE = 0x41
+
+
+def _make_signing_data(count: int):
+    private_keys = [ PrivateKey.from_random() for i in range(3) ]
+    return ([ private_keys[i % 3].to_bytes() for i in range(count) ],
+        [ sha256(bytes([ i % 256, i // 256 ])) for i in range(count) ])
+
+
+def test_sign_hashes() -> None:
+    private_keys, hashes = _make_signing_data(5)
+    signatures = sign_hashes(private_keys, hashes, HASH_TYPE)
+    assert 5 == len(signatures)
+    for private_key, sighash, signature in zip(private_keys, hashes, signatures):
+        assert HASH_TYPE == signature[-1]
+        public_key = PrivateKey(private_key).public_key
+        assert public_key.verify_der_signature(signature[:-1], sighash, None)
+
+
+def test_engine_signs_in_chunks(monkeypatch) -> None:
+    private_keys, hashes = _make_signing_data(25)
+    # The signatures are deterministic, so those made by the workers should be the same.
+    expected_signatures = sign_hashes(private_keys, hashes, HASH_TYPE)
+
+    engine = SigningEngine(max_workers=2)
+    try:
+        # Small runs are signed on the calling thread.
+        assert expected_signatures == engine.sign_hashes(private_keys, hashes, HASH_TYPE)
+        assert engine._executor is None
+
+        monkeypatch.setattr(signing, "MINIMUM_PROCESS_SIGNATURE_COUNT", 10)
+        monkeypatch.setattr(signing, "SIGNATURE_CHUNK_SIZE", 7)
+        assert expected_signatures == engine.sign_hashes(private_keys, hashes, HASH_TYPE)
+        assert engine._executor is not None
+    finally:
+        engine.shutdown()
+    assert engine._executor is None
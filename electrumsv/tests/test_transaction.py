@@ -1,13 +1,19 @@
 import json
+import time
+
 import pytest
 
 from bitcoinx import (
-    Address, PrivateKey, PublicKey, Tx, Script, TxOutput, bip32_key_from_string, hash160, Bitcoin
+    Address, PrivateKey, PublicKey, Tx, Script, SigHash, TxOutput, bip32_key_from_string, hash160,
+    Bitcoin
 )
 
 from electrumsv.bitcoin import address_from_string
 from electrumsv.keystore import Old_KeyStore, BIP32_KeyStore
-from electrumsv.transaction import XPublicKey, Transaction, NO_SIGNATURE
+from electrumsv.constants import ScriptType
+from electrumsv.signing import sign_hashes
+from electrumsv.transaction import (XPublicKey, XTxInput, Transaction,
+    TransactionSizeEstimator, NO_SIGNATURE)
 
 
 unsigned_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000005701ff4c53ff0488b21e0000000000000000004f130d773e678a58366711837ec2e33ea601858262f8eaef246a7ebd19909c9a03c3b30e38ca7d797fee1223df1c9827b2a9f3379768f520910260220e0560014600002300feffffffd8e43201000000000118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
@@ -160,6 +166,115 @@ class TestTransaction2:
         assert tx.is_complete()
         assert tx.txid() == "b83acf939a92c420d0cb8d45d5d4dfad4e90369ebce0f49a45808dc1b41259b0"
 
+    def test_preimage_hash(self):
+        tx = Transaction.from_extended_bytes(bytes.fromhex(unsigned_tx))
+        midstate = tx.signature_hash_midstate()
+        for input_index, txin in enumerate(tx.inputs):
+            script_code = bytes.fromhex(tx.get_preimage_script(txin))
+            expected_hash = tx.signature_hash(input_index, txin.value, script_code,
+                sighash=SigHash(tx.nHashType()))
+            assert expected_hash == tx.preimage_hash(txin)
+            assert expected_hash == tx.preimage_hash(txin, input_index, midstate)
+
+    # Signing many inputs used to be quadratic, as the hashes common to all inputs were
+    # recalculated and each input was found by scanning the inputs.
+    @pytest.mark.parametrize("input_count", (1000, 5000))
+    def test_sign_many_inputs(self, input_count, monkeypatch):
+        keypairs = {XPublicKey.from_hex(priv_key.public_key.to_hex()):
+                    (priv_key.to_bytes(), priv_key.is_compressed())
+                    for priv_key in priv_keys}
+        x_pubkeys = list(keypairs)
+        inputs = [ XTxInput(prev_hash=bytes(32), prev_idx=i, script_sig=Script(),
+            sequence=0xffffffff, value=1000, x_pubkeys=[ x_pubkeys[i % len(x_pubkeys)] ],
+            threshold=1, signatures=[ NO_SIGNATURE ], script_type=ScriptType.P2PKH)
+            for i in range(input_count) ]
+        outputs = [ TxOutput(input_count * 1000 - 1000,
+            priv_keys[0].public_key.to_address(coin=Bitcoin).to_script()) ]
+        # The inputs are not searched for when signing them.
+        class InputList(list):
+            def index(self, *args):
+                raise AssertionError("input looked up by scanning")
+        tx = Transaction.from_io(InputList(inputs), outputs)
+
+        midstate_calls = []
+        signature_hash_midstate = Transaction.signature_hash_midstate
+        def _signature_hash_midstate(self):
+            midstate_calls.append(1)
+            return signature_hash_midstate(self)
+        monkeypatch.setattr(Transaction, "signature_hash_midstate", _signature_hash_midstate)
+
+        start_time = time.perf_counter()
+        tx.sign(keypairs)
+        elapsed_time = time.perf_counter() - start_time
+        print(f"signed {input_count} inputs in {elapsed_time:.2f} seconds")
+
+        assert tx.is_complete()
+        assert [ 1 ] == midstate_calls
+        for input_index in (0, input_count // 2, input_count - 1):
+            txin = tx.inputs[input_index]
+            public_key = txin.x_pubkeys[0].to_public_key()
+            script_code = public_key.P2PKH_script().to_bytes()
+            message_hash = tx.signature_hash(input_index, txin.value, script_code,
+                sighash=SigHash(tx.nHashType()))
+            assert public_key.verify_der_signature(txin.signatures[0][:-1], message_hash, None)
+
+    def test_size_estimator(self):
+        script = priv_keys[0].public_key.to_address(coin=Bitcoin).to_script()
+        tx = Transaction.from_io([], [ TxOutput(1000, script) for i in range(252) ])
+        estimator = TransactionSizeEstimator.from_transaction(tx)
+        assert len(tx.to_bytes()) == estimator.size() == tx.estimated_size()
+
+        # The output count crosses the boundary where its varint needs more than one byte.
+        output_size = len(tx.outputs[0].to_bytes())
+        tx.outputs.append(TxOutput(1000, script))
+        assert len(tx.to_bytes()) == estimator.size_with(output_count=1, output_size=output_size)
+        estimator.add_output(output_size)
+        assert len(tx.to_bytes()) == estimator.size()
+        tx.outputs.pop()
+        estimator.remove_output(output_size)
+        assert len(tx.to_bytes()) == estimator.size()
+
+        x_pubkey = XPublicKey.from_hex(priv_keys[0].public_key.to_hex())
+        txin = XTxInput(prev_hash=bytes(32), prev_idx=0, script_sig=Script(),
+            sequence=0xffffffff, value=1000, x_pubkeys=[ x_pubkey ], threshold=1,
+            signatures=[ NO_SIGNATURE ], script_type=ScriptType.P2PKH)
+        tx.inputs.extend([ txin ] * 253)
+        estimator.add_input(253 * txin.estimated_size(), 253)
+        assert tx.estimated_size() == estimator.size()
+        # The unsigned inputs are serialized without the signatures that are estimated for.
+        assert estimator.size() == len(tx.to_bytes()) + 253 * (txin.estimated_size() -
+            txin.size())
+
+    def test_sign_with_engine(self):
+        keypairs = {XPublicKey.from_hex(priv_key.public_key.to_hex()):
+                    (priv_key.to_bytes(), priv_key.is_compressed())
+                    for priv_key in priv_keys}
+        x_pubkeys = list(keypairs)
+        def make_tx():
+            inputs = [ XTxInput(prev_hash=bytes(32), prev_idx=i, script_sig=Script(),
+                sequence=0xffffffff, value=1000, x_pubkeys=[ x_pubkeys[i % len(x_pubkeys)] ],
+                threshold=1, signatures=[ NO_SIGNATURE ], script_type=ScriptType.P2PKH)
+                for i in range(10) ]
+            outputs = [ TxOutput(9000,
+                priv_keys[0].public_key.to_address(coin=Bitcoin).to_script()) ]
+            return Transaction.from_io(inputs, outputs)
+
+        class MockEngine:
+            calls = []
+            def sign_hashes(self, private_keys, hashes, hash_type):
+                self.calls.append(len(hashes))
+                return sign_hashes(private_keys, hashes, hash_type)
+
+        tx = make_tx()
+        tx.sign(keypairs)
+        engine_tx = make_tx()
+        engine = MockEngine()
+        engine_tx.sign(keypairs, engine)
+        # Every signature is made in the one call, and they are added to the right inputs.
+        assert [ 10 ] == engine.calls
+        assert engine_tx.is_complete()
+        assert tx.to_bytes() == engine_tx.to_bytes()
+
     def multisig_keystores(self):
         seed = 'ee6ea9eceaf649640051a4c305ac5c59'
         keystore1 = Old_KeyStore.from_seed(seed)
@@ -242,3 +242,27 @@ def test_lrucache_add_past_limit_lru_ordering(max_count: int, max_size: int, tes
     added, removals = cache.set(b'6', test_tx_small)
     assert added
     assert removals == [(b'4', test_tx_small)]
+
+def test_lrucache_bytes_sized_by_length() -> None:
+    cache = LRUCache(max_size=10)
+    cache.set(b'1', b'12345')
+    cache.set(b'2', b'1234')
+    assert cache.current_size == 9
+    added, removals = cache.set(b'3', b'12')
+    assert added
+    assert removals == [(b'1', b'12345')]
+    assert cache.current_size == 6
+
+def test_lrucache_size_func() -> None:
+    cache = LRUCache(max_count=2, size_func=lambda value: 0)
+    cache.set(b'1', b'12345')
+    assert cache.current_size == 0
+
+def test_lrucache_explicit_size() -> None:
+    cache = LRUCache(max_size=10, size_func=lambda value: 0)
+    cache.set(b'1', b'12345', 6)
+    assert cache.current_size == 6
+    added, removals = cache.set(b'2', b'1', 5)
+    assert added
+    assert removals == [(b'1', b'12345')]
+    assert cache.current_size == 5
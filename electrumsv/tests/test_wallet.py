@@ -1,4 +1,5 @@
 import asyncio
+from functools import partial
 import json
 import logging
 import os
@@ -9,20 +10,27 @@ import threading
 from typing import Dict, Optional, List, Set
 import unittest
 
+from bitcoinx import Script
 import pytest
 
+from electrumsv import coinchooser
 from electrumsv.constants import (DATABASE_EXT, DerivationType, KeystoreTextType, ScriptType,
-    StorageKind, CHANGE_SUBPATH, RECEIVING_SUBPATH, KeyInstanceFlag)
+    StorageKind, CHANGE_SUBPATH, RECEIVING_SUBPATH, KeyInstanceFlag, TransactionOutputFlag,
+    TxFlags)
+from electrumsv.bitcoin import scripthash_bytes
 from electrumsv.crypto import pw_decode
-from electrumsv.exceptions import InvalidPassword, IncompatibleWalletError
+from electrumsv.exceptions import InvalidPassword, IncompatibleWalletError, NotEnoughFunds
 from electrumsv.keystore import (from_seed, from_xpub, Old_KeyStore, Multisig_KeyStore)
 from electrumsv.networks import Net, SVMainnet, SVTestnet
 from electrumsv.storage import get_categorised_files, WalletStorage, WalletStorageInfo
-from electrumsv.wallet import (ImportedPrivkeyAccount, ImportedAddressAccount, MultisigAccount,
-    Wallet, StandardAccount, AbstractAccount)
-from electrumsv.wallet_database import DatabaseContext
-from electrumsv.wallet_database.tables import AccountRow, KeyInstanceRow, TransactionDeltaTable
-
+from electrumsv.wallet import (AccountHistory, CoinBalances, ImportedPrivkeyAccount, ImportedAddressAccount,
+    KeyHistory, MultisigAccount, SyncState, Wallet, StandardAccount, AbstractAccount)
+from electrumsv.transaction import NO_SIGNATURE, Transaction, XTxInput, XTxOutput
+from electrumsv.wallet_database import DatabaseContext, SynchronousWriter, TxData
+from electrumsv.wallet_database.tables import (AccountRow, KeyInstanceRow, TransactionDeltaTable,
+    TransactionOutputRow, TransactionTable)
+
+from .test_wallet_database import tx_hex_1, tx_hex_2
 from .util import setup_async, tear_down_async, TEST_WALLET_PATH
 
 
@@ -484,9 +492,9 @@ def test_legacy_wallet_loading(storage_info: WalletStorageInfo) -> None:
 
 def test_detect_used_keys(mocker):
     class MockDatabaseContext:
-        def acquire_connection(self):
+        def open_store(self):
             return
-        def release_connection(self, connection):
+        def close_store(self):
             return
 
     class MockWallet:
@@ -527,6 +535,487 @@ def test_detect_used_keys(mocker):
     assert account._keyinstances[3].flags == KeyInstanceFlag.USER_SET_ACTIVE
 
 
+def test_sort_transactions_by_dependency() -> None:
+    class MockTxInput:
+        def __init__(self, prev_hash: bytes) -> None:
+            self.prev_hash = prev_hash
+
+    class MockTransaction:
+        def __init__(self, *prev_hashes: bytes) -> None:
+            self.inputs = [ MockTxInput(prev_hash) for prev_hash in prev_hashes ]
+
+    # c spends b and an external transaction, b spends a, d is unrelated.
+    transactions = [
+        (b'c', MockTransaction(b'b', b'x'), TxFlags.Unset),
+        (b'd', MockTransaction(b'y'), TxFlags.Unset),
+        (b'b', MockTransaction(b'a'), TxFlags.Unset),
+        (b'a', MockTransaction(b'z'), TxFlags.Unset),
+        (b'a', MockTransaction(b'z'), TxFlags.Unset),
+    ]
+    ordered = Wallet._sort_transactions_by_dependency(transactions)
+    assert [ b'a', b'b', b'c', b'd' ] == [ t[0] for t in ordered ]
+
+def test_add_transactions_async(tmp_storage) -> None:
+    wallet = Wallet(tmp_storage)
+    events = []
+    def _on_transactions_added(event_name, transactions, is_external) -> None:
+        events.append((transactions, is_external))
+    wallet.register_callback(_on_transactions_added, ['transactions_added'])
+
+    tx_1 = Transaction.from_hex(tx_hex_1)
+    tx_2 = Transaction.from_hex(tx_hex_2)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(wallet.add_transactions_async([
+            (tx_1.hash(), tx_1, TxFlags.StateCleared),
+            (tx_2.hash(), tx_2, TxFlags.StateCleared) ], True))
+    finally:
+        loop.close()
+
+    # The batch is notified as a whole, once the writes are committed.
+    assert [ ([ (tx_1.hash(), tx_1, set()), (tx_2.hash(), tx_2, set()) ], True) ] == events
+    with TransactionTable(wallet.get_db_context()) as table:
+        assert { tx_1.hash(), tx_2.hash() } == { t[0] for t in table.read_metadata() }
+    for tx in (tx_1, tx_2):
+        assert TxFlags.StateCleared | TxFlags.HasByteData == \
+            wallet._transaction_cache.get_flags(tx.hash()) & \
+                (TxFlags.STATE_MASK | TxFlags.HasByteData)
+
+
+def test_add_transactions_async_failed_write(tmp_storage) -> None:
+    wallet = Wallet(tmp_storage)
+    events = []
+    def _on_transactions_added(event_name, transactions, is_external) -> None:
+        events.append((transactions, is_external))
+    wallet.register_callback(_on_transactions_added, ['transactions_added'])
+
+    # The transaction is added behind the back of the cache, so that adding it again fails.
+    tx_1 = Transaction.from_hex(tx_hex_1)
+    tx_2 = Transaction.from_hex(tx_hex_2)
+    with TransactionTable(wallet.get_db_context()) as table:
+        with SynchronousWriter() as writer:
+            table.create([ (tx_1.hash(), TxData(height=10, date_added=1, date_updated=1), None,
+                TxFlags.HasHeight, None) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(wallet.add_transactions_async([
+            (tx_1.hash(), tx_1, TxFlags.StateCleared),
+            (tx_2.hash(), tx_2, TxFlags.StateCleared) ], False))
+    finally:
+        loop.close()
+
+    # Only the transaction that was written is notified, and the cache reflects the store.
+    assert [ ([ (tx_2.hash(), tx_2, set()) ], False) ] == events
+    assert TxFlags.HasHeight == wallet._transaction_cache.get_flags(tx_1.hash())
+    assert not wallet._transaction_cache.have_transaction_data_cached(tx_1.hash())
+
+
+def test_script_routes(tmp_storage) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+    keyinstance_1, = account.create_keys(1, RECEIVING_SUBPATH)
+
+    script_bytes_1 = account.get_key_script_bytes([ keyinstance_1.keyinstance_id ])[0][1]
+    assert [ (1, keyinstance_1.keyinstance_id) ] == wallet.get_script_routes(script_bytes_1)
+
+    # Keys created after the routes are built are added to them.
+    keyinstance_2, = account.create_keys(1, RECEIVING_SUBPATH)
+    script_bytes_2 = account.get_key_script_bytes([ keyinstance_2.keyinstance_id ])[0][1]
+    assert [ (1, keyinstance_2.keyinstance_id) ] == wallet.get_script_routes(script_bytes_2)
+
+    tx = Transaction.from_hex(tx_hex_1)
+    assert set() == wallet._get_transaction_account_ids(tx.hash(), tx)
+    tx.outputs[0].script_pubkey = account.get_script_for_id(keyinstance_2.keyinstance_id)
+    assert { 1 } == wallet._get_transaction_account_ids(tx.hash(), tx)
+
+    # Unloaded keys are no longer routed to.
+    account._unload_keys({ keyinstance_2.keyinstance_id })
+    assert [] == wallet.get_script_routes(script_bytes_2)
+    assert set() == wallet._get_transaction_account_ids(tx.hash(), tx)
+    assert [ (1, keyinstance_1.keyinstance_id) ] == wallet.get_script_routes(script_bytes_1)
+
+
+def test_process_transactions_key_usage(tmp_storage) -> None:
+    wallet = Wallet(tmp_storage)
+    accounts: List[StandardAccount] = []
+    for account_id, seed_words in enumerate([
+            'cycle rocket west magnet parrot shuffle foot correct salt library feed song',
+            'powerful random nobody notice nothing important anyway look away hidden message over'
+            ], 1):
+        masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+        account_row = AccountRow(account_id, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+        account = StandardAccount(wallet, account_row, [], [])
+        wallet.register_account(account.get_id(), account)
+        accounts.append(account)
+
+    # The parent pays both accounts, and the child spends the parent's output to the first.
+    parent_tx = Transaction.from_hex(tx_hex_1)
+    for output, account in zip(parent_tx.outputs, accounts):
+        keyinstance, = account.create_keys(1, RECEIVING_SUBPATH)
+        output.script_pubkey = account.get_script_for_id(keyinstance.keyinstance_id)
+    child_tx = Transaction.from_hex(tx_hex_2)
+    child_tx.inputs[0].prev_hash = parent_tx.hash()
+    child_tx.inputs[0].prev_idx = 0
+
+    calls: Dict[int, List[bytes]] = { 1: [], 2: [] }
+    thread_names: Set[str] = set()
+    def _process_key_usage(account_id: int, tx_hash: bytes, tx: Transaction,
+            relevant_txos) -> bool:
+        calls[account_id].append(tx_hash)
+        thread_names.add(threading.current_thread().name)
+        return tx_hash == parent_tx.hash() or account_id == 1
+    for account in accounts:
+        account.process_key_usage = partial(_process_key_usage, account.get_id())
+
+    assert { parent_tx.hash(): { 1, 2 }, child_tx.hash(): { 1 } } == \
+        wallet._process_transactions_key_usage([
+            (parent_tx.hash(), parent_tx, TxFlags.Unset),
+            (child_tx.hash(), child_tx, TxFlags.Unset) ])
+    # Each account sees the transactions in order, and only those that may affect it.
+    assert { 1: [ parent_tx.hash(), child_tx.hash() ], 2: [ parent_tx.hash() ] } == calls
+    assert all(name.startswith("wallet-accounts") for name in thread_names)
+
+
+def test_outpoint_spenders(tmp_storage) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+    keyinstance, = account.create_keys(1, RECEIVING_SUBPATH)
+
+    tx = Transaction.from_hex(tx_hex_2)
+    txin = tx.inputs[0]
+    assert not wallet.is_transaction_spends_indexed(tx.hash())
+    assert wallet.get_outpoint_spender(txin.prev_hash, txin.prev_idx) is None
+
+    # Transactions already in the wallet are indexed once for each version of a key's history.
+    loaded_tx_hashes: List[bytes] = []
+    def _get_transaction(tx_hash: bytes) -> Optional[Transaction]:
+        loaded_tx_hashes.append(tx_hash)
+        return tx if tx_hash == tx.hash() else None
+    wallet._transaction_cache.get_transaction = _get_transaction
+    account._sync_state.set_key_history(keyinstance.keyinstance_id, [ (tx.hash(), 10) ])
+    account._index_key_history_spends(keyinstance.keyinstance_id)
+    account._index_key_history_spends(keyinstance.keyinstance_id)
+    assert [ tx.hash() ] == loaded_tx_hashes
+    assert wallet.is_transaction_spends_indexed(tx.hash())
+    assert tx.hash() == wallet.get_outpoint_spender(txin.prev_hash, txin.prev_idx)
+
+    wallet.remove_transaction_spends(tx.hash())
+    assert not wallet.is_transaction_spends_indexed(tx.hash())
+    assert wallet.get_outpoint_spender(txin.prev_hash, txin.prev_idx) is None
+
+    wallet.index_transaction_spends(tx.hash(), tx)
+    assert tx.hash() == wallet.get_outpoint_spender(txin.prev_hash, txin.prev_idx)
+
+
+def test_create_transaction_outputs(tmp_storage) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+    keyinstances = account.create_keys(3, RECEIVING_SUBPATH)
+
+    written_rows: List[List[TransactionOutputRow]] = []
+    def _create_transactionoutputs(account_id: int, rows: List[TransactionOutputRow]) -> None:
+        written_rows.append(rows)
+    wallet.create_transactionoutputs = _create_transactionoutputs
+
+    tx_hash = Transaction.from_hex(tx_hex_1).hash()
+    flags = [ TransactionOutputFlag.NONE, TransactionOutputFlag.IS_SPENT,
+        TransactionOutputFlag.IS_COINBASE ]
+    account.create_transaction_outputs([ (tx_hash, i, 1000 + i, flags[i], keyinstance,
+        account.get_script_for_id(keyinstance.keyinstance_id), None)
+        for i, keyinstance in enumerate(keyinstances) ])
+
+    # All the outputs are written together.
+    assert [ [ TransactionOutputRow(tx_hash, i, 1000 + i, keyinstance.keyinstance_id, flags[i])
+        for i, keyinstance in enumerate(keyinstances) ] ] == written_rows
+    assert account.get_utxo(tx_hash, 0).value == 1000
+    assert account.get_utxo(tx_hash, 1) is None
+    assert keyinstances[1].keyinstance_id == account.get_stxo(tx_hash, 1)
+    assert account.get_utxo(tx_hash, 2).is_coinbase
+
+
+def test_create_keys_derives_public_keys_together(tmp_storage) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+
+    keystore = account.get_keystore()
+    derive_calls: List[List[int]] = []
+    derive_pubkeys = keystore.derive_pubkeys
+    def _derive_pubkeys(parent_path, indexes):
+        derive_calls.append(list(indexes))
+        return derive_pubkeys(parent_path, indexes)
+    keystore.derive_pubkeys = _derive_pubkeys
+
+    keyinstances = account.create_keys(5, RECEIVING_SUBPATH)
+    assert [ list(range(5)) ] == derive_calls
+    for i, keyinstance in enumerate(keyinstances):
+        assert [ keystore.derive_pubkey(RECEIVING_SUBPATH + (i,)) ] == \
+            account.get_public_keys_for_id(keyinstance.keyinstance_id)
+    # The derived keys are not derived again, and their scripts are derived with them.
+    account.get_script_template_for_id(keyinstances[0].keyinstance_id)
+    assert 1 == len(derive_calls)
+    for keyinstance in keyinstances:
+        address = account.get_script_template_for_id(keyinstance.keyinstance_id,
+            ScriptType.P2PKH)
+        script = address.to_script()
+        assert (script, bytes(script), address) == \
+            account._script_cache[(keyinstance.keyinstance_id, ScriptType.P2PKH)]
+        assert [ (ScriptType.P2PKH, scripthash_bytes(script)) ] == \
+            account.get_possible_script_hashes_for_id(keyinstance.keyinstance_id)
+
+
+def test_sign_transactions_decrypts_once(tmp_storage) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    keystore = from_seed(seed_words, '')
+    keystore.update_password('password')
+    masterkey_row = wallet.create_masterkey_from_keystore(keystore)
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+    keyinstances = account.create_keys(4, RECEIVING_SUBPATH)
+
+    added_tx_hashes: List[bytes] = []
+    wallet.add_transaction = lambda tx_hash, tx, flags: added_tx_hashes.append(tx_hash)
+    sessions = []
+    create_signing_session = keystore.create_signing_session
+    def _create_signing_session(password):
+        sessions.append(create_signing_session(password))
+        return sessions[-1]
+    keystore.create_signing_session = _create_signing_session
+
+    txs = []
+    for i in range(2):
+        inputs = [ XTxInput(prev_hash=bytes([ i ]) * 32, prev_idx=j, script_sig=Script(),
+            sequence=0xffffffff, value=1000,
+            x_pubkeys=account.get_xpubkeys_for_id(keyinstance.keyinstance_id), threshold=1,
+            signatures=[ NO_SIGNATURE ], script_type=ScriptType.P2PKH)
+            for j, keyinstance in enumerate(keyinstances) ]
+        outputs = [ XTxOutput(3000, account.get_script_for_id(keyinstances[0].keyinstance_id)) ]
+        txs.append(Transaction.from_io(inputs, outputs))
+
+    account.sign_transactions([ (tx, None) for tx in txs ], 'password')
+    assert all(tx.is_complete() for tx in txs)
+    assert [ tx.hash() for tx in txs ] == added_tx_hashes
+    # The key data was decrypted for one session covering both transactions, which is closed.
+    assert 1 == len(sessions)
+    assert sessions[0].is_closed()
+
+
+class _FeeConfig:
+    def get(self, name, default=None):
+        return default
+
+    def fee_per_kb(self) -> int:
+        return 500
+
+    def estimate_fee(self, size: int) -> int:
+        return size // 2
+
+
+def test_make_unsigned_transaction_selects_by_value(tmp_storage, monkeypatch) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+    keyinstances = account.create_keys(10, RECEIVING_SUBPATH)
+
+    values = [ 1000 + n for n in range(2000) ] + [ 200000, 300000 ]
+    account.register_utxos([ (bytes([ n % 256, n // 256 ]) * 16, 0, value,
+        TransactionOutputFlag.NONE, keyinstances[n % 10],
+        account.get_script_for_id(keyinstances[n % 10].keyinstance_id), None)
+        for n, value in enumerate(values) ])
+    frozen_utxo = account.get_utxo(bytes([ 207, 7 ]) * 16, 0)
+    assert 2999 == frozen_utxo.value
+    account.set_frozen_coin_state([ frozen_utxo ], True)
+
+    # Only the largest of the coins are looked at, and frozen coins are skipped.
+    read_utxo_keys = []
+    get_utxo_filter = account._get_utxo_filter
+    def _get_utxo_filter(*args):
+        is_spendable_utxo = get_utxo_filter(*args)
+        def _is_spendable_utxo(utxo_key, utxo):
+            read_utxo_keys.append(utxo_key)
+            return is_spendable_utxo(utxo_key, utxo)
+        return _is_spendable_utxo
+    monkeypatch.setattr(account, "_get_utxo_filter", _get_utxo_filter)
+    CoinSelector = coinchooser.CoinSelector
+    monkeypatch.setattr(coinchooser, "CoinSelector",
+        lambda: CoinSelector(max_search_coins=50))
+
+    script = account.get_script_for_id(keyinstances[0].keyinstance_id)
+    tx = account.make_unsigned_transaction(None, [ XTxOutput(150000, script) ], _FeeConfig())
+    assert [ 300000 ] == [ txin.value for txin in tx.inputs ]
+    assert 51 == len(read_utxo_keys)
+    assert tx.get_fee() >= _FeeConfig().estimate_fee(tx.estimated_size())
+
+    # Spending more than the largest coins accumulates the remaining coins largest first.
+    tx = account.make_unsigned_transaction(None, [ XTxOutput(505000, script) ], _FeeConfig())
+    input_values = sorted((txin.value for txin in tx.inputs), reverse=True)
+    assert [ 300000, 200000, 2998, 2997 ] == input_values[:4]
+    assert 2999 not in input_values
+
+    # A list of coins of at least the minimum size is also sorted and selected from.
+    tx = account.make_unsigned_transaction(account.get_utxos(), [ XTxOutput(150000, script) ],
+        _FeeConfig())
+    assert [ 300000 ] == [ txin.value for txin in tx.inputs ]
+
+    with pytest.raises(NotEnoughFunds):
+        account.make_unsigned_transaction(None, [ XTxOutput(10 ** 10, script) ], _FeeConfig())
+
+
+def test_sync_state_loads_keys_lazily() -> None:
+    hash_a, hash_b, hash_c = (bytes([ i ]) * 32 for i in range(3))
+    loaded_key_ids: List[List[int]] = []
+    def _loader(key_ids):
+        loaded_key_ids.append(list(key_ids))
+        return { key_id: [ (hash_a, 10), (hash_b, 0) ] for key_id in key_ids if key_id != 3 }
+    sync_state = SyncState(_loader)
+
+    assert set() == sync_state.get_transaction_key_ids(hash_a)
+    assert [ (hash_a, 10), (hash_b, 0) ] == list(sync_state.get_key_history(1))
+    assert 0 == len(sync_state.get_key_history(3))
+    sync_state.load_key_histories([ 1, 2, 3 ])
+    # Each key is only loaded once, whether it has history or not.
+    assert [ [ 1 ], [ 3 ], [ 2 ] ] == loaded_key_ids
+    assert { 1, 2 } == sync_state.get_transaction_key_ids(hash_a)
+
+    # Histories from the server replace the loaded ones.
+    assert ({ hash_a, hash_b }, { hash_c }) == sync_state.set_key_history(2, [ (hash_c, 11) ])
+    assert { 1 } == sync_state.get_transaction_key_ids(hash_a)
+    assert { 2 } == sync_state.get_transaction_key_ids(hash_c)
+    assert [ (hash_c, 11) ] == list(sync_state.get_key_history(2))
+
+    # Removing the last key for a transaction forgets the transaction.
+    sync_state.set_key_history(1, [])
+    assert set() == sync_state.get_transaction_key_ids(hash_a)
+
+
+def test_key_history() -> None:
+    entries = [ (bytes([ i ]) * 32, i - 1) for i in range(3) ]
+    history = KeyHistory(entries)
+    assert 3 == len(history)
+    assert entries == list(history)
+    assert set(t[0] for t in entries) == history.get_tx_hashes()
+    assert KeyHistory(entries) == history
+    assert KeyHistory(entries[:2]) != history
+
+
+def test_account_history() -> None:
+    history = AccountHistory()
+    history.set_transaction(b'a', TxData(height=10, position=1, date_added=1), 100)
+    history.set_transaction(b'b', TxData(height=12, position=0, date_added=2), -30)
+    history.set_transaction(b'c', TxData(height=0, date_added=3), 50)
+    # Signed but not cleared transactions are tracked but not part of the history.
+    history.set_transaction(b'd', TxData(date_added=4), 7)
+    assert 3 == len(history)
+    assert [ (b'c', 0, 50, 120), (b'b', 12, -30, 70), (b'a', 10, 100, 100) ] == \
+        [ (e[0], e[2], e[3], e[4]) for e in history.get_entries() ]
+
+    # Windows are most recent first.
+    assert [ b'b' ] == [ e[0] for e in history.get_entries(1, 1) ]
+    assert [ b'b', b'a' ] == [ e[0] for e in history.get_entries(1, 10) ]
+    assert [] == history.get_entries(3, 1)
+    assert [ b'b', b'a' ] == [ e[0] for e in history.get_height_range_entries(10, 13) ]
+    assert [ b'c', b'b' ] == [ e[0] for e in history.get_height_range_entries(11) ]
+
+    # Changes to value and metadata move the transaction and update the balances after it.
+    history.add_value_delta(b'a', TxData(height=10, position=1, date_added=1), 10)
+    history.update_metadata(b'c', TxData(height=11, position=5, date_added=3))
+    history.update_metadata(b'd', TxData(height=0, date_added=4))
+    assert [ (b'd', 7, 137), (b'b', -30, 130), (b'c', 50, 160), (b'a', 110, 110) ] == \
+        [ (e[0], e[3], e[4]) for e in history.get_entries() ]
+
+    history.remove_transaction(b'c')
+    assert [ (b'd', 87), (b'b', 80), (b'a', 110) ] == \
+        [ (e[0], e[4]) for e in history.get_entries() ]
+    # Metadata changes for transactions that are not in the history are ignored.
+    history.update_metadata(b'c', TxData(height=11, position=5, date_added=3))
+    assert not history.have_transaction(b'c')
+    assert 3 == len(history)
+
+
+def test_coin_balances() -> None:
+    balances = CoinBalances()
+    balances.add(1, 10, False)
+    balances.add(2, 0, False)
+    balances.add(4, 100, True)
+    balances.add(8, 150, True)
+    balances.add(16, 150, True)
+    # Coinbase coins mature once the chain is COINBASE_MATURITY blocks past them.
+    assert (1, 2, 28) == balances.get_balance(149)
+    assert (5, 2, 24) == balances.get_balance(200)
+    assert (29, 2, 0) == balances.get_balance(250)
+
+    balances.remove(8, 150, True)
+    balances.remove(2, 0, False)
+    assert (5, 0, 16) == balances.get_balance(200)
+    balances.remove(16, 150, True)
+    assert (5, 0, 0) == balances.get_balance(200)
+    assert [ 100 ] == balances._coinbase_heights
+
+
+def test_account_balance(tmp_storage) -> None:
+    seed_words = 'cycle rocket west magnet parrot shuffle foot correct salt library feed song'
+    wallet = Wallet(tmp_storage)
+    masterkey_row = wallet.create_masterkey_from_keystore(from_seed(seed_words, ''))
+    account_row = AccountRow(1, masterkey_row.masterkey_id, ScriptType.P2PKH, '...')
+    account = StandardAccount(wallet, account_row, [], [])
+    wallet.register_account(account.get_id(), account)
+    keyinstances = account.create_keys(3, RECEIVING_SUBPATH)
+    wallet.create_transactionoutputs = lambda account_id, rows: None
+    wallet.update_transactionoutput_flags = lambda entries: None
+
+    heights = { b'1': 10, b'2': 0, b'3': 50 }
+    wallet._transaction_cache.get_metadata = \
+        lambda tx_hash: TxData(height=heights[tx_hash], date_added=1)
+    wallet.get_local_height = lambda: 100
+    flags = [ TransactionOutputFlag.NONE, TransactionOutputFlag.NONE,
+        TransactionOutputFlag.IS_COINBASE ]
+    account.create_transaction_outputs([ (tx_hash, 0, value, flags[i], keyinstances[i],
+        account.get_script_for_id(keyinstances[i].keyinstance_id), None)
+        for i, (tx_hash, value) in enumerate([ (b'1', 1), (b'2', 2), (b'3', 4) ]) ])
+    assert (1, 2, 4) == account.get_balance()
+    assert [ b'1' ] == [ u.tx_hash for u in account.get_utxos(mature=True,
+        confirmed_only=True) ]
+
+    account.set_frozen_coin_state([ account.get_utxo(b'1', 0) ], True)
+    assert (0, 2, 4) == account.get_balance(exclude_frozen_coins=True)
+    assert (1, 0, 0) == account.get_frozen_balance()
+
+    # The balances follow the heights of the transactions.
+    heights[b'2'] = 60
+    account.refresh_transaction_metadata([ b'2' ])
+    assert (3, 0, 4) == account.get_balance()
+    assert (2, 0, 4) == account.get_balance(exclude_frozen_coins=True)
+    wallet.get_local_height = lambda: 150
+    assert (7, 0, 0) == account.get_balance()
+
+    account.set_utxo_spent(b'1', 0)
+    assert (6, 0, 0) == account.get_balance()
+    assert (0, 0, 0) == account.get_frozen_balance()
+
+
 # class TestImportedPrivkeyAccount:
 #     # TODO(rt12) REQUIRED add some unit tests for this account type. The following is obsolete.
 #     def test_pubkeys_to_a_ddress(self, tmp_storage, network):
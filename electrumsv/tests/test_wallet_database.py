@@ -1,6 +1,12 @@
+import asyncio
+import concurrent.futures
+from functools import partial
 import os
 import pytest
+import queue
+import threading
 from typing import Tuple, Optional
+import unittest.mock
 
 import bitcoinx
 
@@ -241,6 +247,59 @@ class TestTransactionCache:
         assert TxFlags.HasByteData == entry.flags & TxFlags.HasByteData
         assert cache.have_transaction_data_cached(tx_hash)
 
+    @pytest.mark.timeout(5)
+    def test_transaction_data_cached_serialized(self):
+        cache = TransactionCache(self.store)
+
+        tx = Transaction.from_hex(tx_hex_1)
+        tx_hash = tx.hash()
+        with SynchronousWriter() as writer:
+            cache.add_transaction(tx_hash, tx, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+        assert cache._txdata_cache.get_sizes()[0] == len(tx.to_bytes())
+        assert cache.get_transaction(tx_hash) is tx
+
+        # Only the bytes are cached when loaded, the transaction is parsed on access.
+        cache = TransactionCache(self.store)
+        assert cache.have_transaction_data_cached(tx_hash)
+        assert tx_hash not in cache._parsed_txdata_cache
+        tx_loaded = cache.get_transaction(tx_hash)
+        assert tx_loaded.to_bytes() == tx.to_bytes()
+        assert cache.get_transaction(tx_hash) is tx_loaded
+        # The parsed transaction is accounted for by it's serialized size.
+        assert cache._parsed_txdata_cache.get_sizes()[0] == len(tx.to_bytes())
+
+        # When the bytes are evicted, the parsed transaction goes with them.
+        cache.set_maximum_cache_size_for_bytedata(len(tx.to_bytes()) - 1, force_resize=True)
+        assert not cache.have_transaction_data_cached(tx_hash)
+        assert tx_hash not in cache._parsed_txdata_cache
+
+    @pytest.mark.timeout(5)
+    def test_add_transactions(self):
+        cache = TransactionCache(self.store)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        with SynchronousWriter() as writer:
+            cache.add([ (tx_1.hash(), TxData(height=1), None, TxFlags.Unset, None) ],
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+        # The existing transaction is updated, the new one is inserted.
+        tx_2 = Transaction.from_hex(tx_hex_2)
+        futures = cache.add_transactions([ (tx_1.hash(), tx_1, TxFlags.StateCleared),
+            (tx_2.hash(), tx_2, TxFlags.StateCleared) ])
+        # Each transaction is written separately.
+        assert [ tx_2.hash(), tx_1.hash() ] == [ tx_hash for tx_hash, _future in futures ]
+        for _tx_hash, future in futures:
+            future.result()
+
+        for tx in (tx_1, tx_2):
+            entry = cache.get_entry(tx.hash())
+            assert TxFlags.StateCleared | TxFlags.HasByteData == \
+                entry.flags & (TxFlags.STATE_MASK | TxFlags.HasByteData)
+            assert self.store.read_bytedata([ tx.hash() ]) == [ (tx.hash(), tx.to_bytes()) ]
+
     @pytest.mark.timeout(5)
     def test_add_transaction_update(self):
         cache = TransactionCache(self.store)
@@ -684,6 +743,122 @@ class TestTransactionCache:
         assert data_n3.fee == n3.metadata.fee
         assert TxFlags.StateDispatched | expected_flags == n3.flags, TxFlags.to_repr(n3.flags)
 
+    @pytest.mark.timeout(5)
+    def test_bounded_metadata_eviction(self) -> None:
+        cache = TransactionCache(self.store, metadata_cache_size=2)
+
+        txs = [ Transaction.from_hex(tx_hex) for tx_hex in (tx_hex_1, tx_hex_2, tx_hex_3) ]
+        for i, tx in enumerate(txs):
+            with SynchronousWriter() as writer:
+                cache.add([ (tx.hash(), TxData(height=i+1, position=i), tx,
+                    TxFlags.StateSettled, None) ], completion_callback=writer.get_callback())
+                assert writer.succeeded()
+
+        # The least recently used entry was evicted, but is reloaded from the store on demand.
+        assert 2 == len(cache._cache)
+        assert txs[0].hash() not in cache._cache
+        assert 1 == cache.get_height(txs[0].hash())
+        assert txs[0].hash() in cache._cache
+        assert txs[1].hash() not in cache._cache
+        assert 2 == len(cache._cache)
+
+        # Full matches include the entries that are not resident, without making them resident.
+        entries = cache.get_entries(TxFlags.StateSettled, TxFlags.STATE_MASK)
+        assert set(tx.hash() for tx in txs) == set(t[0] for t in entries)
+        assert 2 == len(cache._cache)
+
+        # A fresh cache reads nothing up front.
+        cache = TransactionCache(self.store, metadata_cache_size=2)
+        assert 0 == len(cache._cache)
+        assert cache.is_cached(txs[2].hash())
+        assert not cache.is_cached(bytes(32))
+
+    @pytest.mark.timeout(5)
+    def test_bounded_metadata_pending_writes(self) -> None:
+        cache = TransactionCache(self.store, metadata_cache_size=1)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        tx_2 = Transaction.from_hex(tx_hex_2)
+        for tx, height in ((tx_1, 1), (tx_2, 2)):
+            with SynchronousWriter() as writer:
+                cache.add([ (tx.hash(), TxData(height=height), tx, TxFlags.StateSettled, None) ],
+                    completion_callback=writer.get_callback())
+                assert writer.succeeded()
+        assert not cache._pending_writes
+        assert [ tx_2.hash() ] == list(cache._cache)
+
+        # Entries with uncommitted writes are never the ones evicted.
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        cache._track_write([ tx_2.hash() ], future)
+        assert 1 == cache.get_height(tx_1.hash())
+        assert [ tx_2.hash() ] == list(cache._cache)
+        future.set_result(None)
+        assert not cache._pending_writes
+        assert 1 == cache.get_height(tx_1.hash())
+        assert [ tx_1.hash() ] == list(cache._cache)
+
+        # An uncommitted deletion hides the store's row.
+        with SynchronousWriter() as writer:
+            cache.delete(tx_1.hash(), completion_callback=writer.get_callback())
+            assert not cache.is_cached(tx_1.hash())
+            assert writer.succeeded()
+        assert not cache.is_cached(tx_1.hash())
+        entries = cache.get_entries()
+        assert [ tx_2.hash() ] == [ t[0] for t in entries ]
+
+        # A modified entry that is evicted is reloaded with the change.
+        with SynchronousWriter() as writer:
+            cache.update_flags(tx_2.hash(), TxFlags.StateCleared, TxFlags.HasByteData,
+                completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        cache._cache.clear()
+        assert TxFlags.StateCleared == cache.get_flags(tx_2.hash()) & TxFlags.STATE_MASK
+
+        # Pinned entries are moved out of the way of later evictions.
+        other_cache = TransactionCache(self.store, metadata_cache_size=3)
+        tx_hashes = [ bytes([ i ]) * 32 for i in range(5) ]
+        future = concurrent.futures.Future()
+        other_cache._track_write(tx_hashes[:2], future)
+        for tx_hash in tx_hashes[:4]:
+            other_cache._set_entry(tx_hash, TransactionCacheEntry(TxData(), TxFlags.Unset))
+        assert [ tx_hashes[3], tx_hashes[0], tx_hashes[1] ] == list(other_cache._cache)
+        other_cache._set_entry(tx_hashes[4], TransactionCacheEntry(TxData(), TxFlags.Unset))
+        assert [ tx_hashes[0], tx_hashes[1], tx_hashes[4] ] == list(other_cache._cache)
+        future.set_result(None)
+
+
+    @pytest.mark.timeout(5)
+    def test_bounded_metadata_missing_cache(self) -> None:
+        cache = TransactionCache(self.store, metadata_cache_size=10)
+
+        tx_1 = Transaction.from_hex(tx_hex_1)
+        assert not cache.is_cached(tx_1.hash())
+        assert (0, 1) == cache.get_missing_cache_stats()
+        assert not cache.is_cached(tx_1.hash())
+        assert cache.get_flags(tx_1.hash()) is None
+        assert (2, 1) == cache.get_missing_cache_stats()
+
+        # Adding the transaction invalidates it's known absence.
+        with SynchronousWriter() as writer:
+            cache.add_transaction(tx_1.hash(), tx_1, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert cache.is_cached(tx_1.hash())
+
+        with SynchronousWriter() as writer:
+            cache.delete(tx_1.hash(), completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        assert not cache.is_cached(tx_1.hash())
+        assert (4, 1) == cache.get_missing_cache_stats()
+
+        # Reloading an evicted entry from the store is not the lookup of an unknown transaction.
+        tx_2 = Transaction.from_hex(tx_hex_2)
+        with SynchronousWriter() as writer:
+            cache.add_transaction(tx_2.hash(), tx_2, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+        stats = cache.get_missing_cache_stats()
+        cache._cache.clear()
+        assert cache.is_cached(tx_2.hash())
+        assert stats == cache.get_missing_cache_stats()
 
 class TestSqliteWriteDispatcher:
     @classmethod
@@ -749,3 +924,281 @@ class TestSqliteWriteDispatcher:
 
         assert _write_callback_called
 
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_future_success(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        future = concurrent.futures.Future()
+        self.dispatcher.put(WriteEntryType(lambda conn: None, None, 0, future))
+        assert future.result(timeout=4) is None
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_future_failure(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        class TestError(Exception):
+            pass
+
+        def _write_callback(conn):
+            raise TestError()
+
+        future = concurrent.futures.Future()
+        self.dispatcher.put(WriteEntryType(_write_callback, None, 0, future))
+        assert isinstance(future.exception(timeout=4), TestError)
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_future_not_cancellable(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        # Hold up the writer thread so that the write is still pending when it is cancelled.
+        blocking_event = threading.Event()
+        release_event = threading.Event()
+        def _blocking_write_callback(conn) -> None:
+            blocking_event.set()
+            release_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocking_event.wait()
+
+        future = concurrent.futures.Future()
+        self.dispatcher.put(WriteEntryType(lambda conn: None, None, 0, future))
+
+        async def _await_write() -> None:
+            await asyncio.wrap_future(future)
+
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.create_task(_await_write())
+            loop.run_until_complete(asyncio.sleep(0.1))
+            # Cancelling the awaiting coroutine does not cancel the write for other observers.
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                loop.run_until_complete(task)
+        finally:
+            loop.close()
+        assert not future.cancel()
+
+        release_event.set()
+        assert future.result(timeout=4) is None
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_bisects_failed_batch(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        # Hold up the writer thread so that the following writes are queued up as one batch.
+        blocking_event = threading.Event()
+        release_event = threading.Event()
+        def _blocking_write_callback(conn) -> None:
+            blocking_event.set()
+            release_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocking_event.wait()
+
+        class TestError(Exception):
+            pass
+
+        write_counts = [ 0 ] * 8
+        def _write_callback(index: int, conn) -> None:
+            write_counts[index] += 1
+            if index == 5:
+                raise TestError()
+
+        logger = unittest.mock.Mock()
+        self.dispatcher._logger = logger
+
+        futures = []
+        for i in range(8):
+            future = concurrent.futures.Future()
+            self.dispatcher.put(WriteEntryType(partial(_write_callback, i), None, 0, future))
+            futures.append(future)
+        release_event.set()
+
+        for i, future in enumerate(futures):
+            if i == 5:
+                assert isinstance(future.exception(timeout=4), TestError)
+            else:
+                assert future.result(timeout=4) is None
+        # The failing write is isolated: 8 -> 4 -> 2 -> 1.
+        assert write_counts[4:6] == [ 4, 4 ]
+        # Those in the healthy half were only retried as part of that half.
+        assert write_counts[:4] == [ 2, 2, 2, 2 ]
+        # Those after the failing write were never reached until their batch was bisected off.
+        assert write_counts[6:] == [ 1, 1 ]
+        # The error is only logged in full for the isolated failing write.
+        assert logger.exception.call_count == 1
+
+    def test_write_dispatcher_gather_batch_limits(self) -> None:
+        # This is not initialised so that there is no writer thread consuming the queued entries.
+        dispatcher = wallet_database.SqliteWriteDispatcher.__new__(
+            wallet_database.SqliteWriteDispatcher)
+        dispatcher._writer_queue = queue.Queue()
+        dispatcher.MAXIMUM_BATCH_ENTRIES = 5
+        dispatcher.TARGET_BATCH_BYTES = 1000
+
+        # Limited by the number of entries.
+        for i in range(7):
+            dispatcher._writer_queue.put(WriteEntryType(None, None, 10))
+        batch = dispatcher._gather_batch(WriteEntryType(None, None, 10))
+        assert len(batch) == 5
+        assert dispatcher._writer_queue.qsize() == 3
+
+        # Limited by the hinted size, where the batch includes the entry that reaches it.
+        dispatcher._writer_queue = queue.Queue()
+        for i in range(4):
+            dispatcher._writer_queue.put(WriteEntryType(None, None, 400))
+        batch = dispatcher._gather_batch(WriteEntryType(None, None, 400))
+        assert len(batch) == 3
+        assert dispatcher._writer_queue.qsize() == 2
+
+        # Limited by what is queued.
+        dispatcher._writer_queue = queue.Queue()
+        dispatcher._writer_queue.put(WriteEntryType(None, None, 0))
+        batch = dispatcher._gather_batch(WriteEntryType(None, None, 0))
+        assert len(batch) == 2
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_bounded_queue_backpressure(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context, 1)
+        self.dispatcher._writer_loop_event.wait()
+
+        # Hold up the writer thread and fill the queue.
+        blocking_event = threading.Event()
+        release_event = threading.Event()
+        def _blocking_write_callback(conn) -> None:
+            blocking_event.set()
+            release_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocking_event.wait()
+        self.dispatcher.put(WriteEntryType(lambda conn: None, None, 0))
+
+        future = concurrent.futures.Future()
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.create_task(self.dispatcher.put_async(
+                WriteEntryType(lambda conn: None, None, 0, future)))
+            loop.run_until_complete(asyncio.sleep(0.2))
+            # The producer is held back while the queue is full, without blocking the loop.
+            assert not task.done()
+
+            release_event.set()
+            loop.run_until_complete(task)
+        finally:
+            loop.close()
+        assert future.result(timeout=4) is None
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_bounded_queue_cancelled_producer(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context, 1)
+        self.dispatcher._writer_loop_event.wait()
+
+        blocking_event = threading.Event()
+        release_event = threading.Event()
+        def _blocking_write_callback(conn) -> None:
+            blocking_event.set()
+            release_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocking_event.wait()
+        self.dispatcher.put(WriteEntryType(lambda conn: None, None, 0))
+
+        future = concurrent.futures.Future()
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.create_task(self.dispatcher.put_async(
+                WriteEntryType(lambda conn: None, None, 0, future)))
+            loop.run_until_complete(asyncio.sleep(0.1))
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                loop.run_until_complete(task)
+        finally:
+            loop.close()
+
+        # The write was already queued, and is applied regardless of the producer going away.
+        assert not future.cancel()
+        release_event.set()
+        assert future.result(timeout=4) is None
+        assert not self.dispatcher._async_room_waiters
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_bounded_queue_blocks_thread(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context, 1)
+        self.dispatcher._writer_loop_event.wait()
+
+        blocking_event = threading.Event()
+        release_event = threading.Event()
+        def _blocking_write_callback(conn) -> None:
+            blocking_event.set()
+            release_event.wait()
+        self.dispatcher.put(WriteEntryType(_blocking_write_callback, None, 0))
+        blocking_event.wait()
+        self.dispatcher.put(WriteEntryType(lambda conn: None, None, 0))
+
+        put_event = threading.Event()
+        def _put() -> None:
+            self.dispatcher.put(WriteEntryType(lambda conn: None, None, 0))
+            put_event.set()
+        thread = threading.Thread(target=_put)
+        thread.start()
+        # The producer thread is held back while the queue is full.
+        assert not put_event.wait(0.2)
+
+        release_event.set()
+        assert put_event.wait(4)
+        thread.join()
+
+    # As we use threading pytest can deadlock if something errors. This will break the deadlock
+    # and display stacktraces.
+    @pytest.mark.timeout(5)
+    def test_write_dispatcher_stats(self) -> None:
+        self.dispatcher = wallet_database.SqliteWriteDispatcher(self.db_context)
+        self.dispatcher._writer_loop_event.wait()
+
+        def _write_callback(conn) -> None:
+            pass
+
+        def _failing_write_callback(conn) -> None:
+            raise Exception()
+
+        futures = []
+        for size_hint in (100, 200):
+            future = concurrent.futures.Future()
+            self.dispatcher.put(WriteEntryType(_write_callback, None, size_hint, future,
+                "TransactionTable"))
+            futures.append(future)
+        future = concurrent.futures.Future()
+        self.dispatcher.put(WriteEntryType(_write_callback, None, 0, future, "KeyInstanceTable"))
+        futures.append(future)
+        future = concurrent.futures.Future()
+        self.dispatcher.put(WriteEntryType(_failing_write_callback, None, 0, future,
+            "KeyInstanceTable"))
+        futures.append(future)
+        concurrent.futures.wait(futures, timeout=4)
+
+        stats = self.dispatcher.get_stats()
+        assert stats["queue_depth"] == 0
+        assert stats["maximum_queue_size"] == 0
+        assert stats["maximum_queue_depth"] >= 1
+        assert stats["write_count"] == 3
+        assert stats["failed_write_count"] == 1
+        assert sum(stats["batch_sizes"].values()) == stats["batch_count"]
+        assert sum(stats["commit_latency_ms"].values()) == stats["batch_count"]
+        # Successful writes are attributed to the table they were made by, sized or not.
+        assert stats["writes_by_table"] == { "TransactionTable": 2, "KeyInstanceTable": 1 }
+        assert stats["bytes_by_table"] == { "TransactionTable": 300, "KeyInstanceTable": 0 }
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import time
 import bitcoinx
@@ -11,15 +12,17 @@ except ModuleNotFoundError:
     # Windows builds use the official Python 3.7.8 builds and version of 3.31.1.
     import sqlite3 # type: ignore
 import tempfile
+import threading
 from typing import List
 
-from electrumsv.constants import (TxFlags, ScriptType, DerivationType, TransactionOutputFlag,
-    PaymentFlag, KeyInstanceFlag, WalletEventFlag, WalletEventType)
+from electrumsv.constants import (TxBytesEncoding, TxFlags, ScriptType, DerivationType,
+    TransactionOutputFlag, PaymentFlag, KeyInstanceFlag, WalletEventFlag, WalletEventType)
 from electrumsv.logs import logs
 from electrumsv.wallet_database import (migration, KeyInstanceTable, MasterKeyTable,
     PaymentRequestTable, TransactionTable, DatabaseContext, TransactionDeltaTable,
     TransactionOutputTable, SynchronousWriter, TxData, TxProof, AccountTable)
-from electrumsv.wallet_database.sqlite_support import LeakedSQLiteConnectionError
+from electrumsv.wallet_database.sqlite_support import (JournalModes,
+    LeakedSQLiteConnectionError, SqliteConnectionProfile)
 from electrumsv.wallet_database.tables import (AccountRow, InvoiceAccountRow, InvoiceRow,
     InvoiceTable, KeyInstanceRow, MAGIC_UNTOUCHED_BYTEDATA, MasterKeyRow, PaymentRequestRow,
     TransactionDeltaRow, TransactionDeltaKeySummaryRow, TransactionRow, TransactionOutputRow,
@@ -63,6 +66,49 @@ def test_migrations() -> None:
     migration.create_database_file(wallet_path)
 
 
+def test_migration_0027_secondary_indexes() -> None:
+    db_context = _db_context()
+    db = db_context.acquire_connection()
+    try:
+        index_names = { row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'") }
+        assert { "idx_KeyInstances_account_id", "idx_TransactionDeltas_tx_hash",
+            "idx_TransactionOutputs_keyinstance_id", "idx_Transactions_flags" } <= index_names
+        assert [ "flags", "block_height" ] == [ row[2] for row in
+            db.execute("PRAGMA index_info(idx_Transactions_flags)") ]
+
+        # The per-transaction delta lookup should seek rather than scan.
+        plan = [ row[3] for row in db.execute("EXPLAIN QUERY PLAN "+
+            TransactionDeltaTable.READ_SQL, [ b'' ]) ]
+        assert any("idx_TransactionDeltas_tx_hash" in line for line in plan)
+    finally:
+        db_context.release_connection(db)
+        db_context.close()
+
+
+def test_migration_0028_transaction_bytes() -> None:
+    from electrumsv.wallet_database import migrations
+    db = sqlite3.connect(":memory:", isolation_level=None)
+    migration.create_database(db)
+    for module in (migrations.migration_0023_add_wallet_events,
+            migrations.migration_0024_account_transactions, migrations.migration_0025_invoices,
+            migrations.migration_0026_txo_coinbase_flag,
+            migrations.migration_0027_secondary_indexes):
+        module.execute(db)
+
+    tx_bytes = os.urandom(100)
+    tx_hash = bitcoinx.double_sha256(tx_bytes)
+    db.executemany("INSERT INTO Transactions (tx_hash, tx_data, flags, date_created, "
+        "date_updated) VALUES (?, ?, ?, 1, 1)", [ (tx_hash, tx_bytes, TxFlags.HasByteData),
+        (os.urandom(32), None, TxFlags.Unset) ])
+    migrations.migration_0028_transaction_bytes.execute(db)
+
+    assert [ (tx_hash, TxBytesEncoding.RAW, tx_bytes) ] == \
+        db.execute("SELECT tx_hash, encoding, tx_data FROM TransactionBytes").fetchall()
+    assert [ (None,), (None,) ] == db.execute("SELECT tx_data FROM Transactions").fetchall()
+    db.close()
+
+
 @pytest.mark.timeout(8)
 def test_database_context() -> None:
     db_context = _db_context()
@@ -96,6 +142,103 @@ def test_database_context() -> None:
         conn.commit()
 
 
+def test_database_context_connection_profile(monkeypatch) -> None:
+    # The synchronous setting is only changed for the WAL journal mode the tests do not use.
+    monkeypatch.setattr(DatabaseContext, "JOURNAL_MODE", JournalModes.WAL)
+    wallet_path = os.path.join(tempfile.mkdtemp(), "wallet_create")
+    migration.create_database_file(wallet_path)
+    profile = SqliteConnectionProfile(mmap_size=1024 * 1024, cache_size_kib=512,
+        temp_store="FILE", synchronous="FULL", statement_cache_size=10)
+    db_context = DatabaseContext(wallet_path, profile=profile)
+    try:
+        db = db_context.get_read_connection()
+        assert db.execute("PRAGMA mmap_size").fetchone()[0] == 1024 * 1024
+        assert db.execute("PRAGMA cache_size").fetchone()[0] == -512
+        # 1 is FILE.
+        assert db.execute("PRAGMA temp_store").fetchone()[0] == 1
+        # 2 is FULL.
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 2
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        db_context.close()
+
+    # The default profile is applied otherwise, including to the writer thread's connection.
+    db_context = DatabaseContext(wallet_path)
+    try:
+        db_context._write_dispatcher._writer_loop_event.wait()
+        db = db_context._write_dispatcher._db
+        assert db.execute("PRAGMA mmap_size").fetchone()[0] == \
+            SqliteConnectionProfile().mmap_size
+        # 2 is MEMORY.
+        assert db.execute("PRAGMA temp_store").fetchone()[0] == 2
+        # 1 is NORMAL.
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+    finally:
+        db_context.close()
+
+
+def test_connection_profile_from_config() -> None:
+    class MockConfig(dict):
+        pass
+
+    assert SqliteConnectionProfile.from_config(MockConfig()) == SqliteConnectionProfile()
+
+    profile = SqliteConnectionProfile.from_config(MockConfig(sqlite_mmap_size="0",
+        sqlite_cache_size_kib=100, sqlite_temp_store="file", sqlite_synchronous="full",
+        sqlite_statement_cache_size=5))
+    assert profile == SqliteConnectionProfile(0, 100, "FILE", "FULL", 5)
+
+    # Values that would be invalid pragma arguments are ignored.
+    profile = SqliteConnectionProfile.from_config(MockConfig(sqlite_temp_store="X; DROP",
+        sqlite_synchronous="SOMETIMES"))
+    assert profile.temp_store == SqliteConnectionProfile().temp_store
+    assert profile.synchronous == SqliteConnectionProfile().synchronous
+
+
+@pytest.mark.timeout(8)
+def test_database_context_read_connections() -> None:
+    db_context = _db_context()
+    try:
+        # Each thread keeps the same connection, shared by all stores it uses.
+        db = db_context.get_read_connection()
+        assert db_context.get_read_connection() is db
+        with MasterKeyTable(db_context) as table1, AccountTable(db_context) as table2:
+            assert table1._db is db
+            assert table2._db is db
+
+        thread_connections: List[sqlite3.Connection] = []
+        def thread_main() -> None:
+            thread_connections.append(db_context.get_read_connection())
+            thread_connections.append(db_context.get_read_connection())
+
+        thread = threading.Thread(target=thread_main)
+        thread.start()
+        thread.join()
+        assert thread_connections[0] is thread_connections[1]
+        assert thread_connections[0] is not db
+        assert db_context.get_read_connection_count() == 2
+
+        # The exited thread's connection is reused rather than a new one being created.
+        thread = threading.Thread(target=thread_main)
+        thread.start()
+        thread.join()
+        assert thread_connections[2] is thread_connections[0]
+        assert db_context.get_read_connection_count() == 2
+    finally:
+        db_context.close()
+
+    # All the read connections are closed with the context.
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
+
+
+def test_database_context_unclosed_store() -> None:
+    db_context = _db_context()
+    MasterKeyTable(db_context)
+    with pytest.raises(LeakedSQLiteConnectionError):
+        db_context.close()
+
+
 @pytest.mark.timeout(8)
 def test_table_masterkeys_crud(db_context: DatabaseContext) -> None:
     table = MasterKeyTable(db_context)
@@ -504,6 +647,33 @@ class TestTransactionTable:
         assert metadata_1 == metadata_2
         assert bytedata_1 == bytedata_2
 
+    @pytest.mark.timeout(8)
+    def test_create_async(self) -> None:
+        bytedata_1 = os.urandom(10)
+        tx_hash = bitcoinx.double_sha256(bytedata_1)
+        metadata_1 = TxData(height=None, fee=None, position=None, date_added=1, date_updated=1)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.store.create_async(
+                [ (tx_hash, metadata_1, bytedata_1, TxFlags.StateCleared, None) ]))
+        finally:
+            loop.close()
+
+        # The write has been committed by the time the awaited coroutine returns.
+        _tx_hash, bytedata_2, _flags, metadata_2 = self.store.read(tx_hashes=[tx_hash])[0]
+        assert metadata_1 == metadata_2
+        assert bytedata_1 == bytedata_2
+        assert self.db_context.get_stats()["bytes_by_table"]["TransactionTable"] >= 10
+
+        # A failed write surfaces as an exception in the awaiting coroutine.
+        loop = asyncio.new_event_loop()
+        try:
+            with pytest.raises(sqlite3.IntegrityError):
+                loop.run_until_complete(self.store.create_async(
+                    [ (tx_hash, metadata_1, bytedata_1, TxFlags.StateCleared, None) ]))
+        finally:
+            loop.close()
+
     @pytest.mark.timeout(8)
     def test_create2(self) -> None:
         to_add = []
@@ -550,6 +720,30 @@ class TestTransactionTable:
                     assert bytedata_get == update_tx_bytes
                     continue
 
+    @pytest.mark.timeout(8)
+    def test_create_compressed_bytedata(self) -> None:
+        compressible_bytes = os.urandom(32) * 100
+        incompressible_bytes = os.urandom(3200)
+        tx_data = TxData(height=None, fee=2, position=None, date_added=1, date_updated=1)
+        to_add = []
+        for tx_bytes in (compressible_bytes, incompressible_bytes):
+            tx_hash = bitcoinx.double_sha256(tx_bytes)
+            to_add.append((tx_hash, tx_data, tx_bytes, TxFlags.HasByteData, None))
+        with SynchronousWriter() as writer:
+            self.store.create(to_add, completion_callback=writer.get_callback())
+            assert writer.succeeded()
+
+        # Only bytes that benefit from compression are stored compressed.
+        encodings = dict(self.store._db.execute(
+            "SELECT tx_hash, encoding FROM TransactionBytes").fetchall())
+        assert encodings == { to_add[0][0]: TxBytesEncoding.ZLIB,
+            to_add[1][0]: TxBytesEncoding.RAW }
+
+        tx_hashes = [ row[0] for row in to_add ]
+        assert { row[0]: row[1] for row in self.store.read(tx_hashes=tx_hashes) } == \
+            { row[0]: row[2] for row in to_add }
+        assert dict(self.store.read_bytedata(tx_hashes)) == { row[0]: row[2] for row in to_add }
+
     @pytest.mark.timeout(8)
     def test_update__entry_with_set_bytedata_flag(self):
         tx_bytes = os.urandom(10)
@@ -1114,6 +1308,13 @@ def test_table_transactiondeltas_crud(db_context: DatabaseContext) -> None:
     assert hrows[0].tx_flags != TxFlags.HasByteData | TxFlags.HasHeight | TxFlags.HasFee
     assert hrows[0].value_delta == hrow_sum
 
+    krows = table.read_key_history(ACCOUNT_ID, [ KEYINSTANCE_ID, KEYINSTANCE_ID+2 ])
+    assert { (TX_HASH, KEYINSTANCE_ID), (TX_HASH, KEYINSTANCE_ID+2) } == set(krows)
+    assert [] == table.read_key_history(ACCOUNT_ID_OTHER, [ KEYINSTANCE_ID ])
+    assert { KEYINSTANCE_ID, KEYINSTANCE_ID+1, KEYINSTANCE_ID+2 } == \
+        set(table.read_transaction_keys(ACCOUNT_ID, TX_HASH))
+    assert [] == table.read_transaction_keys(ACCOUNT_ID, TX_HASH2)
+
     srows = table.read_key_summary(ACCOUNT_ID)
     assert srows is not None
     assert len(srows) == 3
@@ -25,14 +25,14 @@
 import enum
 from io import BytesIO
 import struct
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
 
 import attr
 from bitcoinx import (
     Address, base58_encode_check, bip32_key_from_string, BIP32PublicKey, classify_output_script,
     der_signature_to_compact, double_sha256, hash160, hash_to_hex_str, InvalidSignatureError,
     Ops, P2PK_Output, P2SH_Address, pack_byte, pack_le_int32, pack_le_uint32, pack_list,
-    PrivateKey, PublicKey, push_int, push_item, Script, SigHash, Tx, TxInput, TxOutput,
+    PublicKey, push_int, push_item, Script, Tx, TxInput, TxOutput,
     read_le_uint32, read_le_int32, read_le_int64, read_list, read_varbytes, unpack_le_uint16,
 )
 
@@ -41,6 +41,7 @@ from .constants import ScriptType
 from .logs import logs
 from .networks import Net
 from .script import AccumulatorMultiSigOutput
+from .signing import sign_hashes, SigningEngine
 
 NO_SIGNATURE = b'\xff'
 dummy_public_key = PublicKey.from_bytes(bytes(range(3, 36)))
@@ -75,6 +76,13 @@ class TransactionContext:
     invoice_id: Optional[int] = attr.ib(default=None)
 
 
+class SignatureHashMidstate(NamedTuple):
+    "The parts of the signature hash preimage that are the same for every input of a transaction."
+    hash_prevouts: bytes
+    hash_sequence: bytes
+    hash_outputs: bytes
+
+
 class XPublicKeyType(enum.IntEnum):
     UNKNOWN = 0
     OLD = 1
@@ -511,7 +519,70 @@ def txdict_from_str(txt: str) -> Dict[str, Any]:
     return tx_dict
 
 
-# ...
+def _varint_size(value: int) -> int:
+    if value < 253:
+        return 1
+    if value <= 0xffff:
+        return 3
+    if value <= 0xffffffff:
+        return 5
+    return 9
+
+
+class TransactionSizeEstimator:
+    """
+    The estimated serialized size of a transaction, tracked as inputs and outputs are added and
+    removed so that it does not need to be recalculated from the whole transaction. The inputs
+    are sized as if they were signed.
+    """
+    __slots__ = ("_input_count", "_input_size", "_output_count", "_output_size")
+
+    # The version and the locktime.
+    BASE_SIZE = 8
+
+    def __init__(self) -> None:
+        self._input_count = 0
+        self._input_size = 0
+        self._output_count = 0
+        self._output_size = 0
+
+    @classmethod
+    def from_transaction(cls, tx: 'Transaction') -> 'TransactionSizeEstimator':
+        estimator = cls()
+        for txin in tx.inputs:
+            estimator.add_input(txin.estimated_size())
+        for output in tx.outputs:
+            estimator.add_output(len(output.to_bytes()))
+        return estimator
+
+    def add_input(self, size: int, count: int=1) -> None:
+        self._input_count += count
+        self._input_size += size
+
+    def remove_input(self, size: int, count: int=1) -> None:
+        assert self._input_count >= count and self._input_size >= size
+        self._input_count -= count
+        self._input_size -= size
+
+    def add_output(self, size: int, count: int=1) -> None:
+        self._output_count += count
+        self._output_size += size
+
+    def remove_output(self, size: int, count: int=1) -> None:
+        assert self._output_count >= count and self._output_size >= size
+        self._output_count -= count
+        self._output_size -= size
+
+    def size(self) -> int:
+        return self.size_with()
+
+    def size_with(self, input_count: int=0, input_size: int=0, output_count: int=0,
+            output_size: int=0) -> int:
+        "The size the transaction would be with the given inputs and outputs added to it."
+        input_count += self._input_count
+        output_count += self._output_count
+        return (self.BASE_SIZE + _varint_size(input_count) + self._input_size + input_size +
+            _varint_size(output_count) + self._output_size + output_size)
 
 
 @attr.s(slots=True)
@@ -631,13 +702,37 @@ class Transaction(Tx):
         '''Hash type in hex.'''
         return 0x01 | cls.SIGHASH_FORKID
 
-    def preimage_hash(self, txin):
-        input_index = self.inputs.index(txin)
+    def signature_hash_midstate(self) -> SignatureHashMidstate:
+        """
+        The hashes of the prevouts, sequences and outputs, which only need to be calculated once
+        for all the inputs signed with our hash type (ALL|FORKID). Adding signatures does not
+        change any of them.
+        """
+        return SignatureHashMidstate(self._hash_prevouts(), self._hash_sequence(),
+            self._hash_outputs())
+
+    def preimage_hash(self, txin: XTxInput, input_index: Optional[int]=None,
+            midstate: Optional[SignatureHashMidstate]=None) -> bytes:
+        if input_index is None:
+            input_index = self.inputs.index(txin)
+        if midstate is None:
+            midstate = self.signature_hash_midstate()
+        assert txin.value is not None and txin.value >= 0, f"invalid input value {txin.value}"
         script_code = bytes.fromhex(self.get_preimage_script(txin))
-        sighash = SigHash(self.nHashType())
         # Original BTC algorithm: https://en.bitcoin.it/wiki/OP_CHECKSIG
         # Current algorithm: https://github.com/moneybutton/bips/blob/master/bip-0143.mediawiki
-        return self.signature_hash(input_index, txin.value, script_code, sighash=sighash)
+        # This is the same preimage as `signature_hash` constructs for our hash type, but with
+        # the hashes that are common to all inputs provided by the caller.
+        preimage = b''.join((
+            pack_le_int32(self.version),
+            midstate.hash_prevouts,
+            midstate.hash_sequence,
+            txin.to_bytes_for_signature(txin.value, script_code),
+            midstate.hash_outputs,
+            pack_le_uint32(self.locktime),
+            pack_le_uint32(self.nHashType()),
+        ))
+        return double_sha256(preimage)
 
     def serialize(self) -> str:
         return self.to_bytes().hex()
@@ -665,12 +760,7 @@ class Transaction(Tx):
 
     def estimated_size(self) -> int:
         '''Return an estimated tx size in bytes.'''
-        saved_inputs = self.inputs
-        self.inputs: List[XTxInput] = []
-        size_without_inputs = len(self.to_bytes())
-        self.inputs = saved_inputs
-        input_size = sum(txin.estimated_size() for txin in self.inputs)
-        return size_without_inputs + input_size
+        return TransactionSizeEstimator.from_transaction(self).size()
 
     def signature_count(self) -> Tuple[int, int]:
         r = 0
@@ -681,24 +771,39 @@ class Transaction(Tx):
             r += txin.threshold
         return s, r
 
-    def sign(self, keypairs: Dict[XPublicKey, Tuple[bytes, bool]]) -> None:
+    def sign(self, keypairs: Dict[XPublicKey, Tuple[bytes, bool]],
+            engine: Optional[SigningEngine]=None) -> None:
+        """
+        Add the signatures for the given keys to the inputs. If an engine is given, it is used to
+        make the signatures, so that large numbers of them can be made across worker processes.
+        """
         assert all(isinstance(key, XPublicKey) for key in keypairs)
-        for txin in self.inputs:
+        midstate = self.signature_hash_midstate()
+        # The (input index, signature index) position of each signature to be made.
+        positions: List[Tuple[int, int]] = []
+        private_keys: List[bytes] = []
+        hashes: List[bytes] = []
+        for input_index, txin in enumerate(self.inputs):
             if txin.is_complete():
                 continue
+            pre_hash: Optional[bytes] = None
             for j, x_pubkey in enumerate(txin.x_pubkeys):
                 if x_pubkey in keypairs:
-                    logger.debug("adding signature for %s", x_pubkey)
-                    sec, compressed = keypairs[x_pubkey]
-                    txin.signatures[j] = self._sign_txin(txin, sec)
+                    if pre_hash is None:
+                        pre_hash = self.preimage_hash(txin, input_index, midstate)
+                    positions.append((input_index, j))
+                    private_keys.append(keypairs[x_pubkey][0])
+                    hashes.append(pre_hash)
+
+        logger.debug("adding %d signatures", len(hashes))
+        if engine is None:
+            signatures = sign_hashes(private_keys, hashes, self.nHashType())
+        else:
+            signatures = engine.sign_hashes(private_keys, hashes, self.nHashType())
+        for (input_index, j), signature in zip(positions, signatures):
+            self.inputs[input_index].signatures[j] = signature
         logger.debug("is_complete %s", self.is_complete())
 
-    def _sign_txin(self, txin: XTxInput, privkey_bytes: bytes) -> bytes:
-        pre_hash = self.preimage_hash(txin)
-        privkey = PrivateKey(privkey_bytes)
-        sig = privkey.sign(pre_hash, None)
-        return sig + pack_byte(self.nHashType())
-
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Transaction':
         version = data.get('version', 0)
@@ -1,9 +1,8 @@
 import sys
 from threading import RLock
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from .misc import obj_size
-from ..transaction import Transaction
 from ..constants import MAXIMUM_TXDATA_CACHE_SIZE_MB, MINIMUM_TXDATA_CACHE_SIZE_MB
 
 
@@ -11,21 +10,32 @@ class Node:
     previous: 'Node'
     next: 'Node'
     key: bytes
-    value: Transaction
+    value: Any
+    size: int
 
     def __init__(self, previous: Optional['Node']=None, next: Optional['Node']=None,
-            key: bytes=b'', value=None) -> None:
+            key: bytes=b'', value: Any=None, size: int=0) -> None:
         self.previous = previous if previous is not None else self
         self.next = previous if previous is not None else self
         self.key = key
         self.value = value
+        self.size = size
+
+
+def get_value_size(value: Any) -> int:
+    # Serialized data is sized directly, anything else needs it's object graph walked.
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return obj_size(value)
 
 
 # Derived from functools.lrucache, LRUCache should be considered licensed under Python license.
 # This intentionally does not have a dictionary interface for now.
 class LRUCache:
-    def __init__(self, max_count: Optional[int]=None, max_size: Optional[int]=None) -> None:
+    def __init__(self, max_count: Optional[int]=None, max_size: Optional[int]=None,
+            size_func: Callable[[Any], int]=get_value_size) -> None:
         self._cache: Dict[bytes, Node] = {}
+        self._size_func = size_func
 
         assert max_count is not None or max_size is not None, "need some limit"
         if max_size is None:
@@ -42,18 +52,19 @@ class LRUCache:
         # This will be a node in a bi-directional circular linked list with itself as sole entry.
         self._root = Node()
 
-    def set_maximum_size(self, maximum_size: int, resize: bool=True) -> None:
+    def set_maximum_size(self, maximum_size: int, resize: bool=True) -> List[Tuple[bytes, Any]]:
         self._max_size = maximum_size
         if resize:
             with self._lock:
-                self._resize()
+                return self._resize()
+        return []
 
     def get_sizes(self) -> Tuple[int, int]:
         return (self.current_size, self._max_size)
 
-    def _add(self, key: bytes, value: Transaction, size: int) -> Node:
+    def _add(self, key: bytes, value: Any, size: int) -> Node:
         most_recent_node = self._root.previous
-        new_node = Node(most_recent_node, self._root, key, value)
+        new_node = Node(most_recent_node, self._root, key, value, size)
         most_recent_node.next = self._root.previous = self._cache[key] = new_node
         self.current_size += size
         return new_node
@@ -64,10 +75,15 @@ class LRUCache:
     def __contains__(self, key: bytes) -> bool:
         return key in self._cache
 
-    def set(self, key: bytes, value: Optional[Transaction]) -> Tuple[bool, List[Tuple[
-            bytes, Transaction]]]:
+    def set(self, key: bytes, value: Optional[Any], size: Optional[int]=None) \
+            -> Tuple[bool, List[Tuple[bytes, Any]]]:
+        """
+        Set the value for the key, or remove it if the value is `None`. The size is given by the
+        cache's size function, unless the caller already knows it. Returns whether the value was
+        added, and the key and value for every entry that was removed to make room for it.
+        """
         added = False
-        removals: List[Tuple[bytes, Transaction]] = []
+        removals: List[Tuple[bytes, Any]] = []
         with self._lock:
             node = self._cache.get(key, None)
             if node is not None:
@@ -75,11 +91,12 @@ class LRUCache:
                 assert value != old_value, "duplicate set not supported"
                 previous_node.next = next_node
                 next_node.previous = previous_node
-                self.current_size -= obj_size(old_value)
+                self.current_size -= node.size
                 del self._cache[key]
                 removals.append((key, old_value))
 
-            size = obj_size(value)
+            if size is None:
+                size = self._size_func(value) if value is not None else 0
             if value is not None and size <= self._max_size:
                 added_node = self._add(key, value, size)
                 a, b, c, d = len(self._cache)-1, self._max_count, self.current_size, self._max_size
@@ -91,7 +108,7 @@ class LRUCache:
 
         return added, removals
 
-    def get(self, key: bytes) -> Optional[Transaction]:
+    def get(self, key: bytes) -> Optional[Any]:
         with self._lock:
             node = self._cache.get(key)
             if node is not None:
@@ -107,8 +124,8 @@ class LRUCache:
             self.misses += 1
         return None
 
-    def _resize(self) -> List[Tuple[bytes, Transaction]]:
-        removals = []
+    def _resize(self) -> List[Tuple[bytes, Any]]:
+        removals: List[Tuple[bytes, Any]] = []
         # Discount the root node when considering count.
         while len(self._cache) > self._max_count or self.current_size > self._max_size:
             node = self._root.next
@@ -116,7 +133,7 @@ class LRUCache:
                 node.previous, node.next, node.key, node.value
             previous_node.next = next_node
             next_node.previous = previous_node
-            self.current_size -= obj_size(discard_value)
+            self.current_size -= node.size
             del self._cache[discard_key]
             removals.append((discard_key, discard_value))
         return removals
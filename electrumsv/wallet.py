@@ -27,7 +27,11 @@
 #   - StandardAccount: one keystore, P2PKH
 #   - MultisigAccount: several keystores, P2SH
 
+import array
+import asyncio
+import bisect
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from functools import partial
 import itertools
@@ -36,13 +40,14 @@ import os
 import random
 import threading
 import time
-from typing import (Any, cast, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple,
-    TypeVar, TYPE_CHECKING, Union)
+from typing import (Any, Callable, cast, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+    Sequence, Set, Tuple, TypeVar, TYPE_CHECKING, Union)
 import weakref
 
 import attr
 from bitcoinx import (Address, PrivateKey, PublicKey, hash_to_hex_str, hash160, hex_str_to_hash,
-    MissingHeader, Ops, P2MultiSig_Output, P2PK_Output, P2SH_Address, pack_byte, push_item, Script)
+    MissingHeader, Ops, P2MultiSig_Output, P2PK_Output, P2PKH_Address, P2SH_Address, pack_byte,
+    push_item, Script)
 
 from . import coinchooser
 from .app_state import app_state
@@ -58,17 +63,19 @@ from .exceptions import (ExcessiveFee, NotEnoughFunds, UserCancelled, UnknownTra
 from .i18n import _
 from .keystore import (DerivablePaths, Deterministic_KeyStore, Hardware_KeyStore, Imported_KeyStore,
     instantiate_keystore, KeyStore, Multisig_KeyStore, MultisigChildKeyStoreTypes,
-    SignableKeystoreTypes, StandardKeystoreTypes, Xpub)
+    SignableKeystoreTypes, SigningSession, Software_KeyStore, StandardKeystoreTypes, Xpub)
+from .key_derivation import DerivedKeys, KeyDerivationEngine
 from .logs import logs
 from .networks import Net
 from .script import AccumulatorMultiSigOutput
 from .services import InvoiceService, KeyService, RequestService
+from .signing import SigningEngine
 from .simple_config import SimpleConfig
 from .storage import WalletStorage
 from .transaction import (Transaction, TransactionContext, NO_SIGNATURE, XPublicKey,
     XPublicKeyType, XTxInput, XTxOutput)
 from .types import TxoKeyType
-from .util import (format_satoshis, get_wallet_name_from_path, profiler, timestamp_to_datetime,
+from .util import (format_satoshis, get_wallet_name_from_path, timestamp_to_datetime,
     TriggeredCallbacks)
 from .wallet_database import TxData, TxProof, TransactionCacheEntry, TransactionCache
 from .wallet_database.tables import (AccountRow, AccountTable, InvoiceTable,
@@ -76,7 +83,8 @@ from .wallet_database.tables import (AccountRow, AccountTable, InvoiceTable,
     TransactionOutputTable, TransactionOutputRow, TransactionDeltaTable, TransactionDeltaRow,
     TransactionDeltaSumRow, PaymentRequestTable, PaymentRequestRow, WalletEventRow,
     WalletEventTable)
-from .wallet_database.sqlite_support import CompletionCallbackType, DatabaseContext
+from .wallet_database.sqlite_support import (CompletionCallbackType, DatabaseContext,
+    WriteFutureType)
 
 if TYPE_CHECKING:
     from .network import Network
@@ -100,8 +108,11 @@ class BIP32KeyData:
     script_pubkey: bytes
 
 
+HistorySortKey = Tuple[float, int]
+
+
 class HistoryLine(NamedTuple):
-    sort_key: Tuple[int, int]
+    sort_key: HistorySortKey
     tx_hash: bytes
     tx_flags: TxFlags
     height: Optional[int]
@@ -151,46 +162,325 @@ class UTXO:
         )
 
 
-class SyncState:
-    def __init__(self) -> None:
-        self._key_history: Dict[int, List[Tuple[str, int]]] = {}
-        self._tx_keys: Dict[str, Set[int]] = {}
+KeyHistoryLoaderType = Callable[[Sequence[int]], Dict[int, List[Tuple[bytes, int]]]]
+
+
+class KeyHistory:
+    """
+    The (tx_hash, height) entries in the history of a key. The hashes are stored concatenated and
+    the heights in an array, as there can be millions of these entries in a large wallet.
+    """
+    __slots__ = ("_tx_hashes", "_heights")
+
+    def __init__(self, entries: Iterable[Tuple[bytes, int]]=()) -> None:
+        tx_hashes: List[bytes] = []
+        self._heights = array.array('i')
+        for tx_hash, height in entries:
+            tx_hashes.append(tx_hash)
+            self._heights.append(height)
+        self._tx_hashes = b''.join(tx_hashes)
+
+    def __len__(self) -> int:
+        return len(self._heights)
+
+    def __iter__(self) -> Iterator[Tuple[bytes, int]]:
+        tx_hashes = self._tx_hashes
+        for i, height in enumerate(self._heights):
+            yield tx_hashes[i*32:(i+1)*32], height
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, KeyHistory):
+            return self._tx_hashes == other._tx_hashes and self._heights == other._heights
+        return NotImplemented
 
-    def get_key_history(self, key_id: int) -> List[Tuple[str, int]]:
-        return self._key_history.get(key_id, [])
+    def get_tx_hashes(self) -> Set[bytes]:
+        tx_hashes = self._tx_hashes
+        return set(tx_hashes[i:i+32] for i in range(0, len(tx_hashes), 32))
 
-    def set_key_history(self, key_id: int, history: List[Tuple[str, int]]) \
-            -> Tuple[Set[str], Set[str]]:
-        old_history = self._key_history.get(key_id, [])
+
+_EMPTY_KEY_HISTORY = KeyHistory()
+
+
+class SyncState:
+    """
+    The history of each key as last obtained from the server. The history of a key is only loaded
+    from the database when it is first needed, which is generally when the key's status is being
+    checked against the server.
+    """
+
+    def __init__(self, loader: Optional[KeyHistoryLoaderType]=None) -> None:
+        self._key_history: Dict[int, KeyHistory] = {}
+        # The keys for each transaction, where most transactions are for a single key.
+        self._tx_keys: Dict[bytes, Union[int, Set[int]]] = {}
+        self._loader = loader
+        self._lock = threading.RLock()
+
+    def load_key_histories(self, key_ids: Iterable[int]) -> None:
+        "Load the history for any of the given keys that have not been loaded."
+        with self._lock:
+            unloaded_key_ids = [ key_id for key_id in key_ids if key_id not in self._key_history ]
+            if self._loader is None or not len(unloaded_key_ids):
+                return
+            histories = self._loader(unloaded_key_ids)
+            for key_id in unloaded_key_ids:
+                self._set_key_history(key_id, KeyHistory(histories.get(key_id, [])))
+
+    def get_key_history(self, key_id: int) -> KeyHistory:
+        with self._lock:
+            if key_id not in self._key_history:
+                self.load_key_histories([ key_id ])
+            return self._key_history.get(key_id, _EMPTY_KEY_HISTORY)
+
+    def set_key_history(self, key_id: int, history: Iterable[Tuple[bytes, int]]) \
+            -> Tuple[Set[bytes], Set[bytes]]:
+        with self._lock:
+            return self._set_key_history(key_id, KeyHistory(history))
+
+    def _set_key_history(self, key_id: int, history: KeyHistory) \
+            -> Tuple[Set[bytes], Set[bytes]]:
+        old_history = self._key_history.get(key_id, _EMPTY_KEY_HISTORY)
         self._key_history[key_id] = history
 
-        old_tx_ids = set(t[0] for t in old_history)
-        new_tx_ids = set(t[0] for t in history)
+        old_tx_hashes = old_history.get_tx_hashes()
+        new_tx_hashes = history.get_tx_hashes()
+
+        removed_tx_hashes = old_tx_hashes - new_tx_hashes
+        added_tx_hashes = new_tx_hashes - old_tx_hashes
+
+        for tx_hash in removed_tx_hashes:
+            tx_keys = self._tx_keys[tx_hash]
+            if isinstance(tx_keys, int):
+                del self._tx_keys[tx_hash]
+                continue
+            tx_keys.remove(key_id)
+            if len(tx_keys) == 1:
+                self._tx_keys[tx_hash] = tx_keys.pop()
+
+        for tx_hash in added_tx_hashes:
+            tx_keys = self._tx_keys.get(tx_hash)
+            if tx_keys is None:
+                self._tx_keys[tx_hash] = key_id
+            elif isinstance(tx_keys, int):
+                self._tx_keys[tx_hash] = { tx_keys, key_id }
+            else:
+                tx_keys.add(key_id)
+
+        return removed_tx_hashes, added_tx_hashes
+
+    def get_transaction_key_ids(self, tx_hash: bytes) -> Set[int]:
+        "The loaded keys that have the given transaction in their history."
+        with self._lock:
+            tx_keys = self._tx_keys.get(tx_hash)
+            if tx_keys is None:
+                return set()
+            if isinstance(tx_keys, int):
+                return { tx_keys }
+            return set(tx_keys)
+
+
+def get_history_sort_key(metadata: TxData) -> Optional[HistorySortKey]:
+    "Where the transaction is placed in the history, or `None` if it is not part of it."
+    # Signed but not cleared.
+    if metadata.height is None:
+        return None
+    if metadata.position is not None:
+        return metadata.height, metadata.position
+    if metadata.height > 0:
+        return metadata.height, metadata.date_added
+    return 1e9, metadata.date_added
+
 
-        removed_tx_ids = old_tx_ids - new_tx_ids
-        added_tx_ids = new_tx_ids - old_tx_ids
+# tx_hash, sort_key, height, value_delta, balance
+AccountHistoryEntry = Tuple[bytes, HistorySortKey, int, int, int]
 
-        for tx_id in removed_tx_ids:
-            self._tx_keys[tx_id].remove(key_id)
+class AccountHistory:
+    """
+    The transactions that affect an account in history order, with the running balance after
+    each. It is updated as the value and metadata of each transaction change, so that windows of
+    the history can be read without reading and sorting all of it every time.
+    """
 
-        for tx_id in added_tx_ids:
-            if tx_id not in self._tx_keys:
-                self._tx_keys[tx_id] = set()
-            self._tx_keys[tx_id].add(key_id)
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        # The transactions the account has value deltas for, including those that are not
+        # part of the history yet: tx_hash -> (sort_key, height, value_delta)
+        self._entries: Dict[bytes, Tuple[Optional[HistorySortKey], Optional[int], int]] = {}
+        self._order: List[Tuple[HistorySortKey, bytes]] = []
+        # The running balances after each ordered transaction. Only those before the first
+        # change since they were last calculated are valid.
+        self._balances: List[int] = []
+        self._valid_balance_count = 0
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def set_transaction(self, tx_hash: bytes, metadata: TxData, value_delta: int) -> None:
+        with self._lock:
+            self._set_entry(tx_hash, get_history_sort_key(metadata), metadata.height,
+                value_delta)
+
+    def add_value_delta(self, tx_hash: bytes, metadata: TxData, value_delta: int) -> None:
+        with self._lock:
+            entry = self._entries.get(tx_hash)
+            if entry is not None:
+                value_delta += entry[2]
+            self._set_entry(tx_hash, get_history_sort_key(metadata), metadata.height,
+                value_delta)
+
+    def update_metadata(self, tx_hash: bytes, metadata: TxData) -> None:
+        with self._lock:
+            entry = self._entries.get(tx_hash)
+            if entry is not None:
+                self._set_entry(tx_hash, get_history_sort_key(metadata), metadata.height,
+                    entry[2])
+
+    def remove_transaction(self, tx_hash: bytes) -> None:
+        with self._lock:
+            entry = self._entries.pop(tx_hash, None)
+            if entry is not None and entry[0] is not None:
+                self._remove_order(entry[0], tx_hash)
 
-        return removed_tx_ids, added_tx_ids
+    def have_transaction(self, tx_hash: bytes) -> bool:
+        with self._lock:
+            return tx_hash in self._entries
+
+    def get_entries(self, offset: int=0,
+            count: Optional[int]=None) -> List[AccountHistoryEntry]:
+        "A window of the history, most recent first."
+        with self._lock:
+            end_index = len(self._order) - offset
+            start_index = 0 if count is None else max(end_index - count, 0)
+            return self._get_entries(start_index, end_index)
+
+    def get_height_range_entries(self, from_height: int,
+            to_height: Optional[int]=None) -> List[AccountHistoryEntry]:
+        """
+        The history at or above `from_height` and below `to_height`, most recent first. If there
+        is no `to_height`, unconfirmed transactions are included.
+        """
+        with self._lock:
+            start_index = bisect.bisect_left(self._order, ((from_height,), b''))
+            end_index = len(self._order) if to_height is None else \
+                bisect.bisect_left(self._order, ((to_height,), b''))
+            return self._get_entries(start_index, end_index)
+
+    def _get_entries(self, start_index: int, end_index: int) -> List[AccountHistoryEntry]:
+        if start_index >= end_index:
+            return []
+        self._update_balances(end_index)
+        results: List[AccountHistoryEntry] = []
+        for index in range(end_index-1, start_index-1, -1):
+            sort_key, tx_hash = self._order[index]
+            _sort_key, height, value_delta = self._entries[tx_hash]
+            results.append((tx_hash, sort_key, cast(int, height), value_delta,
+                self._balances[index]))
+        return results
+
+    def _update_balances(self, end_index: int) -> None:
+        index = self._valid_balance_count
+        balance = self._balances[index-1] if index > 0 else 0
+        while index < end_index:
+            balance += self._entries[self._order[index][1]][2]
+            self._balances[index] = balance
+            index += 1
+        self._valid_balance_count = max(self._valid_balance_count, end_index)
+
+    def _set_entry(self, tx_hash: bytes, sort_key: Optional[HistorySortKey],
+            height: Optional[int], value_delta: int) -> None:
+        old_entry = self._entries.get(tx_hash)
+        self._entries[tx_hash] = sort_key, height, value_delta
+        if old_entry is not None and old_entry[0] is not None:
+            self._remove_order(old_entry[0], tx_hash)
+        if sort_key is not None:
+            index = bisect.bisect_left(self._order, (sort_key, tx_hash))
+            self._order.insert(index, (sort_key, tx_hash))
+            self._balances.insert(index, 0)
+            self._valid_balance_count = min(self._valid_balance_count, index)
+
+    def _remove_order(self, sort_key: HistorySortKey, tx_hash: bytes) -> None:
+        index = bisect.bisect_left(self._order, (sort_key, tx_hash))
+        del self._order[index]
+        del self._balances[index]
+        self._valid_balance_count = min(self._valid_balance_count, index)
+
+
+class CoinBalances:
+    """
+    The confirmed, unconfirmed and immature value of a set of coins. Coinbase coins are grouped by
+    the height they were mined at, so that what has matured can be determined for any chain tip
+    without visiting each coin.
+    """
 
-    def get_transaction_key_ids(self, tx_id: str) -> Set[int]:
-        tx_keys = self._tx_keys.get(tx_id)
-        if tx_keys is None:
-            return set()
-        return tx_keys
+    def __init__(self) -> None:
+        self._confirmed = 0
+        self._unconfirmed = 0
+        self._coinbase_confirmed = 0
+        self._coinbase_unconfirmed = 0
+        # The distinct heights of the coinbase coins in ascending order, and their value and count.
+        self._coinbase_heights: List[int] = []
+        self._coinbase_entries: Dict[int, List[int]] = {}
+
+    def add(self, value: int, height: int, is_coinbase: bool) -> None:
+        if not is_coinbase:
+            if height > 0:
+                self._confirmed += value
+            else:
+                self._unconfirmed += value
+            return
+
+        if height > 0:
+            self._coinbase_confirmed += value
+        else:
+            self._coinbase_unconfirmed += value
+        entry = self._coinbase_entries.get(height)
+        if entry is None:
+            bisect.insort(self._coinbase_heights, height)
+            entry = self._coinbase_entries[height] = [ 0, 0 ]
+        entry[0] += value
+        entry[1] += 1
+
+    def remove(self, value: int, height: int, is_coinbase: bool) -> None:
+        if not is_coinbase:
+            if height > 0:
+                self._confirmed -= value
+            else:
+                self._unconfirmed -= value
+            return
+
+        if height > 0:
+            self._coinbase_confirmed -= value
+        else:
+            self._coinbase_unconfirmed -= value
+        entry = self._coinbase_entries[height]
+        entry[0] -= value
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._coinbase_entries[height]
+            del self._coinbase_heights[bisect.bisect_left(self._coinbase_heights, height)]
+
+    def get_balance(self, local_height: int) -> Tuple[int, int, int]:
+        confirmed = self._confirmed + self._coinbase_confirmed
+        unconfirmed = self._unconfirmed + self._coinbase_unconfirmed
+        immature = 0
+        # A coinbase coin is immature until COINBASE_MATURITY blocks after the one it is in.
+        index = bisect.bisect_right(self._coinbase_heights, local_height - COINBASE_MATURITY)
+        for height in self._coinbase_heights[index:]:
+            value = self._coinbase_entries[height][0]
+            immature += value
+            if height > 0:
+                confirmed -= value
+            else:
+                unconfirmed -= value
+        return confirmed, unconfirmed, immature
 
 
 def dust_threshold(network):
     return 546 # hard-coded Bitcoin SV dust threshold. Was changed to this as of Sept. 2018
 
 CachedScriptType = Tuple[Script, bytes, Optional[ScriptTemplate]]
+# tx_hash, output_index, value, flags, keyinstance, script, address
+TransactionOutputEntry = Tuple[bytes, int, int, TransactionOutputFlag, KeyInstanceRow, Script,
+    Optional[ScriptTemplate]]
 
 T = TypeVar('T', bound='AbstractAccount')
 
@@ -216,6 +506,7 @@ class AbstractAccount:
         self._network = None
 
         self._script_cache: Dict[Tuple[int, ScriptType], CachedScriptType] = {}
+        self._script_hash_cache: Dict[Tuple[int, ScriptType], bytes] = {}
 
         # For synchronization.
         self._activated_keys: List[int] = []
@@ -233,17 +524,21 @@ class AbstractAccount:
         self.last_poll_time: Optional[float] = None
 
         self._load_sync_state()
+        self._load_history()
         self._utxos: Dict[TxoKeyType, UTXO] = {}
+        self._utxo_value_index = coinchooser.CoinValueIndex()
         self._utxos_lock = threading.RLock()
         self._stxos: Dict[TxoKeyType, int] = {}
+        # The history of each key at the time its transactions were last indexed for spends.
+        self._spend_indexed_histories: Dict[int, KeyHistory] = {}
         self._keypath: Dict[int, Sequence[int]] = {}
         self._keyinstances: Dict[int, KeyInstanceRow] = { r.keyinstance_id: r for r
             in keyinstance_rows }
         self._masterkey_ids: Set[int] = set(row.masterkey_id for row in keyinstance_rows
             if row.masterkey_id is not None)
 
-        # { txids -> { scripthashes: [ <set of txo indices> ]} }
-        self._script_txos: Dict[str, Dict[bytes, Set[int]]] = {}
+        # { tx_hash -> { scripthashes: [ <set of txo indices> ]} }
+        self._script_txos: Dict[bytes, Dict[bytes, Set[int]]] = {}
 
         self._load_keys(keyinstance_rows)
         self._load_txos(output_rows)
@@ -260,29 +555,29 @@ class AbstractAccount:
         script_bytes = bytes(script)
         return sha256(script_bytes)
 
-    def get_script_txos(self, tx_id: str, keyinstance_id: int) -> Optional[Set[int]]:
+    def get_script_txos(self, tx_hash: bytes, keyinstance_id: int) -> Optional[Set[int]]:
         """get the set of all output indices in a given transaction for a given keyinstance id"""
         script, _script_bytes, _object = self._get_cached_script(keyinstance_id)
-        if tx_id in self._script_txos:
+        if tx_hash in self._script_txos:
             try:
                 scripthash = self.scriptpubkey_to_scripthash(script)
-                return self._script_txos[tx_id][scripthash]
+                return self._script_txos[tx_hash][scripthash]
             except KeyError as e:
                 return None
         return None
 
-    def add_tx_to_script_txos(self, tx_id: str, tx: Transaction) -> None:
-        """lazy-loads cache as new txids are encountered by set_key_history."""
-        # { txids -> { scripthashes: [ <set of txo indices> ]} }
-        if self._script_txos.get(tx_id) is not None:
+    def add_tx_to_script_txos(self, tx_hash: bytes, tx: Transaction) -> None:
+        """lazy-loads cache as new transactions are encountered by set_key_history."""
+        # { tx_hash -> { scripthashes: [ <set of txo indices> ]} }
+        if self._script_txos.get(tx_hash) is not None:
             return
 
-        self._script_txos[tx_id] = {}
+        self._script_txos[tx_hash] = {}
         for index, output in enumerate(tx.outputs):
             _hash = self.scriptpubkey_to_scripthash(output.script_pubkey)
-            if not self._script_txos[tx_id].get(_hash):
-                self._script_txos[tx_id][_hash] = set()
-            self._script_txos[tx_id][_hash].add(index)
+            if not self._script_txos[tx_hash].get(_hash):
+                self._script_txos[tx_hash][_hash] = set()
+            self._script_txos[tx_hash][_hash].add(index)
 
     def get_id(self) -> int:
         return self._id
@@ -351,6 +646,8 @@ class AbstractAccount:
         for i, row in enumerate(rows):
             self._keyinstances[row.keyinstance_id] = row
             self._keypath[row.keyinstance_id] = key_allocations[i].derivation_path
+        self._derive_public_keys([ row.keyinstance_id for row in rows ])
+        self._wallet.add_key_script_routes(self, [ row.keyinstance_id for row in rows ])
         self._add_activated_keys(rows)
         return rows
 
@@ -387,8 +684,15 @@ class AbstractAccount:
 
         assert len(candidate_key_ids), "should never be called with no keys to activate"
 
-        for txo_row in self._wallet.read_transactionoutputs(key_ids=list(candidate_key_ids)):
-            self._load_txo(txo_row)
+        utxo_entries: List[TransactionOutputEntry] = []
+        txo_rows = self._wallet.read_transactionoutputs(key_ids=list(candidate_key_ids))
+        self._derive_public_keys(set(row.keyinstance_id for row in txo_rows
+            if not row.flags & TransactionOutputFlag.IS_SPENT))
+        for txo_row in txo_rows:
+            utxo_entry = self._load_txo(txo_row)
+            if utxo_entry is not None:
+                utxo_entries.append(utxo_entry)
+        self.register_utxos(utxo_entries)
 
         keyinstance_updates: List[Tuple[KeyInstanceFlag, int]] = []
         for row in self._wallet.read_keyinstances(key_ids=list(candidate_key_ids)):
@@ -401,20 +705,22 @@ class AbstractAccount:
             keyinstance_updates.append((flags, row.keyinstance_id))
 
         if len(keyinstance_updates):
+            self._wallet.add_key_script_routes(self, [ t[1] for t in keyinstance_updates ])
             self._wallet.update_keyinstance_flags(keyinstance_updates)
 
     def _unload_keys(self, key_ids: Set[int]) -> None:
+        self._wallet.remove_key_script_routes(self._id, key_ids)
         utxokeys, stxokeys = self.get_key_txokeys(key_ids)
         # Flush the associated UTXO state and account state from memory.
         with self._utxos_lock:
             for utxo_key in utxokeys:
-                if utxo_key in self._frozen_coins:
-                    self._frozen_coins.remove(utxo_key)
-                del self._utxos[utxo_key]
+                self._remove_utxo(utxo_key)
         for stxokey in stxokeys:
             del self._stxos[stxokey]
         for key_id in key_ids:
             del self._keyinstances[key_id]
+            for script_type in ScriptType:
+                self._script_hash_cache.pop((key_id, script_type), None)
 
     def get_key_txokeys(self, key_ids: Set[int]) -> Tuple[List[TxoKeyType], List[TxoKeyType]]:
         with self._utxos_lock:
@@ -446,6 +752,24 @@ class AbstractAccount:
     def get_possible_scripts_for_id(self, keyinstance_id: int) -> List[Script]:
         raise NotImplementedError
 
+    def get_possible_script_hashes_for_id(self, keyinstance_id: int) \
+            -> List[Tuple[ScriptType, bytes]]:
+        "The hashes of the scripts the key may be paid to with, that the server indexes by."
+        script_hashes: List[Tuple[ScriptType, bytes]] = []
+        for script_type in self.get_enabled_script_types():
+            script_hash = self._script_hash_cache.get((keyinstance_id, script_type))
+            if script_hash is None:
+                break
+            script_hashes.append((script_type, script_hash))
+        else:
+            return script_hashes
+
+        script_hashes = [ (script_type, sha256(bytes(script)))
+            for script_type, script in self.get_possible_scripts_for_id(keyinstance_id) ]
+        for script_type, script_hash in script_hashes:
+            self._script_hash_cache[(keyinstance_id, script_type)] = script_hash
+        return script_hashes
+
     def get_script_for_id(self, keyinstance_id: int,
             script_type: Optional[ScriptType]=None) -> Script:
         script_template = self.get_script_template_for_id(keyinstance_id, script_type)
@@ -560,25 +884,25 @@ class AbstractAccount:
             return self.type().value
         return f"{self.type().value}/{k.debug_name()}"
 
-    @profiler
     def _load_sync_state(self) -> None:
-        self._sync_state = SyncState()
+        self._sync_state = SyncState(self._read_key_histories)
 
+    def _read_key_histories(self, keyinstance_ids: Sequence[int]) \
+            -> Dict[int, List[Tuple[bytes, int]]]:
         with TransactionDeltaTable(self._wallet._db_context) as table:
-            rows = table.read_key_history(self._id)
+            rows = table.read_key_history(self._id, keyinstance_ids)
 
-        key_history: Dict[int, List[Tuple[str, int]]] = {}
+        key_history: Dict[int, List[Tuple[bytes, int]]] = {}
         maximum_position = 0
-        positions: Dict[str, int] = {}
+        positions: Dict[bytes, int] = {}
         for tx_hash, keyinstance_id in rows:
             metadata = cast(TxData, self.get_transaction_metadata(tx_hash))
             if metadata.height is not None:
-                tx_id = hash_to_hex_str(tx_hash)
                 if metadata.position is not None:
-                    positions[tx_id] = metadata.position
+                    positions[tx_hash] = metadata.position
                     maximum_position = max(maximum_position, metadata.position)
                 entries = key_history.setdefault(keyinstance_id, [])
-                entries.append((tx_id, metadata.height))
+                entries.append((tx_hash, metadata.height))
 
         # From elsewhere:
         #   The history is in immediately usable order. Transactions are listed in ascending
@@ -589,67 +913,154 @@ class AbstractAccount:
         # leave this as a less common case that will reprocess the state. In the longer term
         # syncing from the blockchain will likely be phased out except for restoration of older
         # seeds.
-        for keyinstance_id, entries in key_history.items():
+        for entries in key_history.values():
             entries.sort(key=lambda v: (v[1], positions.get(v[0], maximum_position+1)))
-            self._sync_state.set_key_history(keyinstance_id, entries)
+        return key_history
+
+    def _load_history(self) -> None:
+        self._history = AccountHistory()
+
+        with TransactionDeltaTable(self._wallet._db_context) as table:
+            rows = table.read_history(self._id)
+
+        for row in rows:
+            metadata = cast(TxData, self.get_transaction_metadata(row.tx_hash))
+            self._history.set_transaction(row.tx_hash, metadata, int(row.value_delta))
+
+    def refresh_transaction_metadata(self, tx_hashes: Iterable[bytes]) -> None:
+        """
+        Update the history and coin balances for changes in the heights of the given
+        transactions.
+        """
+        for tx_hash in tx_hashes:
+            if self._history.have_transaction(tx_hash):
+                metadata = cast(TxData, self.get_transaction_metadata(tx_hash))
+                self._history.update_metadata(tx_hash, metadata)
+            with self._utxos_lock:
+                for utxo_key in list(self._tx_utxo_keys.get(tx_hash, ())):
+                    utxo = self._utxos[utxo_key]
+                    self._add_utxo(utxo, utxo_key in self._frozen_coins)
 
     def _load_keys(self, keyinstance_rows: List[KeyInstanceRow]) -> None:
         pass
 
+    def _derive_public_keys(self, keyinstance_ids: Iterable[int]) -> None:
+        "Prepare the public keys for the given keys, for accounts that need to derive them."
+        pass
+
     def _load_txos(self, output_rows: List[TransactionOutputRow]) -> None:
         self._stxos.clear()
         self._utxos.clear()
+        self._utxo_value_index = coinchooser.CoinValueIndex()
         self._frozen_coins: Set[TxoKeyType] = set([])
-
+        # The heights of the coins are kept so that they can be classified without looking up
+        # their transaction, and the balances so that they do not need to be classified at all.
+        self._utxo_heights: Dict[TxoKeyType, int] = {}
+        self._tx_utxo_keys: Dict[bytes, Set[TxoKeyType]] = {}
+        self._utxo_balances = CoinBalances()
+        self._frozen_utxo_balances = CoinBalances()
+
+        # The keys for the unspent outputs are derived together rather than one at a time.
+        self._derive_public_keys(set(row.keyinstance_id for row in output_rows
+            if not row.flags & TransactionOutputFlag.IS_SPENT))
+        utxo_entries: List[TransactionOutputEntry] = []
         for row in output_rows:
-            self._load_txo(row)
+            utxo_entry = self._load_txo(row)
+            if utxo_entry is not None:
+                utxo_entries.append(utxo_entry)
+        self.register_utxos(utxo_entries)
 
-    def _load_txo(self, row: TransactionOutputRow) -> None:
+    def _load_txo(self, row: TransactionOutputRow) -> Optional[TransactionOutputEntry]:
+        "Load a spent output, or return the entry for an unspent output to be registered."
         txo_key = TxoKeyType(row.tx_hash, row.tx_index)
         if row.flags & TransactionOutputFlag.IS_SPENT:
             self._stxos[txo_key] = row.keyinstance_id
-        else:
-            keyinstance = self._keyinstances[row.keyinstance_id]
-            script_template = self.get_script_template_for_id(row.keyinstance_id)
-            address = script_template if isinstance(script_template, Address) else None
-            self.register_utxo(row.tx_hash, row.tx_index, row.value, row.flags,
-                keyinstance, script_template.to_script(), address)
+            return None
+        keyinstance = self._keyinstances[row.keyinstance_id]
+        script_template = self.get_script_template_for_id(row.keyinstance_id)
+        address = script_template if isinstance(script_template, Address) else None
+        return (row.tx_hash, row.tx_index, row.value, row.flags, keyinstance,
+            script_template.to_script(), address)
 
     def register_utxo(self, tx_hash: bytes, output_index: int, value: int,
             flags: TransactionOutputFlag, keyinstance: KeyInstanceRow,
             script: Script, address: Optional[ScriptTemplate]=None) -> None:
-        is_coinbase = (flags & TransactionOutputFlag.IS_COINBASE) != 0
-        utxo_key = TxoKeyType(tx_hash, output_index)
+        self.register_utxos([ (tx_hash, output_index, value, flags, keyinstance, script,
+            address) ])
+
+    def register_utxos(self, entries: Sequence[TransactionOutputEntry]) -> None:
         with self._utxos_lock:
-            self._utxos[utxo_key] = UTXO(
-                value=value,
-                script_pubkey=script,
-                script_type=keyinstance.script_type,
-                tx_hash=tx_hash,
-                out_index=output_index,
-                keyinstance_id=keyinstance.keyinstance_id,
-                flags=flags,
-                address=address,
-                is_coinbase=is_coinbase)
-            if flags & TransactionOutputFlag.IS_FROZEN:
-                if flags & TransactionOutputFlag.IS_SPENT:
-                    self._logger.warning("Ignoring frozen flag for spent txo %s:%d",
-                        hash_to_hex_str(tx_hash), output_index)
-                    return
-                self._frozen_coins.add(utxo_key)
+            for tx_hash, output_index, value, flags, keyinstance, script, address in entries:
+                is_coinbase = (flags & TransactionOutputFlag.IS_COINBASE) != 0
+                utxo = UTXO(
+                    value=value,
+                    script_pubkey=script,
+                    script_type=keyinstance.script_type,
+                    tx_hash=tx_hash,
+                    out_index=output_index,
+                    keyinstance_id=keyinstance.keyinstance_id,
+                    flags=flags,
+                    address=address,
+                    is_coinbase=is_coinbase)
+                is_frozen = False
+                if flags & TransactionOutputFlag.IS_FROZEN:
+                    if flags & TransactionOutputFlag.IS_SPENT:
+                        self._logger.warning("Ignoring frozen flag for spent txo %s:%d",
+                            hash_to_hex_str(tx_hash), output_index)
+                    else:
+                        is_frozen = True
+                self._add_utxo(utxo, is_frozen)
+
+    # Should be called with the UTXO lock.
+    def _add_utxo(self, utxo: UTXO, is_frozen: bool) -> None:
+        utxo_key = utxo.key()
+        if utxo_key in self._utxos:
+            self._remove_utxo(utxo_key)
+        metadata = self.get_transaction_metadata(utxo.tx_hash)
+        # Transactions that are signed but not cleared have no height.
+        height = metadata.height if metadata is not None and metadata.height is not None else 0
+        self._utxos[utxo_key] = utxo
+        self._utxo_value_index.add(utxo.value, utxo_key)
+        self._utxo_heights[utxo_key] = height
+        self._tx_utxo_keys.setdefault(utxo.tx_hash, set()).add(utxo_key)
+        self._utxo_balances.add(utxo.value, height, utxo.is_coinbase)
+        if is_frozen:
+            self._frozen_coins.add(utxo_key)
+            self._frozen_utxo_balances.add(utxo.value, height, utxo.is_coinbase)
+
+    # Should be called with the UTXO lock.
+    def _remove_utxo(self, utxo_key: TxoKeyType) -> UTXO:
+        utxo = self._utxos.pop(utxo_key)
+        self._utxo_value_index.remove(utxo.value, utxo_key)
+        height = self._utxo_heights.pop(utxo_key)
+        tx_utxo_keys = self._tx_utxo_keys[utxo_key.tx_hash]
+        tx_utxo_keys.remove(utxo_key)
+        if not tx_utxo_keys:
+            del self._tx_utxo_keys[utxo_key.tx_hash]
+        self._utxo_balances.remove(utxo.value, height, utxo.is_coinbase)
+        if utxo_key in self._frozen_coins:
+            self._frozen_coins.remove(utxo_key)
+            self._frozen_utxo_balances.remove(utxo.value, height, utxo.is_coinbase)
+        return utxo
 
     # Should be called with the transaction lock.
-    def create_transaction_output(self, tx_hash: bytes, output_index: int, value: int,
-            flags: TransactionOutputFlag, keyinstance: KeyInstanceRow,
-            script: Script, address: Optional[ScriptTemplate]=None):
-        if flags & TransactionOutputFlag.IS_SPENT:
-            self._stxos[TxoKeyType(tx_hash, output_index)] = keyinstance.keyinstance_id
-        else:
-            self.register_utxo(tx_hash, output_index, value, flags, keyinstance,
-                script, address)
-
-        self._wallet.create_transactionoutputs(self._id, [ TransactionOutputRow(tx_hash,
-            output_index, value, keyinstance.keyinstance_id, flags) ])
+    def create_transaction_outputs(self, entries: Sequence[TransactionOutputEntry]) -> None:
+        """
+        Add the outputs to the account, registering any that are unspent as coins, and write
+        them to the database together.
+        """
+        utxo_entries: List[TransactionOutputEntry] = []
+        rows: List[TransactionOutputRow] = []
+        for entry in entries:
+            tx_hash, output_index, value, flags, keyinstance, _script, _address = entry
+            if flags & TransactionOutputFlag.IS_SPENT:
+                self._stxos[TxoKeyType(tx_hash, output_index)] = keyinstance.keyinstance_id
+            else:
+                utxo_entries.append(entry)
+            rows.append(TransactionOutputRow(tx_hash, output_index, value,
+                keyinstance.keyinstance_id, flags))
+        self.register_utxos(utxo_entries)
+        self._wallet.create_transactionoutputs(self._id, rows)
 
     def is_deterministic(self) -> bool:
         # Not all wallets have a keystore, like imported address for instance.
@@ -755,7 +1166,7 @@ class AbstractAccount:
     def set_utxo_spent(self, tx_hash: bytes, output_index: int) -> None:
         with self._utxos_lock:
             txo_key = TxoKeyType(tx_hash, output_index)
-            utxo = self._utxos.pop(txo_key)
+            utxo = self._remove_utxo(txo_key)
         retained_flags = utxo.flags & TransactionOutputFlag.IS_COINBASE
         self._wallet.update_transactionoutput_flags(
             [ (retained_flags | TransactionOutputFlag.IS_SPENT, tx_hash, output_index)  ])
@@ -779,20 +1190,35 @@ class AbstractAccount:
 
     def get_utxos(self, exclude_frozen=False, mature=False, confirmed_only=False) -> List[UTXO]:
         '''Note exclude_frozen=True checks for coin-level frozen status. '''
+        is_spendable_utxo = self._get_utxo_filter(exclude_frozen, mature, confirmed_only)
+        with self._utxos_lock:
+            return [ utxo for utxo_key, utxo in self._utxos.items()
+                if is_spendable_utxo(utxo_key, utxo) ]
+
+    def _get_utxo_filter(self, exclude_frozen: bool, mature: bool,
+            confirmed_only: bool) -> Callable[[TxoKeyType, UTXO], bool]:
         mempool_height = self._wallet.get_local_height() + 1
-        def is_spendable_utxo(utxo):
-            metadata = self.get_transaction_metadata(utxo.tx_hash)
-            if exclude_frozen and self.is_frozen_utxo(utxo):
+        def is_spendable_utxo(utxo_key: TxoKeyType, utxo: UTXO) -> bool:
+            if exclude_frozen and utxo_key in self._frozen_coins:
                 return False
-            if confirmed_only and metadata.height <= 0:
+            height = self._utxo_heights[utxo_key]
+            if confirmed_only and height <= 0:
                 return False
             # A coin is spendable at height + COINBASE_MATURITY)
-            if mature and utxo.is_coinbase and \
-                    mempool_height < metadata.height + COINBASE_MATURITY:
+            if mature and utxo.is_coinbase and mempool_height < height + COINBASE_MATURITY:
                 return False
             return True
-        with self._utxos_lock:
-            return [ utxo for utxo in self._utxos.values() if is_spendable_utxo(utxo)]
+        return is_spendable_utxo
+
+    # Should be called with the UTXO lock.
+    def _iter_spendable_coins_by_value(self, config: SimpleConfig) -> Iterator[UTXO]:
+        "The spendable coins, largest first, as `get_spendable_coins` would filter them."
+        is_spendable_utxo = self._get_utxo_filter(True, True,
+            config.get('confirmed_only', False))
+        for _value, utxo_key in self._utxo_value_index.iter_descending():
+            utxo = self._utxos[utxo_key]
+            if is_spendable_utxo(utxo_key, utxo):
+                yield utxo
 
     def existing_active_keys(self) -> List[int]:
         with self._activated_keys_lock:
@@ -802,23 +1228,27 @@ class AbstractAccount:
 
     def get_frozen_balance(self) -> Tuple[int, int, int]:
         with self._utxos_lock:
-            return self.get_balance(self._frozen_coins)
+            return self._frozen_utxo_balances.get_balance(self._wallet.get_local_height())
 
     def get_balance(self, domain=None, exclude_frozen_coins: bool=False) -> Tuple[int, int, int]:
+        local_height = self._wallet.get_local_height()
         with self._utxos_lock:
             if domain is None:
-                domain = set(self._utxos.keys())
+                c, u, x = self._utxo_balances.get_balance(local_height)
+                if exclude_frozen_coins:
+                    fc, fu, fx = self._frozen_utxo_balances.get_balance(local_height)
+                    c, u, x = c - fc, u - fu, x - fx
+                return c, u, x
+
             c = u = x = 0
             for k in domain:
                 if exclude_frozen_coins and k in self._frozen_coins:
                     continue
                 o = self._utxos[k]
-                metadata = cast(TxData, self.get_transaction_metadata(o.tx_hash))
-                metadata_height = cast(int, metadata.height)
-                if o.is_coinbase and metadata_height + COINBASE_MATURITY > \
-                        self._wallet.get_local_height():
+                height = self._utxo_heights[k]
+                if o.is_coinbase and height + COINBASE_MATURITY > local_height:
                     x += o.value
-                elif metadata_height > 0:
+                elif height > 0:
                     c += o.value
                 else:
                     u += o.value
@@ -832,6 +1262,7 @@ class AbstractAccount:
             existing_flags = self._wallet._transaction_cache.get_flags(tx_hash)
             updated_flags = self._wallet._transaction_cache.update_flags(tx_hash, flags,
                 ~TxFlags.STATE_MASK)
+        self._wallet.refresh_transaction_metadata([ tx_hash ])
         self._wallet.trigger_callback('transaction_state_change', self._id, tx_hash,
             existing_flags, updated_flags)
 
@@ -849,9 +1280,10 @@ class AbstractAccount:
                 return True
             return False
 
-    def _get_cached_script(self, keyinstance_id: int) -> CachedScriptType:
-        keyinstance = self.get_keyinstance(keyinstance_id)
-        script_type = keyinstance.script_type
+    def _get_cached_script(self, keyinstance_id: int,
+            script_type: Optional[ScriptType]=None) -> CachedScriptType:
+        if script_type is None:
+            script_type = self.get_keyinstance(keyinstance_id).script_type
         assert script_type != ScriptType.NONE, "key_id=%s has ScriptType.NONE" % keyinstance_id
         cache_key = (keyinstance_id, script_type)
         cache_value = self._script_cache.get(cache_key)
@@ -863,6 +1295,15 @@ class AbstractAccount:
             self._script_cache[cache_key] = cache_value
         return cache_value
 
+    def get_key_script_bytes(self, keyinstance_ids: Iterable[int]) -> List[Tuple[int, bytes]]:
+        """
+        The script each of the given keys would be paid to with. Keys that have not been used yet
+        are expected to be paid to with the default script type.
+        """
+        return [ (keyinstance_id, self._get_cached_script(keyinstance_id,
+            self.get_script_type_for_id(keyinstance_id))[1])
+            for keyinstance_id in keyinstance_ids ]
+
     def process_key_usage(self, tx_hash: bytes, tx: Transaction,
             relevant_txos: Optional[List[Tuple[int, XTxOutput]]]) -> bool:
         with self.transaction_lock:
@@ -883,16 +1324,16 @@ class AbstractAccount:
 
     def _process_key_usage(self, tx_hash: bytes, tx: Transaction,
             relevant_txos: Optional[List[Tuple[int, XTxOutput]]]) -> bool:
-        tx_id = hash_to_hex_str(tx_hash)
-        key_ids = self._sync_state.get_transaction_key_ids(tx_id)
-        key_matches = [(self.get_keyinstance(key_id),
-            *self._get_cached_script(key_id)) for key_id in key_ids]
+        key_ids = self._sync_state.get_transaction_key_ids(tx_hash)
+        key_matches: Dict[bytes, Tuple[KeyInstanceRow, Script, Optional[ScriptTemplate]]] = {}
+        for key_id in key_ids:
+            script, script_bytes, address = self._get_cached_script(key_id)
+            key_matches[script_bytes] = (self.get_keyinstance(key_id), script, address)
 
         base_txo_flags = TransactionOutputFlag.IS_COINBASE if tx.is_coinbase() \
             else TransactionOutputFlag.NONE
         tx_deltas: Dict[Tuple[bytes, int], int] = defaultdict(int)
-        new_txos: List[Tuple[bytes, int, int, TransactionOutputFlag, KeyInstanceRow,
-            ScriptTemplate]] = []
+        new_txos: List[TransactionOutputEntry] = []
         for output_index, output in relevant_txos or enumerate(tx.outputs):
             utxo = self.get_utxo(tx_hash, output_index)
             if utxo is not None:
@@ -901,38 +1342,26 @@ class AbstractAccount:
             if keyinstance_id is not None:
                 continue
 
-            output_bytes = bytes(output.script_pubkey)
-            for keyinstance, script, script_bytes, address in key_matches:
-                if script_bytes == output_bytes:
-                    break
-            else:
+            key_match = key_matches.get(bytes(output.script_pubkey))
+            if key_match is None:
                 continue
+            keyinstance, script, address = key_match
 
-            # Search the known candidates to see if we already have this txo's spending input.
+            # Check if we already have this txo's spending input.
             txo_flags = base_txo_flags
-            for spend_tx_id, _height in self._sync_state.get_key_history(
-                    keyinstance.keyinstance_id):
-                if spend_tx_id == tx_id:
-                    continue
-                spend_tx_hash = hex_str_to_hash(spend_tx_id)
-                spend_tx = self._wallet._transaction_cache.get_transaction(spend_tx_hash)
-                if spend_tx is None:
-                    continue
-                for spend_txin in spend_tx.inputs:
-                    if spend_txin.prev_hash == tx_hash and spend_txin.prev_idx == output_index:
-                        break
-                else:
-                    continue
-
+            self._index_key_history_spends(keyinstance.keyinstance_id)
+            spend_tx_hash = self._wallet.get_outpoint_spender(tx_hash, output_index)
+            if spend_tx_hash is not None:
                 tx_deltas[(spend_tx_hash, keyinstance.keyinstance_id)] -= output.value
                 txo_flags |= TransactionOutputFlag.IS_SPENT
-                break
 
-            # TODO(rt12) BACKLOG batch create the outputs.
-            self.create_transaction_output(tx_hash, output_index, output.value,
-                txo_flags, keyinstance, script, address)
+            new_txos.append((tx_hash, output_index, output.value, txo_flags, keyinstance,
+                script, address))
             tx_deltas[(tx_hash, keyinstance.keyinstance_id)] += output.value
 
+        if len(new_txos):
+            self.create_transaction_outputs(new_txos)
+
         for input_index, input in enumerate(tx.inputs):
             keyinstance_id = self.get_stxo(input.prev_hash, input.prev_idx)
             if keyinstance_id is not None:
@@ -950,6 +1379,13 @@ class AbstractAccount:
                 [ TransactionDeltaRow(k[0], k[1], v) for k, v in tx_deltas.items() ],
                 partial(self.requests.check_paid_requests, check_keyinstance_ids))
 
+            history_deltas: Dict[bytes, int] = defaultdict(int)
+            for (delta_tx_hash, _keyinstance_id), value_delta in tx_deltas.items():
+                history_deltas[delta_tx_hash] += value_delta
+            for delta_tx_hash, value_delta in history_deltas.items():
+                metadata = cast(TxData, self.get_transaction_metadata(delta_tx_hash))
+                self._history.add_value_delta(delta_tx_hash, metadata, value_delta)
+
             affected_keys = [self._keyinstances[k] for (_x, k) in tx_deltas.keys()]
             self._wallet.trigger_callback('on_keys_updated', self._id, affected_keys)
 
@@ -957,6 +1393,23 @@ class AbstractAccount:
 
         return False
 
+    def _index_key_history_spends(self, keyinstance_id: int) -> None:
+        """
+        Ensure the spends of the transactions in the key's history are indexed. Those added to
+        the wallet are indexed as they arrive, but this also covers those that were already
+        present. The history is replaced when it changes, so each version is only walked once.
+        """
+        history = self._sync_state.get_key_history(keyinstance_id)
+        if self._spend_indexed_histories.get(keyinstance_id) is history:
+            return
+        for history_tx_hash, _height in history:
+            if self._wallet.is_transaction_spends_indexed(history_tx_hash):
+                continue
+            history_tx = self._wallet._transaction_cache.get_transaction(history_tx_hash)
+            if history_tx is not None:
+                self._wallet.index_transaction_spends(history_tx_hash, history_tx)
+        self._spend_indexed_histories[keyinstance_id] = history
+
     def delete_transaction(self, tx_hash: bytes) -> None:
         # Invoices have foreign key on the transaction.
         tx_flags = self._wallet.get_transaction_cache().get_flags(tx_hash)
@@ -975,6 +1428,8 @@ class AbstractAccount:
         with self.transaction_lock:
             self._logger.debug("removing tx from history %s", tx_id)
             self._remove_transaction(tx_hash)
+            self._wallet.remove_transaction_spends(tx_hash)
+            self._history.remove_transaction(tx_hash)
             self._logger.debug("deleting tx from cache and datastore: %s", tx_id)
             self._wallet._transaction_cache.delete(tx_hash, _completion_callback)
 
@@ -1034,11 +1489,8 @@ class AbstractAccount:
                 self._keyinstances[utxo.keyinstance_id] = key._replace(script_type=ScriptType.NONE)
 
                 # Expunge the UTXO.
-                utxo_key = utxo.key()
                 with self._utxos_lock:
-                    if utxo_key in self._frozen_coins:
-                        self._frozen_coins.remove(utxo_key)
-                    del self._utxos[utxo_key]
+                    self._remove_utxo(utxo.key())
 
             if len(txout_flags):
                 self._wallet.update_transactionoutput_flags(txout_flags)
@@ -1051,10 +1503,10 @@ class AbstractAccount:
             #         [ TransactionDeltaRow(k[0], k[1], v) for k, v in tx_deltas.items() ])
 
     def get_key_history(self, keyinstance_id: int,
-            script_type: ScriptType) -> List[Tuple[str, int]]:
+            script_type: ScriptType) -> List[Tuple[bytes, int]]:
         keyinstance = self._keyinstances[keyinstance_id]
         if keyinstance.script_type in (ScriptType.NONE, script_type):
-            return self._sync_state.get_key_history(keyinstance_id)
+            return list(self._sync_state.get_key_history(keyinstance_id))
         # This is normal for multi-script monitoring key registrations (fresh keys).
         # self._logger.warning("Received key history request from server for key that already "
         #     f"has script type {keyinstance.script_type}, where server history relates "
@@ -1062,9 +1514,10 @@ class AbstractAccount:
         #     f"past, and will ignore it for now. Please report it.")
         return []
 
-    def get_relevant_txos(self, keyinstance_id, tx, tx_id) -> Optional[List[Tuple[int, XTxOutput]]]:
-        self.add_tx_to_script_txos(tx_id, tx)
-        relevant_indices = self.get_script_txos(tx_id, keyinstance_id)
+    def get_relevant_txos(self, keyinstance_id, tx, tx_hash) \
+            -> Optional[List[Tuple[int, XTxOutput]]]:
+        self.add_tx_to_script_txos(tx_hash, tx)
+        relevant_indices = self.get_script_txos(tx_hash, keyinstance_id)
         if relevant_indices is None:
             return None
 
@@ -1075,7 +1528,7 @@ class AbstractAccount:
 
     # Called by network.
     async def set_key_history(self, keyinstance_id: int, script_type: ScriptType,
-            hist: List[Tuple[str, int]], tx_fees: Dict[str, int]) -> None:
+            hist: List[Tuple[bytes, int]], tx_fees: Dict[bytes, int]) -> None:
         if self._stopped:
             self._logger.debug("set_key_history on stopped wallet: %s", keyinstance_id)
             return
@@ -1086,7 +1539,7 @@ class AbstractAccount:
         # - The key usage has been processed.
         # As some of the events may read from the database or access wallet state.
         update_state_changes: List[Tuple[bytes, TxFlags, TxFlags]] = []
-        pending_event_count = 1
+        write_futures: List[WriteFutureType] = []
 
         def do_post_processing() -> None:
             nonlocal update_state_changes
@@ -1098,15 +1551,6 @@ class AbstractAccount:
             self._wallet.txs_changed_event.set()
             self.synchronize()
 
-        def on_event_completed() -> None:
-            nonlocal pending_event_count
-            pending_event_count -= 1
-            if pending_event_count > 0:
-                return
-
-            # We do not want to block the completion thread.
-            app_state.app.run_in_thread(do_post_processing)
-
         with self.lock:
             self._logger.debug("set_key_history key_id=%s fees=%s", keyinstance_id, tx_fees)
             key = self._keyinstances[keyinstance_id]
@@ -1114,6 +1558,7 @@ class AbstractAccount:
                 # This is the first use of the allocated key and we update the key to reflect it.
                 self._keyinstances[keyinstance_id] = key._replace(script_type=script_type)
                 self._wallet.update_keyinstance_script_types([ (script_type, keyinstance_id) ])
+                self._wallet.add_key_script_routes(self, [ keyinstance_id ])
             elif key.script_type != script_type:
                 self._logger.error("Received key history from server for key that already "
                     f"has script type {key.script_type}, where server history relates "
@@ -1129,8 +1574,8 @@ class AbstractAccount:
             adds = []
             updates = []
             unique_tx_hashes: Set[bytes] = set([])
-            for tx_id, tx_height in hist:
-                tx_fee = tx_fees.get(tx_id, None)
+            for tx_hash, tx_height in hist:
+                tx_fee = tx_fees.get(tx_hash, None)
                 data = TxData(height=tx_height, fee=tx_fee)
                 # The metadata flags indicate to the update call which TxData fields should
                 # be updated. Fields that are not flagged in the existing cache record, should
@@ -1138,7 +1583,6 @@ class AbstractAccount:
                 flags = TxFlags.HasHeight
                 if tx_fee is not None:
                     flags |= TxFlags.HasFee
-                tx_hash = hex_str_to_hash(tx_id)
                 entry_flags = self._wallet._transaction_cache.get_flags(tx_hash)
                 if entry_flags is None:
                     adds.append((tx_hash, data, None, flags, None))
@@ -1156,53 +1600,54 @@ class AbstractAccount:
                     updates.append((tx_hash, data, None, flags))
                 unique_tx_hashes.add(tx_hash)
 
-            def _completion_callback(exc_value: Any) -> None:
-                if exc_value is not None:
-                    raise exc_value # pylint: disable=raising-bad-type
-                on_event_completed()
-
             if len(adds):
-                # The completion callback is guaranteed to be called.
-                pending_event_count += 1
-                self._wallet._transaction_cache.add(adds, completion_callback=_completion_callback)
+                write_futures.append(self._wallet._transaction_cache.add(adds))
 
             if len(updates):
-                # The completion callback is only guaranteed to be called if database updates are
-                # actually made. We can infer this from the return value which is how many are.
-                pending_event_count += 1
-                if self._wallet._transaction_cache.update(updates,
-                    completion_callback=_completion_callback) == 0:
-                        pending_event_count -= 1
-
-            for tx_id, tx_height in hist:
-                tx_hash = hex_str_to_hash(tx_id)
+                # There is only a write to wait for if the updates resulted in actual changes.
+                update_future = self._wallet._transaction_cache.queue_update(updates)
+                if update_future is not None:
+                    write_futures.append(update_future)
+                self._wallet.refresh_transaction_metadata([ t[0] for t in updates ])
+
+            for tx_hash, tx_height in hist:
                 entry_flags = self._wallet._transaction_cache.get_flags(tx_hash)
                 if entry_flags & TxFlags.HasByteData == TxFlags.HasByteData:
                     tx = self._wallet._transaction_cache.get_transaction(tx_hash)
-                    relevant_txos = self.get_relevant_txos(keyinstance_id, tx, tx_id)
+                    relevant_txos = self.get_relevant_txos(keyinstance_id, tx, tx_hash)
                     self.process_key_usage(tx_hash, tx, relevant_txos)
 
-        # Reaching this stage is the only guaranteed event in triggering post-processing.
-        on_event_completed()
+        # The account lock is not held while we wait, as the writes may take a while to reach.
+        # Processing the key usage also queues writes that there are no futures for, and if the
+        # write queue is bounded we hold back the network until it is back within that bound.
+        await self._wallet.get_db_context().wait_for_write_room_async()
+        for future in write_futures:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                # The failure is isolated to the write and should not stop the processing of
+                # other key histories.
+                self._logger.exception("set_key_history write failed for key_id=%s",
+                    keyinstance_id)
+
+        # The post-processing synchronously waits on the event loop, so cannot be done on it.
+        app_state.app.run_in_thread(do_post_processing)
 
     def get_history(self, domain: Optional[Set[int]]=None) -> List[Tuple[HistoryLine, int]]:
+        "The history with the balance after each transaction, most recent first."
+        if domain is None:
+            return self._get_history_lines(self._history.get_entries())
+
         history_raw: List[HistoryLine] = []
         with TransactionDeltaTable(self._wallet._db_context) as table:
             rows = table.read_history(self._id, domain)
 
         for row in rows:
-            metadata = self._wallet._transaction_cache.get_metadata(row.tx_hash)
-            # Signed but not cleared.
-            if metadata.height is None:
+            metadata = cast(TxData, self._wallet._transaction_cache.get_metadata(row.tx_hash))
+            sort_key = get_history_sort_key(metadata)
+            if sort_key is None:
                 continue
-            height, position = metadata.height, metadata.position
-            if position is not None:
-                sort_key = height, position
-            elif height is not None and height > 0:
-                sort_key = (height, metadata.date_added)
-            else:
-                sort_key = (1e9, metadata.date_added)
-            history_raw.append(HistoryLine(sort_key, row.tx_hash, row.tx_flags, height,
+            history_raw.append(HistoryLine(sort_key, row.tx_hash, row.tx_flags, metadata.height,
                 row.value_delta))
 
         history_raw.sort(key = lambda v: v.sort_key)
@@ -1217,6 +1662,29 @@ class AbstractAccount:
 
         return history
 
+    def get_history_count(self) -> int:
+        return len(self._history)
+
+    def get_history_page(self, offset: int, count: int) -> List[Tuple[HistoryLine, int]]:
+        "A window of the history, where the most recent transaction is at offset zero."
+        return self._get_history_lines(self._history.get_entries(offset, count))
+
+    def get_history_range(self, from_height: int,
+            to_height: Optional[int]=None) -> List[Tuple[HistoryLine, int]]:
+        """
+        The history at or above `from_height` and below `to_height`, most recent first. If there
+        is no `to_height`, unconfirmed transactions are included.
+        """
+        return self._get_history_lines(
+            self._history.get_height_range_entries(from_height, to_height))
+
+    def _get_history_lines(self,
+            entries: List[AccountHistoryEntry]) -> List[Tuple[HistoryLine, int]]:
+        get_flags = self._wallet._transaction_cache.get_flags
+        return [ (HistoryLine(sort_key, tx_hash, cast(TxFlags, get_flags(tx_hash)), height,
+            value_delta), balance)
+            for tx_hash, sort_key, height, value_delta, balance in entries ]
+
     def export_history(self, from_timestamp=None, to_timestamp=None,
                        show_addresses=False):
         h = self.get_history()
@@ -1290,8 +1758,12 @@ class AbstractAccount:
     def dust_threshold(self):
         return dust_threshold(self._network)
 
-    def make_unsigned_transaction(self, utxos: List[UTXO], outputs: List[XTxOutput],
+    def make_unsigned_transaction(self, utxos: Optional[List[UTXO]], outputs: List[XTxOutput],
             config: SimpleConfig, fixed_fee: Optional[int]=None) -> Transaction:
+        """
+        Spend the given coins, or if none are given select them from the account's spendable
+        coins in order of value, without looking at all of them.
+        """
         # check outputs
         all_index = None
         for n, output in enumerate(outputs):
@@ -1300,38 +1772,52 @@ class AbstractAccount:
                     raise ValueError("More than one output set to spend max")
                 all_index = n
 
+        if utxos is None and all_index is not None:
+            utxos = self.get_spendable_coins(None, config)
+
         # Avoid index-out-of-range with inputs[0] below
-        if not utxos:
+        if utxos is not None and not utxos:
             raise NotEnoughFunds()
 
         if fixed_fee is None and config.fee_per_kb() is None:
             raise Exception('Dynamic fee estimates not available')
 
         fee_estimator = config.estimate_fee if fixed_fee is None else lambda size: fixed_fee
-        inputs = [utxo.to_tx_input(self) for utxo in utxos]
         if all_index is None:
             # Let the coin chooser select the coins to spend
-            # TODO(rt12) BACKLOG Hardware wallets should use 1 change at most. Make sure the
-            # corner case of the active multisig cosigning wallet being hardware is covered.
-            max_change = self.max_change_outputs \
-                if self._wallet.get_boolean_setting(WalletSettings.MULTIPLE_CHANGE) else 1
-            if self._wallet.get_boolean_setting(WalletSettings.USE_CHANGE) and \
-                    self.is_deterministic():
-                change_keyinstances = self.get_fresh_keys(CHANGE_SUBPATH, max_change)
-                change_outs = []
-                for keyinstance in change_keyinstances:
-                    script_type = self.get_script_type_for_id(keyinstance.keyinstance_id)
-                    change_outs.append(XTxOutput(0, # type: ignore
-                        self.get_script_for_id(keyinstance.keyinstance_id, script_type),
-                        script_type,
-                        self.get_xpubkeys_for_id(keyinstance.keyinstance_id)))
+            coin_chooser: coinchooser.CoinChooserBase
+            if utxos is None or len(utxos) >= coinchooser.MINIMUM_SELECTOR_COIN_COUNT:
+                coin_chooser = coinchooser.CoinSelector()
+                with self._utxos_lock:
+                    if utxos is None:
+                        coins = self._iter_spendable_coins_by_value(config)
+                    else:
+                        coins = iter(sorted(utxos, key=lambda utxo: utxo.value, reverse=True))
+                    first_coin = next(coins, None)
+                    if first_coin is None:
+                        raise NotEnoughFunds()
+                    change_outs = self._make_change_outputs(first_coin)
+
+                    # The inputs for a key are all the same size.
+                    input_sizes: Dict[int, int] = {}
+                    def get_input_size(utxo: UTXO) -> int:
+                        size = input_sizes.get(utxo.keyinstance_id)
+                        if size is None:
+                            size = input_sizes[utxo.keyinstance_id] = \
+                                utxo.to_tx_input(self).estimated_size()
+                        return size
+
+                    utxos = coin_chooser.select_coins(itertools.chain([ first_coin ], coins),
+                        get_input_size, outputs, change_outs[0].estimated_size(), fee_estimator,
+                        self.dust_threshold())
             else:
-                change_outs = [ XTxOutput(0, utxos[0].script_pubkey, # type: ignore
-                    inputs[0].script_type, inputs[0].x_pubkeys) ]
-            coin_chooser = coinchooser.CoinChooserPrivacy()
+                coin_chooser = coinchooser.CoinChooserPrivacy()
+                change_outs = self._make_change_outputs(utxos[0])
+            inputs = [utxo.to_tx_input(self) for utxo in utxos]
             tx = coin_chooser.make_tx(inputs, outputs, change_outs, fee_estimator,
                 self.dust_threshold())
         else:
+            inputs = [utxo.to_tx_input(self) for utxo in cast(List[UTXO], utxos)]
             assert all(txin.value is not None for txin in inputs)
             sendable = cast(int, sum(txin.value for txin in inputs))
             outputs[all_index].value = 0
@@ -1357,19 +1843,49 @@ class AbstractAccount:
         tx.locktime = locktime
         return tx
 
+    def _make_change_outputs(self, utxo: UTXO) -> List[XTxOutput]:
+        "The outputs that change can be sent to, given a coin that is being spent."
+        # TODO(rt12) BACKLOG Hardware wallets should use 1 change at most. Make sure the
+        # corner case of the active multisig cosigning wallet being hardware is covered.
+        max_change = self.max_change_outputs \
+            if self._wallet.get_boolean_setting(WalletSettings.MULTIPLE_CHANGE) else 1
+        if self._wallet.get_boolean_setting(WalletSettings.USE_CHANGE) and \
+                self.is_deterministic():
+            change_keyinstances = self.get_fresh_keys(CHANGE_SUBPATH, max_change)
+            change_outs = []
+            for keyinstance in change_keyinstances:
+                script_type = self.get_script_type_for_id(keyinstance.keyinstance_id)
+                change_outs.append(XTxOutput(0, # type: ignore
+                    self.get_script_for_id(keyinstance.keyinstance_id, script_type),
+                    script_type,
+                    self.get_xpubkeys_for_id(keyinstance.keyinstance_id)))
+            return change_outs
+        return [ XTxOutput(0, utxo.script_pubkey, # type: ignore
+            utxo.script_type, self.get_xpubkeys_for_id(utxo.keyinstance_id)) ]
+
     def set_frozen_coin_state(self, utxos: List[UTXO], freeze: bool) -> None:
         '''Set frozen state of the COINS to FREEZE, True or False.  Note that coin-level freezing
         is set/unset independent of address-level freezing, however both must be satisfied for
         a coin to be defined as spendable.'''
         update_entries: List[Tuple[TransactionOutputFlag, bytes, int]] = []
+        with self._utxos_lock:
+            for utxo in utxos:
+                utxo_key = utxo.key()
+                if utxo_key not in self._utxos or (utxo_key in self._frozen_coins) == freeze:
+                    continue
+                height = self._utxo_heights[utxo_key]
+                if freeze:
+                    self._frozen_coins.add(utxo_key)
+                    self._frozen_utxo_balances.add(utxo.value, height, utxo.is_coinbase)
+                else:
+                    self._frozen_coins.remove(utxo_key)
+                    self._frozen_utxo_balances.remove(utxo.value, height, utxo.is_coinbase)
         if freeze:
-            self._frozen_coins.update(utxo.key() for utxo in utxos)
             update_entries.extend(
                 (utxo.flags | TransactionOutputFlag.FROZEN_MASK, utxo.tx_hash, utxo.out_index)
                 for utxo in utxos if (utxo.flags & TransactionOutputFlag.FROZEN_MASK !=
                     TransactionOutputFlag.FROZEN_MASK))
         else:
-            self._frozen_coins.difference_update(utxo.key() for utxo in utxos)
             update_entries.extend(
                 (utxo.flags & ~TransactionOutputFlag.FROZEN_MASK, utxo.tx_hash, utxo.out_index)
                 for utxo in utxos if utxo.flags & TransactionOutputFlag.FROZEN_MASK != 0)
@@ -1463,9 +1979,28 @@ class AbstractAccount:
 
     def sign_transaction(self, tx: Transaction, password: str,
             tx_context: Optional[TransactionContext]=None) -> None:
+        self.sign_transactions([ (tx, tx_context) ], password)
+
+    def sign_transactions(self,
+            entries: Sequence[Tuple[Transaction, Optional[TransactionContext]]],
+            password: str) -> None:
+        """
+        Sign the given transactions, decrypting the key data of each software keystore only once
+        for all of them.
+        """
         if self.is_watching_only():
             return
 
+        sessions: Dict[int, SigningSession] = {}
+        try:
+            for tx, tx_context in entries:
+                self._sign_transaction(tx, password, tx_context, sessions)
+        finally:
+            for session in sessions.values():
+                session.close()
+
+    def _sign_transaction(self, tx: Transaction, password: str,
+            tx_context: Optional[TransactionContext], sessions: Dict[int, SigningSession]) -> None:
         # Annotate the outputs to the account's own keys for hardware wallets.
         # - Digitalbitbox makes use of all available output annotations.
         # - Keepkey and Trezor use this to annotate one arbitrary change address.
@@ -1476,10 +2011,16 @@ class AbstractAccount:
             self._add_hw_info(tx)
 
         # sign
-        for k in self.get_keystores():
+        for i, k in enumerate(self.get_keystores()):
             try:
                 if k.can_sign(tx):
-                    k.sign_transaction(tx, password)
+                    if isinstance(k, Software_KeyStore):
+                        if i not in sessions:
+                            sessions[i] = k.create_signing_session(password)
+                        k.sign_transaction(tx, password, sessions[i],
+                            self._wallet.get_signing_engine())
+                    else:
+                        k.sign_transaction(tx, password)
             except UserCancelled:
                 continue
 
@@ -1610,9 +2151,12 @@ class AbstractAccount:
         mechanisms."""
         with self.lock:
             tx_key_ids: List[Tuple[bytes, Set[int]]] = []
-            for tx_hash in reorged_tx_hashes:
-                tx_key_ids.append((tx_hash, self._sync_state.get_transaction_key_ids(
-                    hash_to_hex_str(tx_hash))))
+            with TransactionDeltaTable(self._wallet._db_context) as table:
+                for tx_hash in reorged_tx_hashes:
+                    # The history of keys that have not been checked yet is not loaded.
+                    key_ids = self._sync_state.get_transaction_key_ids(tx_hash)
+                    key_ids.update(table.read_transaction_keys(self._id, tx_hash))
+                    tx_key_ids.append((tx_hash, key_ids))
             self.unarchive_transaction_keys(tx_key_ids)
 
     async def new_deactivated_keys(self) -> List[int]:
@@ -1723,6 +2267,7 @@ class ImportedAddressAccount(ImportedAccountBase):
         keyinstance = self._wallet.create_keyinstances(self._id, [ raw_keyinstance ])[0]
         self._hashes[keyinstance.keyinstance_id] = address_string
         self._keyinstances[keyinstance.keyinstance_id] = keyinstance
+        self._wallet.add_key_script_routes(self, [ keyinstance.keyinstance_id ])
         self._add_activated_keys([ keyinstance ])
 
         return True
@@ -1802,6 +2347,7 @@ class ImportedPrivkeyAccount(ImportedAccountBase):
         self._keyinstances[keyinstance.keyinstance_id] = keyinstance
 
         k.import_private_key(keyinstance.keyinstance_id, public_key, enc_private_key_text)
+        self._wallet.add_key_script_routes(self, [ keyinstance.keyinstance_id ])
 
         self._add_activated_keys([ keyinstance ])
         return private_key_text
@@ -1838,6 +2384,8 @@ class DeterministicAccount(AbstractAccount):
     def __init__(self, wallet: 'Wallet', row: AccountRow,
             keyinstance_rows: List[KeyInstanceRow],
             output_rows: List[TransactionOutputRow]) -> None:
+        # The public keys for each key, one for each keystore of the account.
+        self._public_keys: Dict[int, List[PublicKey]] = {}
         AbstractAccount.__init__(self, wallet, row, keyinstance_rows, output_rows)
 
     def has_seed(self) -> bool:
@@ -1856,8 +2404,50 @@ class DeterministicAccount(AbstractAccount):
         for key_id in key_ids:
             if key_id in self._keypath:
                 del self._keypath[key_id]
+            self._public_keys.pop(key_id, None)
         super()._unload_keys(key_ids)
 
+    def _derive_public_keys(self, keyinstance_ids: Iterable[int]) -> None:
+        # Keys with the same parent path are derived together from the keystore's parsed
+        # parent node, and this is where most of the cost of creating or loading keys lies.
+        parent_entries: Dict[Sequence[int], List[Tuple[int, int]]] = defaultdict(list)
+        for keyinstance_id in keyinstance_ids:
+            derivation_path = self._keypath.get(keyinstance_id)
+            if derivation_path is None or keyinstance_id in self._public_keys:
+                continue
+            parent_entries[tuple(derivation_path[:-1])].append(
+                (keyinstance_id, derivation_path[-1]))
+
+        keystores = cast(Sequence[MultisigChildKeyStoreTypes], self.get_keystores())
+        # Where the script is known from the public key alone, it is derived with it.
+        script_types = self.get_enabled_script_types()
+        script_type = script_types[0] if len(keystores) == 1 and len(script_types) == 1 else None
+        for parent_path, entries in parent_entries.items():
+            indexes = [ n for _keyinstance_id, n in entries ]
+            keystore_derived_keys = [ self._wallet.derive_keys(k, parent_path, indexes,
+                script_type) for k in keystores ]
+            keystore_public_keys = [ d.get_public_keys() for d in keystore_derived_keys ]
+            for i, (keyinstance_id, _n) in enumerate(entries):
+                self._public_keys[keyinstance_id] = [ public_keys[i]
+                    for public_keys in keystore_public_keys ]
+
+            if script_type is not None:
+                derived_keys = keystore_derived_keys[0]
+                for (keyinstance_id, _n), script_bytes, script_hash in zip(entries,
+                        derived_keys.get_scripts(), derived_keys.get_script_hashes()):
+                    address = P2PKH_Address(script_bytes[3:23], Net.COIN) \
+                        if script_type == ScriptType.P2PKH else None
+                    self._script_cache[(keyinstance_id, script_type)] = (Script(script_bytes),
+                        script_bytes, address)
+                    self._script_hash_cache[(keyinstance_id, script_type)] = script_hash
+
+    def _get_public_keys(self, keyinstance_id: int) -> List[PublicKey]:
+        public_keys = self._public_keys.get(keyinstance_id)
+        if public_keys is None:
+            self._derive_public_keys([ keyinstance_id ])
+            public_keys = self._public_keys[keyinstance_id]
+        return public_keys
+
     def get_next_derivation_index(self, derivation_path: Sequence[int]) -> int:
         with self.lock:
             keystore = cast(DerivablePaths, self.get_keystore())
@@ -1909,6 +2499,8 @@ class DeterministicAccount(AbstractAccount):
         existing_count = path_keystore.get_next_index(derivation_parent)
         fresh_count = len(self.get_existing_fresh_keys(derivation_parent))
         self.get_fresh_keys(derivation_parent, wanted)
+        # The new keys are written synchronously, so we are held back here if the queue is full.
+        await self._wallet.get_db_context().wait_for_write_room_async()
         self._logger.info(
             f'derivation {derivation_parent} has {existing_count:,d} keys, {fresh_count:,d} fresh')
 
@@ -1945,10 +2537,7 @@ class SimpleDeterministicAccount(SimpleAccount, DeterministicAccount):
         return cast(str, keystore.get_master_public_key())
 
     def _get_public_key_for_id(self, keyinstance_id: int) -> PublicKey:
-        derivation_path = self._keypath[keyinstance_id]
-        keyinstance = self._keyinstances[keyinstance_id]
-        keystore = self._wallet.get_keystore(keyinstance.masterkey_id)
-        return keystore.derive_pubkey(derivation_path)
+        return self._get_public_keys(keyinstance_id)[0]
 
     def get_public_keys_for_id(self, keyinstance_id: int) -> List[PublicKey]:
         return [ self._get_public_key_for_id(keyinstance_id) ]
@@ -2007,8 +2596,7 @@ class MultisigAccount(DeterministicAccount):
         return self.m
 
     def get_public_keys_for_id(self, keyinstance_id: int) -> List[PublicKey]:
-        derivation_path = self._keypath[keyinstance_id]
-        return [ k.derive_pubkey(derivation_path) for k in self.get_keystores() ]
+        return list(self._get_public_keys(keyinstance_id))
 
     def get_enabled_script_types(self) -> Sequence[ScriptType]:
         return (ScriptType.MULTISIG_P2SH, ScriptType.MULTISIG_BARE, ScriptType.MULTISIG_ACCUMULATOR)
@@ -2110,8 +2698,10 @@ class Wallet(TriggeredCallbacks):
         txdata_cache_size = self.get_cache_size_for_tx_bytedata() * (1024 * 1024)
 
         self._transaction_table = TransactionTable(self._db_context)
+        # By default the metadata for all transactions is kept in memory, large wallets can bound it.
         self._transaction_cache = TransactionCache(self._transaction_table,
-            txdata_cache_size=txdata_cache_size)
+            txdata_cache_size=txdata_cache_size,
+            metadata_cache_size=self._storage.get('tx_metadata_cache_size'))
         self._transaction_descriptions: Dict[bytes, str] = {}
 
         self._masterkey_rows: Dict[int, MasterKeyRow] = {}
@@ -2119,6 +2709,20 @@ class Wallet(TriggeredCallbacks):
 
         self._accounts: Dict[int, AbstractAccount] = {}
         self._keystores: Dict[int, KeyStore] = {}
+        # The keys that each output script pays, across all accounts. This is built when first
+        # needed, as it requires the scripts for all the keys, and is then kept up to date.
+        self._script_routes: Optional[Dict[bytes, List[Tuple[int, int]]]] = None
+        self._script_route_keys: Dict[Tuple[int, int], bytes] = {}
+        self._script_routes_lock = threading.RLock()
+        # Accounts do not share key or coin state, so each can process its part of added
+        # transactions independently of the others.
+        self._account_executor = ThreadPoolExecutor(thread_name_prefix="wallet-accounts")
+        self._key_derivation = KeyDerivationEngine()
+        self._signing_engine = SigningEngine()
+        # The transaction that spends each outpoint, for the transactions that have been indexed.
+        self._outpoint_spenders: Dict[TxoKeyType, bytes] = {}
+        self._spent_outpoints: Dict[bytes, List[TxoKeyType]] = {}
+        self._outpoint_spenders_lock = threading.Lock()
 
         self.load_state()
 
@@ -2162,6 +2766,12 @@ class Wallet(TriggeredCallbacks):
         self._keystores.clear()
         self._accounts.clear()
         self._transaction_descriptions.clear()
+        with self._script_routes_lock:
+            self._script_routes = None
+            self._script_route_keys.clear()
+        with self._outpoint_spenders_lock:
+            self._outpoint_spenders.clear()
+            self._spent_outpoints.clear()
 
         with TransactionTable(self._db_context) as table:
             # NOTE(rt12) BACKLOG These are actually read in the transaction cache but perhaps
@@ -2206,6 +2816,55 @@ class Wallet(TriggeredCallbacks):
 
     def register_account(self, account_id: int, account: AbstractAccount) -> None:
         self._accounts[account_id] = account
+        self.add_key_script_routes(account, account.get_keyinstance_ids())
+
+    def _get_script_routes(self) -> Dict[bytes, List[Tuple[int, int]]]:
+        # This should be called with the script routes lock held.
+        if self._script_routes is None:
+            self._script_routes = {}
+            for account in self._accounts.values():
+                self._add_key_script_routes(account, account.get_keyinstance_ids())
+            self._logger.debug("built script routes for %d keys", len(self._script_route_keys))
+        return self._script_routes
+
+    def add_key_script_routes(self, account: AbstractAccount,
+            keyinstance_ids: Iterable[int]) -> None:
+        """
+        Add or update the routes to the given account keys, from the scripts that pay them.
+        """
+        with self._script_routes_lock:
+            # The routes for the keys will be included when they are first needed.
+            if self._script_routes is not None:
+                self._add_key_script_routes(account, keyinstance_ids)
+
+    def _add_key_script_routes(self, account: AbstractAccount,
+            keyinstance_ids: Iterable[int]) -> None:
+        assert self._script_routes is not None
+        account_id = account.get_id()
+        self.remove_key_script_routes(account_id, keyinstance_ids)
+        for keyinstance_id, script_bytes in account.get_key_script_bytes(keyinstance_ids):
+            route = (account_id, keyinstance_id)
+            self._script_routes.setdefault(script_bytes, []).append(route)
+            self._script_route_keys[route] = script_bytes
+
+    def remove_key_script_routes(self, account_id: int, keyinstance_ids: Iterable[int]) -> None:
+        with self._script_routes_lock:
+            if self._script_routes is None:
+                return
+            for keyinstance_id in keyinstance_ids:
+                route = (account_id, keyinstance_id)
+                script_bytes = self._script_route_keys.pop(route, None)
+                if script_bytes is None:
+                    continue
+                routes = self._script_routes[script_bytes]
+                routes.remove(route)
+                if not routes:
+                    del self._script_routes[script_bytes]
+
+    def get_script_routes(self, script_bytes: bytes) -> List[Tuple[int, int]]:
+        "The account and key ids for the keys that are paid by the given output script."
+        with self._script_routes_lock:
+            return list(self._get_script_routes().get(script_bytes, ()))
 
     def name(self) -> str:
         return get_wallet_name_from_path(self.get_storage_path())
@@ -2222,6 +2881,15 @@ class Wallet(TriggeredCallbacks):
     def get_keystores(self) -> Sequence[KeyStore]:
         return list(self._keystores.values())
 
+    def derive_keys(self, keystore: MultisigChildKeyStoreTypes, parent_path: Sequence[int],
+            indexes: Sequence[int], script_type: Optional[ScriptType]=None) -> DerivedKeys:
+        "Derive a run of keys, across worker processes where there are enough of them."
+        return self._key_derivation.derive_keys(keystore, parent_path, indexes, script_type)
+
+    def get_signing_engine(self) -> SigningEngine:
+        "Signs large runs of signature hashes across worker processes."
+        return self._signing_engine
+
     def check_password(self, password: str) -> None:
         self._storage.check_password(password)
 
@@ -2590,7 +3258,6 @@ class Wallet(TriggeredCallbacks):
         self._logger.debug("unverified_transactions: %s", [hash_to_hex_str(r[0]) for r in results])
         return { t[0]: cast(int, t[1].metadata.height) for t in results }
 
-    # Also called by network.
     def add_transaction(self, tx_hash: bytes, tx: Transaction, flags: TxFlags,
             external: bool=False) -> None:
         tx_id = hash_to_hex_str(tx_hash)
@@ -2621,16 +3288,188 @@ class Wallet(TriggeredCallbacks):
 
         self._logger.debug("adding tx data %s (flags: %r)", tx_id, flags)
         self._transaction_cache.add_transaction(tx_hash, tx, flags, _completion_callback)
+        self.index_transaction_spends(tx_hash, tx)
 
-        # TODO: It should be possible to determine what accounts are involved with this without
-        # entering the processing stage.
-        # TODO: It should be possible to parallelise each account's processing.
-        for account in self._accounts.values():
-            if account.process_key_usage(tx_hash, tx, None):
-                involved_account_ids.add(account.get_id())
+        involved_account_ids |= self._process_transaction_key_usage(tx_hash, tx)
 
         attempt_callback()
 
+    # Called by network.
+    async def add_transactions_async(self,
+            transactions: List[Tuple[bytes, Transaction, TxFlags]], external: bool=False) -> None:
+        """
+        The batch equivalent of `add_transaction`, for callers on the event loop. The transactions
+        are written together, and a single `transactions_added` event is triggered for those that
+        were successfully written once all the writes are complete.
+        """
+        if self._stopped:
+            self._logger.debug("add_transactions_async on stopped wallet: %d", len(transactions))
+            return
+
+        transactions = self._sort_transactions_by_dependency(transactions)
+        futures = self._transaction_cache.add_transactions(transactions)
+        for tx_hash, tx, _flags in transactions:
+            self.index_transaction_spends(tx_hash, tx)
+        involved_account_ids = self._process_transactions_key_usage(transactions)
+
+        failed_tx_hashes: List[bytes] = []
+        for tx_hash, future in futures:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception as e:
+                # The writer thread logs the details of the failure.
+                self._logger.error("add_transactions_async write failed for %s: %r",
+                    hash_to_hex_str(tx_hash), e)
+                failed_tx_hashes.append(tx_hash)
+        if len(failed_tx_hashes):
+            self._transaction_cache.reload_entries(failed_tx_hashes)
+
+        added_transactions = [ (tx_hash, tx, involved_account_ids[tx_hash])
+            for tx_hash, tx, _flags in transactions if tx_hash not in failed_tx_hashes ]
+        self._logger.debug("wallet.add_transactions_async: %d", len(added_transactions))
+        if len(added_transactions):
+            self.trigger_callback('transactions_added', added_transactions, external)
+
+    @staticmethod
+    def _sort_transactions_by_dependency(
+            transactions: List[Tuple[bytes, Transaction, TxFlags]]) \
+                -> List[Tuple[bytes, Transaction, TxFlags]]:
+        """
+        Order the transactions so that any parent in the batch comes before it's children, and
+        drop any duplicates.
+        """
+        entries = { t[0]: t for t in transactions }
+        ordered: List[Tuple[bytes, Transaction, TxFlags]] = []
+        visited: Set[bytes] = set()
+        for tx_hash in entries:
+            # This is an iterative depth first traversal, as chains can be very long.
+            stack = [ (tx_hash, False) ]
+            while stack:
+                stack_hash, is_expanded = stack.pop()
+                if is_expanded:
+                    ordered.append(entries[stack_hash])
+                    continue
+                if stack_hash in visited:
+                    continue
+                visited.add(stack_hash)
+                stack.append((stack_hash, True))
+                for txin in entries[stack_hash][1].inputs:
+                    if txin.prev_hash in entries and txin.prev_hash not in visited:
+                        stack.append((txin.prev_hash, False))
+        return ordered
+
+    def _process_transactions_key_usage(self,
+            transactions: List[Tuple[bytes, Transaction, TxFlags]]) -> Dict[bytes, Set[int]]:
+        """
+        Process the transactions for the accounts they affect, returning the ids of the accounts
+        that each was relevant to. The transactions are expected to be in dependency order.
+        """
+        output_account_ids: Dict[TxoKeyType, Set[int]] = {}
+        account_transactions: Dict[int, List[Tuple[bytes, Transaction]]] = defaultdict(list)
+        for tx_hash, tx, _flags in transactions:
+            for account_id in self._get_transaction_account_ids(tx_hash, tx, output_account_ids):
+                account_transactions[account_id].append((tx_hash, tx))
+
+        involved_account_ids: Dict[bytes, Set[int]] = { t[0]: set() for t in transactions }
+        for account_id, tx_hashes in self._process_accounts_key_usage(account_transactions):
+            for tx_hash in tx_hashes:
+                involved_account_ids[tx_hash].add(account_id)
+        return involved_account_ids
+
+    def refresh_transaction_metadata(self, tx_hashes: Sequence[bytes]) -> None:
+        "Update the accounts for changes to the heights of the given transactions."
+        for account in self._accounts.values():
+            account.refresh_transaction_metadata(tx_hashes)
+
+    def index_transaction_spends(self, tx_hash: bytes, tx: Transaction) -> None:
+        "Record the outpoints spent by the given transaction."
+        if tx.is_coinbase():
+            return
+        with self._outpoint_spenders_lock:
+            if tx_hash in self._spent_outpoints:
+                return
+            txo_keys = [ TxoKeyType(txin.prev_hash, txin.prev_idx) for txin in tx.inputs ]
+            for txo_key in txo_keys:
+                self._outpoint_spenders[txo_key] = tx_hash
+            self._spent_outpoints[tx_hash] = txo_keys
+
+    def remove_transaction_spends(self, tx_hash: bytes) -> None:
+        with self._outpoint_spenders_lock:
+            for txo_key in self._spent_outpoints.pop(tx_hash, []):
+                if self._outpoint_spenders.get(txo_key) == tx_hash:
+                    del self._outpoint_spenders[txo_key]
+
+    def is_transaction_spends_indexed(self, tx_hash: bytes) -> bool:
+        with self._outpoint_spenders_lock:
+            return tx_hash in self._spent_outpoints
+
+    def get_outpoint_spender(self, tx_hash: bytes, output_index: int) -> Optional[bytes]:
+        "The indexed transaction that spends the given outpoint, if there is one."
+        with self._outpoint_spenders_lock:
+            return self._outpoint_spenders.get(TxoKeyType(tx_hash, output_index))
+
+    def _get_transaction_account_ids(self, tx_hash: bytes, tx: Transaction,
+            batch_output_account_ids: Optional[Dict[TxoKeyType, Set[int]]]=None) -> Set[int]:
+        """
+        The accounts that may be affected by the transaction, that it either pays to or spends
+        from. These are the only accounts that need to process it.
+
+        Coins from earlier transactions in the same batch are not known to the accounts yet, so
+        the accounts each output is routed to are recorded in the batch mapping if given.
+        """
+        account_ids: Set[int] = set()
+        with self._script_routes_lock:
+            script_routes = self._get_script_routes()
+            for output_index, output in enumerate(tx.outputs):
+                routes = script_routes.get(bytes(output.script_pubkey))
+                if routes is None:
+                    continue
+                routed_account_ids = set(account_id for account_id, _keyinstance_id in routes)
+                account_ids |= routed_account_ids
+                if batch_output_account_ids is not None:
+                    batch_output_account_ids[TxoKeyType(tx_hash, output_index)] = \
+                        routed_account_ids
+        if batch_output_account_ids:
+            for txin in tx.inputs:
+                account_ids |= batch_output_account_ids.get(
+                    TxoKeyType(txin.prev_hash, txin.prev_idx), set())
+        # The spent coins are found by outpoint, which each account indexes.
+        for account in self._accounts.values():
+            if account.get_id() in account_ids:
+                continue
+            for txin in tx.inputs:
+                if account.get_utxo(txin.prev_hash, txin.prev_idx) is not None:
+                    account_ids.add(account.get_id())
+                    break
+        return account_ids
+
+    def _process_accounts_key_usage(self,
+            account_transactions: Dict[int, List[Tuple[bytes, Transaction]]]) \
+                -> List[Tuple[int, List[bytes]]]:
+        """
+        Each account processes its transactions in the given order, with different accounts
+        processed in parallel on the account worker pool. The results are returned in account id
+        order, with the hashes of the transactions that were relevant to each account.
+        """
+        def _process_account(account_id: int,
+                entries: List[Tuple[bytes, Transaction]]) -> List[bytes]:
+            account = self._accounts[account_id]
+            return [ tx_hash for tx_hash, tx in entries
+                if account.process_key_usage(tx_hash, tx, None) ]
+
+        account_ids = sorted(account_transactions)
+        if len(account_ids) < 2:
+            # There is no point in the overhead of the worker pool for one account.
+            return [ (account_id, _process_account(account_id, account_transactions[account_id]))
+                for account_id in account_ids ]
+
+        futures = [ (account_id, self._account_executor.submit(_process_account, account_id,
+            account_transactions[account_id])) for account_id in account_ids ]
+        return [ (account_id, future.result()) for account_id, future in futures ]
+
+    def _process_transaction_key_usage(self, tx_hash: bytes, tx: Transaction) -> Set[int]:
+        return self._process_transactions_key_usage([ (tx_hash, tx, TxFlags.Unset) ])[tx_hash]
+
     # Called by network.
     def add_transaction_proof(self, tx_hash: bytes, height: int, timestamp: int, position: int,
             proof_position: int, proof_branch: Sequence[bytes]) -> None:
@@ -2661,6 +3500,7 @@ class Wallet(TriggeredCallbacks):
 
         proof = TxProof(proof_position, proof_branch)
         self._transaction_cache.update_proof(tx_hash, proof)
+        self.refresh_transaction_metadata([ tx_hash ])
 
         height, conf, _timestamp = self.get_tx_height(tx_hash)
         self._logger.debug("add_transaction_proof %d %d %d", height, conf, timestamp)
@@ -2701,6 +3541,7 @@ class Wallet(TriggeredCallbacks):
         reorg_count, updated_tx_hashes = self._transaction_cache.apply_reorg(above_height)
         self._logger.info(
             f'removing verification of {reorg_count} transactions above {above_height}')
+        self.refresh_transaction_metadata(updated_tx_hashes)
 
         if self._storage.get('deactivate_used_keys', False):
             for account in self._accounts.values():
@@ -2794,6 +3635,9 @@ class Wallet(TriggeredCallbacks):
             self._network.remove_wallet(self)
         if self._transaction_table is not None:
             self._transaction_table.close()
+        self._account_executor.shutdown()
+        self._key_derivation.shutdown()
+        self._signing_engine.shutdown()
         self._storage.close()
         self._network = None
         self._stopped = True
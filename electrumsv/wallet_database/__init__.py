@@ -1,4 +1,5 @@
-from .sqlite_support import DatabaseContext, SynchronousWriter, SqliteWriteDispatcher
+from .sqlite_support import (DatabaseContext, SqliteConnectionProfile, SynchronousWriter,
+    SqliteWriteDispatcher)
 from .cache import TransactionCache, TransactionCacheEntry
 from .tables import (AccountTable, DataPackingError, InvalidDataError, KeyInstanceTable,
     MasterKeyTable, PaymentRequestTable, TransactionTable, TransactionDeltaTable,
@@ -4,6 +4,8 @@ needs to be authoritatively cached above the database. This also reduces the loc
 there will be no reads or
 """
 
+from collections import OrderedDict
+from functools import partial
 import threading
 import time
 from typing import cast, Dict, Iterable, List, Optional, Sequence, Tuple
@@ -13,6 +15,7 @@ from bitcoinx import double_sha256, hash_to_hex_str
 from ..constants import TxFlags, MAXIMUM_TXDATA_CACHE_SIZE_MB
 from ..logs import logs
 from ..transaction import Transaction
+from .sqlite_support import WriteFutureType
 from .tables import (CompletionCallbackType, InvalidDataError, MAGIC_UNTOUCHED_BYTEDATA,
     MissingRowError, TransactionTable, TxData, TxProof, TransactionRow)
 from ..util.cache import LRUCache
@@ -29,16 +32,48 @@ class TransactionCacheEntry:
 
 
 class TransactionCache:
-    def __init__(self, store: TransactionTable, txdata_cache_size: Optional[int]=None) -> None:
+    # The recently accessed transactions are also kept deserialized, in addition to the serialized
+    # bytes in the size limited cache. They are limited to this fraction of the size of that cache,
+    # measured by serialized size as the parsed objects are too costly to measure.
+    PARSED_TRANSACTION_CACHE_DIVISOR = 4
+    # The number of transactions known not to be in the wallet, that are remembered to avoid
+    # looking for them in the store again.
+    MISSING_TRANSACTION_CACHE_COUNT = 1000
+
+    def __init__(self, store: TransactionTable, txdata_cache_size: Optional[int]=None,
+            metadata_cache_size: Optional[int]=None) -> None:
+        """
+        If `metadata_cache_size` is not given, the metadata for every transaction in the wallet
+        is loaded and kept resident. Otherwise at most that many entries are kept, with the least
+        recently used being evicted and reloaded from the store when next needed.
+        """
         if txdata_cache_size is None:
             txdata_cache_size = MAXIMUM_TXDATA_CACHE_SIZE_MB * (1024 * 1024)
 
         self._logger = logs.get_logger("cache-tx")
-        self._cache: Dict[bytes, TransactionCacheEntry] = {}
+        self._cache: "OrderedDict[bytes, TransactionCacheEntry]" = OrderedDict()
+        self._metadata_cache_size = metadata_cache_size
         self._txdata_cache = LRUCache(max_size=txdata_cache_size)
+        self._parsed_txdata_cache = LRUCache(
+            max_size=txdata_cache_size // self.PARSED_TRANSACTION_CACHE_DIVISOR)
+        # This is only needed if residency is bounded, otherwise all unknown hashes are missing.
+        self._missing_cache = LRUCache(max_count=self.MISSING_TRANSACTION_CACHE_COUNT,
+            size_func=lambda value: 0)
+        # How many lookups of transactions not in the wallet did and did not avoid the store.
+        self._unknown_lookups_avoided = 0
+        self._unknown_lookups_made = 0
         self._store = store
 
         self._lock = threading.RLock()
+        # The number of uncommitted writes for each transaction, when residency is bounded. These
+        # entries cannot be evicted as the store does not reflect them yet. This has it's own lock
+        # as it is updated on the writer thread, which must never wait on the cache lock.
+        self._pending_writes: Dict[bytes, int] = {}
+        self._pending_writes_lock = threading.Lock()
+
+        if metadata_cache_size is not None:
+            self._logger.debug("caching up to %d metadata records", metadata_cache_size)
+            return
 
         self._logger.debug("caching all metadata records")
         self.get_metadatas()
@@ -49,7 +84,7 @@ class TransactionCache:
             self._logger.debug("attempting to cache unsettled transaction bytedata")
             rows = self._store.read(TxFlags.HasByteData, TxFlags.HasByteData|TxFlags.StateSettled)
             for row in rows:
-                self._txdata_cache.set(row[0], Transaction.from_bytes(row[1]))
+                self._set_cached_bytedata(row[0], row[1])
             self._logger.debug("matched/cached %d unsettled transactions", len(rows))
 
     def set_store(self, store: TransactionTable) -> None:
@@ -57,7 +92,155 @@ class TransactionCache:
 
     def set_maximum_cache_size_for_bytedata(self, maximum_size: int,
             force_resize: bool=False) -> None:
-        self._txdata_cache.set_maximum_size(maximum_size, force_resize)
+        with self._lock:
+            removals = self._txdata_cache.set_maximum_size(maximum_size, force_resize)
+            self._parsed_txdata_cache.set_maximum_size(
+                maximum_size // self.PARSED_TRANSACTION_CACHE_DIVISOR, force_resize)
+            self._purge_parsed_transactions(removals)
+
+    def _set_entry(self, tx_hash: bytes, entry: TransactionCacheEntry) -> None:
+        self._cache[tx_hash] = entry
+        if self._metadata_cache_size is not None:
+            self._missing_cache.set(tx_hash, None)
+            self._cache.move_to_end(tx_hash)
+            self._evict_entries()
+
+    def _evict_entries(self) -> None:
+        excess_count = len(self._cache) - cast(int, self._metadata_cache_size)
+        if excess_count <= 0:
+            return
+        # Pinned entries that are encountered are moved to the most recently used end, so that
+        # later evictions do not have to walk past them again. Each entry is looked at once at
+        # most, which stops this when everything that is left is pinned.
+        for _i in range(len(self._cache)):
+            tx_hash = next(iter(self._cache))
+            if tx_hash in self._pending_writes:
+                self._cache.move_to_end(tx_hash)
+                continue
+            del self._cache[tx_hash]
+            excess_count -= 1
+            if excess_count == 0:
+                break
+
+    def _track_write(self, tx_hashes: List[bytes], future: Optional[WriteFutureType]) -> None:
+        """
+        Pin the entries for the given transactions in the cache until the write is committed.
+        This should be done before the entries are (re)inserted into the cache.
+        """
+        if self._metadata_cache_size is None or future is None:
+            return
+        with self._pending_writes_lock:
+            for tx_hash in tx_hashes:
+                self._pending_writes[tx_hash] = self._pending_writes.get(tx_hash, 0) + 1
+        future.add_done_callback(partial(self._on_write_done, tx_hashes))
+
+    def _on_write_done(self, tx_hashes: List[bytes], _future: WriteFutureType) -> None:
+        # This is called on the writer thread and must not acquire the cache lock.
+        with self._pending_writes_lock:
+            for tx_hash in tx_hashes:
+                pending_count = self._pending_writes[tx_hash] - 1
+                if pending_count:
+                    self._pending_writes[tx_hash] = pending_count
+                else:
+                    del self._pending_writes[tx_hash]
+
+    def _lookup_entries(self, tx_hashes: Iterable[bytes]) -> Dict[bytes, TransactionCacheEntry]:
+        """
+        Get the entries for the given transactions, where they exist. If residency is bounded any
+        entries that are not resident are loaded from the store.
+        """
+        results: Dict[bytes, TransactionCacheEntry] = {}
+        if self._metadata_cache_size is None:
+            for tx_hash in tx_hashes:
+                entry = self._cache.get(tx_hash)
+                if entry is not None:
+                    results[tx_hash] = entry
+            return results
+
+        missing_tx_hashes: List[bytes] = []
+        for tx_hash in tx_hashes:
+            entry = self._cache.get(tx_hash)
+            if entry is not None:
+                results[tx_hash] = entry
+                self._cache.move_to_end(tx_hash)
+            elif tx_hash in self._pending_writes:
+                # Pinned entries are always resident, unless the pending write is the deletion.
+                pass
+            elif self._missing_cache.get(tx_hash) is not None:
+                self._unknown_lookups_avoided += 1
+            else:
+                missing_tx_hashes.append(tx_hash)
+        if len(missing_tx_hashes):
+            for tx_hash, flags_get, metadata in self._store.read_metadata(
+                    tx_hashes=missing_tx_hashes):
+                entry = TransactionCacheEntry(metadata, flags_get)
+                results[tx_hash] = entry
+                self._cache[tx_hash] = entry
+            self._evict_entries()
+            for tx_hash in missing_tx_hashes:
+                if tx_hash not in results:
+                    self._unknown_lookups_made += 1
+                    if tx_hash not in self._missing_cache:
+                        self._missing_cache.set(tx_hash, True)
+        return results
+
+    def get_missing_cache_stats(self) -> Tuple[int, int]:
+        """
+        The number of lookups of transactions not in the wallet that did and did not avoid the
+        store. Lookups of evicted entries that are in the store are not included.
+        """
+        return self._unknown_lookups_avoided, self._unknown_lookups_made
+
+    def _lookup_entry(self, tx_hash: bytes) -> Optional[TransactionCacheEntry]:
+        return self._lookup_entries([ tx_hash ]).get(tx_hash)
+
+    def _scan_entries(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None) \
+            -> List[Tuple[bytes, TransactionCacheEntry]]:
+        """
+        Match against all the transactions in the wallet, when residency is bounded. The resident
+        entries take precedence over the store as they may have uncommitted changes. The entries
+        that are read from the store are not made resident.
+        """
+        results = [ (tx_hash, entry) for tx_hash, entry in self._cache.items()
+            if self._entry_visible(entry.flags, flags, mask) ]
+        for tx_hash, flags_get, metadata in self._store.read_metadata(flags, mask):
+            if tx_hash not in self._cache and tx_hash not in self._pending_writes:
+                results.append((tx_hash, TransactionCacheEntry(metadata, flags_get)))
+        return results
+
+    def _get_cached_transaction(self, tx_hash: bytes) -> Optional[Transaction]:
+        # The size limited cache of serialized bytes decides what is cached, the parsed objects
+        # are only kept for the most recently used of those.
+        bytedata = self._txdata_cache.get(tx_hash)
+        if bytedata is None:
+            return None
+        tx = self._parsed_txdata_cache.get(tx_hash)
+        if tx is None:
+            tx = Transaction.from_bytes(bytedata)
+            self._parsed_txdata_cache.set(tx_hash, tx, len(bytedata))
+        return tx
+
+    def _set_cached_transaction(self, tx_hash: bytes, tx: Optional[Transaction],
+            bytedata: Optional[bytes]=None) -> None:
+        # The caches do not support setting a value equal to the existing one.
+        self._txdata_cache.set(tx_hash, None)
+        self._parsed_txdata_cache.set(tx_hash, None)
+        if tx is not None:
+            if bytedata is None:
+                bytedata = tx.to_bytes()
+            if self._set_cached_bytedata(tx_hash, bytedata):
+                self._parsed_txdata_cache.set(tx_hash, tx, len(bytedata))
+
+    def _set_cached_bytedata(self, tx_hash: bytes, bytedata: bytes) -> bool:
+        added, removals = self._txdata_cache.set(tx_hash, bytedata)
+        self._purge_parsed_transactions(removals)
+        return added
+
+    def _purge_parsed_transactions(self, removals: List[Tuple[bytes, bytes]]) -> None:
+        # A parsed transaction is only kept while it's bytes are, otherwise it would be outside
+        # of the byte budget of the cache.
+        for tx_hash, _bytedata in removals:
+            self._parsed_txdata_cache.set(tx_hash, None)
 
     def _validate_transaction_bytes(self, tx_hash: bytes, bytedata: Optional[bytes]) -> bool:
         if bytedata is None:
@@ -101,26 +284,76 @@ class TransactionCache:
 
     def add_transaction(self, tx_hash: bytes, tx: Transaction,
             flags: TxFlags=TxFlags.Unset,
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) \
+                -> Optional[WriteFutureType]:
+        """
+        Returns the future for the database write, or `None` if the transaction was already
+        present and there was nothing to update.
+        """
         assert isinstance(tx, Transaction)
 
         with self._lock:
             date_updated = self._store._get_current_timestamp()
-            if tx_hash in self._cache:
-                self.update([ (tx_hash, TxData(date_added=date_updated, date_updated=date_updated),
-                    tx, flags | TxFlags.HasByteData) ], completion_callback=completion_callback)
-            else:
-                self.add([(tx_hash, TxData(date_added=date_updated, date_updated=date_updated),
-                        tx, flags | TxFlags.HasByteData, None)],
-                    completion_callback=completion_callback)
+            if self._lookup_entry(tx_hash) is not None:
+                return self._update([ (tx_hash, TxData(date_added=date_updated,
+                    date_updated=date_updated), tx, flags | TxFlags.HasByteData) ],
+                    completion_callback=completion_callback)[1]
+            return self._add([(tx_hash, TxData(date_added=date_updated,
+                    date_updated=date_updated), tx, flags | TxFlags.HasByteData, None)],
+                completion_callback=completion_callback)
+
+    def add_transactions(self, transactions: List[Tuple[bytes, Transaction, TxFlags]]) \
+            -> List[Tuple[bytes, WriteFutureType]]:
+        """
+        The batch equivalent of `add_transaction`. Each transaction is written separately, so
+        that a failed write only affects that transaction, and the writer thread still commits
+        them in batches. Returns the futures for the database writes, for each transaction that
+        needed one.
+        """
+        with self._lock:
+            date_updated = self._store._get_current_timestamp()
+            existing_entries = self._lookup_entries(t[0] for t in transactions)
+            inserts: List[Tuple[bytes, TxData, Transaction, TxFlags, Optional[str]]] = []
+            updates: List[Tuple[bytes, TxData, Optional[Transaction], TxFlags]] = []
+            for tx_hash, tx, flags in transactions:
+                assert isinstance(tx, Transaction)
+                metadata = TxData(date_added=date_updated, date_updated=date_updated)
+                if tx_hash in existing_entries:
+                    updates.append((tx_hash, metadata, tx, flags | TxFlags.HasByteData))
+                else:
+                    inserts.append((tx_hash, metadata, tx, flags | TxFlags.HasByteData, None))
+
+            futures: List[Tuple[bytes, WriteFutureType]] = []
+            for insert in inserts:
+                futures.append((insert[0], self._add([ insert ])))
+            for update in updates:
+                future = self._update([ update ])[1]
+                if future is not None:
+                    futures.append((update[0], future))
+            return futures
+
+    def reload_entries(self, tx_hashes: List[bytes]) -> None:
+        """
+        Discard what is cached for the given transactions and reload it from the store. The cache
+        is changed before the writes are committed, and this restores it if they fail.
+        """
+        with self._lock:
+            for tx_hash in tx_hashes:
+                self._cache.pop(tx_hash, None)
+                self._set_cached_transaction(tx_hash, None)
+            if self._metadata_cache_size is None:
+                # All the entries are expected to be resident.
+                for tx_hash, flags_get, metadata in self._store.read_metadata(
+                        tx_hashes=tx_hashes):
+                    self._cache[tx_hash] = TransactionCacheEntry(metadata, flags_get)
 
     def add(self, inserts: List[Tuple[bytes, TxData, Transaction, TxFlags, Optional[str]]],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
         with self._lock:
             return self._add(inserts, completion_callback=completion_callback)
 
     def _add(self, inserts: List[Tuple[bytes, TxData, Transaction, TxFlags, Optional[str]]],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
         """
         This infers the bytedata flag from the bytedata value for a given input row, and
         alters the flags to reflect that inference. This differs from update, which uses
@@ -128,6 +361,7 @@ class TransactionCache:
         overwrite them.
         """
         date_added = self._store._get_current_timestamp()
+        new_entries: List[Tuple[bytes, TransactionCacheEntry]] = []
         for i, (tx_hash, metadata, tx, add_flags, description) in enumerate(inserts):
             assert tx_hash not in self._cache, \
                 f"Tx {hash_to_hex_str(tx_hash)} found in cache unexpectedly"
@@ -139,23 +373,38 @@ class TransactionCache:
             self._validate_new_flags(tx_hash, flags)
             metadata = TxData(metadata.height, metadata.position, metadata.fee, date_added,
                 date_added)
-            self._cache[tx_hash] = TransactionCacheEntry(metadata, flags)
+            new_entries.append((tx_hash, TransactionCacheEntry(metadata, flags)))
             bytedata = None
             if tx is not None:
-                self._txdata_cache.set(tx_hash, tx)
                 bytedata = tx.to_bytes()
+                self._set_cached_transaction(tx_hash, tx, bytedata)
             inserts[i] = TransactionRow(  # type:ignore
                 tx_hash, metadata, bytedata, flags, description)
-        self._store.create(inserts, completion_callback=completion_callback)  # type:ignore
+        future = self._store.create(inserts,  # type:ignore
+            completion_callback=completion_callback)
+        self._track_write([ t[0] for t in new_entries ], future)
+        for tx_hash, entry in new_entries:
+            self._set_entry(tx_hash, entry)
+        return future
 
     def update(self, updates: List[Tuple[bytes, TxData, Optional[Transaction], TxFlags]],
             completion_callback: Optional[CompletionCallbackType]=None) -> int:
         with self._lock:
-            return self._update(updates, completion_callback=completion_callback)
+            return self._update(updates, completion_callback=completion_callback)[0]
+
+    def queue_update(self, updates: List[Tuple[bytes, TxData, Optional[Transaction], TxFlags]]) \
+            -> Optional[WriteFutureType]:
+        """
+        Returns the future for the database write, or `None` if none of the updates resulted
+        in changes that needed to be written.
+        """
+        with self._lock:
+            return self._update(updates)[1]
 
     def _update(self, updates: List[Tuple[bytes, TxData, Optional[Transaction], TxFlags]],
             update_all: bool=True,
-            completion_callback: Optional[CompletionCallbackType]=None) -> int:
+            completion_callback: Optional[CompletionCallbackType]=None) \
+                -> Tuple[int, Optional[WriteFutureType]]:
         """
         The flagged changes are applied to the existing entry, leaving the unflagged aspects
         as they were. An example of this is bytedata, the bytedata in the existing entry should
@@ -169,6 +418,7 @@ class TransactionCache:
         update_map = { t[0]: t for t in updates }
         desired_update_hashes = set(update_map)
         updated_entries: List[Tuple[bytes, TxData, Optional[bytes], TxFlags]] = []
+        new_entries: List[Tuple[bytes, TransactionCacheEntry]] = []
 
         date_updated = self._store._get_current_timestamp()
         for tx_hash, entry in self._get_entries(tx_hashes=desired_update_hashes,
@@ -205,14 +455,14 @@ class TransactionCache:
             new_entry = TransactionCacheEntry(new_metadata, flags, entry.time_loaded)
             self._logger.debug("_update: %s %r %s %r %r", hash_to_hex_str(tx_hash),
                 incoming_metadata, TxFlags.to_repr(incoming_flags), entry, new_entry)
-            self._cache[tx_hash] = new_entry
+            new_entries.append((tx_hash, new_entry))
             if incoming_tx:  # serialize txs -> binary before all db writes
                 incoming_bytedata: Optional[bytes] = incoming_tx.to_bytes()
             else:
                 incoming_bytedata = None
 
             if incoming_flags & TxFlags.HasByteData:
-                self._txdata_cache.set(tx_hash, incoming_tx)
+                self._set_cached_transaction(tx_hash, incoming_tx, incoming_bytedata)
             elif flags & TxFlags.HasByteData:
                 # Indicate the user is not changing the bytedata, it's a metadata/flags update.
                 incoming_bytedata = MAGIC_UNTOUCHED_BYTEDATA
@@ -220,9 +470,13 @@ class TransactionCache:
 
         # The reason we don't dispatch metadata and entry updates as separate calls
         # is that there's no way of reusing a completion context for more than one thing.
+        future: Optional[WriteFutureType] = None
         if len(updated_entries):
-            self._store.update(updated_entries, completion_callback=completion_callback)
-        return len(updated_entries)
+            future = self._store.update(updated_entries, completion_callback=completion_callback)
+            self._track_write([ t[0] for t in new_entries ], future)
+            for tx_hash, new_entry in new_entries:
+                self._set_entry(tx_hash, new_entry)
+        return len(updated_entries), future
 
     # TODO: This is problematic as it discards non-metadata flags unless the caller provides a mask
     # that preserves the ones that should be preserved. Perhaps mask should be obligatory.
@@ -245,8 +499,10 @@ class TransactionCache:
             metadata = entry.metadata
             entry.metadata = TxData(metadata.height, metadata.position, metadata.fee,
                 metadata.date_added, date_updated)
-            self._store.update_flags([ (tx_hash, flags, mask, date_updated) ],
+            future = self._store.update_flags([ (tx_hash, flags, mask, date_updated) ],
                 completion_callback=completion_callback)
+            self._track_write([ tx_hash ], future)
+            self._set_entry(tx_hash, entry)
         return entry.flags
 
     def update_proof(self, tx_hash: bytes, proof: TxProof,
@@ -258,27 +514,35 @@ class TransactionCache:
             metadata = entry.metadata
             entry.metadata = TxData(metadata.height, metadata.position, metadata.fee,
                 metadata.date_added, date_updated)
-            self._store.update_proof([ (tx_hash, proof, date_updated) ],
+            future = self._store.update_proof([ (tx_hash, proof, date_updated) ],
                 completion_callback=completion_callback)
+            self._track_write([ tx_hash ], future)
+            self._set_entry(tx_hash, entry)
 
     def delete(self, tx_hash: bytes,
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         with self._lock:
             self._logger.debug("cache_deletion: %s", hash_to_hex_str(tx_hash))
-            del self._cache[tx_hash]
-            self._txdata_cache.set(tx_hash, None)
-            self._store.delete([ tx_hash ], completion_callback=completion_callback)
+            entry = self._cache.pop(tx_hash, None)
+            assert entry is not None or self._metadata_cache_size is not None
+            self._set_cached_transaction(tx_hash, None)
+            future = self._store.delete([ tx_hash ], completion_callback=completion_callback)
+            # A pinned transaction that is not resident is treated as deleted.
+            self._track_write([ tx_hash ], future)
+            if self._metadata_cache_size is not None and tx_hash not in self._missing_cache:
+                self._missing_cache.set(tx_hash, True)
 
     def get_flags(self, tx_hash: bytes) -> Optional[TxFlags]:
-        # We cache all metadata, so this can avoid touching the database.
-        entry = self._cache.get(tx_hash)
+        # If all metadata is cached, this can avoid touching the database.
+        with self._lock:
+            entry = self._lookup_entry(tx_hash)
         if entry is not None:
             return entry.flags
         return None
 
-    # NOTE: Only used by unit tests at this time.
     def is_cached(self, tx_hash: bytes) -> bool:
-        return tx_hash in self._cache
+        with self._lock:
+            return self._lookup_entry(tx_hash) is not None
 
     # This should not be used to get
     def get_entry(self, tx_hash: bytes, flags: Optional[TxFlags]=None,
@@ -291,8 +555,10 @@ class TransactionCache:
             force_store_fetch: bool=False) -> Optional[TransactionCacheEntry]:
         # We want to hit the cache, but only if we can give them what they want. Generally if
         # something is cached, then all we may lack is the bytedata.
-        if not force_store_fetch and tx_hash in self._cache:
-            entry = self._cache[tx_hash]
+        entry: Optional[TransactionCacheEntry] = None
+        if not force_store_fetch:
+            entry = self._lookup_entry(tx_hash)
+        if entry is not None:
             # If they filter the entry they request, we only give them a matched result.
             if not self._entry_visible(entry.flags, flags, mask):
                 return None
@@ -300,8 +566,7 @@ class TransactionCache:
             if mask is not None and (mask & TxFlags.HasByteData) == 0:
                 return entry
             # If they do, and we have it cached, then give them the entry.
-            tx = self._txdata_cache.get(tx_hash)
-            if tx is not None:
+            if self._txdata_cache.get(tx_hash) is not None:
                 return entry
             force_store_fetch = True
         if not force_store_fetch:
@@ -314,9 +579,10 @@ class TransactionCache:
                 # Overwrite any existing entry for this transaction. Due to the lock, and lack of
                 # flushing we can assume that we will not be clobbering any fresh changes.
                 entry = TransactionCacheEntry(metadata, flags_get)
-                self._cache.update({ tx_hash: entry })
+                self._set_entry(tx_hash, entry)
                 if bytedata is not None:
-                    self._txdata_cache.set(tx_hash, Transaction.from_bytes(bytedata))
+                    self._set_cached_transaction(tx_hash, None)
+                    self._set_cached_bytedata(tx_hash, bytedata)
                 self._logger.debug("get_entry/cache_change: %r", (hash_to_hex_str(tx_hash),
                     entry, TxFlags.to_repr(flags), TxFlags.to_repr(mask)))
                 # If they filter the entry they request, we only give them a matched result.
@@ -325,10 +591,7 @@ class TransactionCache:
                 return None
             raise InvalidDataError(tx_hash)
 
-        # TODO: If something is requested that does not exist, it will miss the cache and wait
-        # on the store access every time. It should be possible to cache misses and also maintain/
-        # update them on other accesses. A complication is the flag/mask filtering, which will
-        # not indicate presence of entries for the tx_hash.
+        # Known misses are remembered by the non-forced lookups, this is an explicit store fetch.
         return None
 
     def get_metadata(self, tx_hash: bytes, flags: Optional[TxFlags]=None,
@@ -338,13 +601,14 @@ class TransactionCache:
 
     def _get_metadata(self, tx_hash: bytes, flags: Optional[TxFlags]=None,
             mask: Optional[TxFlags]=None) -> Optional[TxData]:
-        if tx_hash in self._cache:
-            entry = self._cache[tx_hash]
+        entry = self._lookup_entry(tx_hash)
+        if entry is not None:
             return entry.metadata if self._entry_visible(entry.flags, flags, mask) else None
         return None
 
     def have_transaction_data(self, tx_hash: bytes) -> bool:
-        entry = self._cache.get(tx_hash)
+        with self._lock:
+            entry = self._lookup_entry(tx_hash)
         return entry is not None and (entry.flags & TxFlags.HasByteData) != 0
 
     def have_transaction_data_cached(self, tx_hash: bytes) -> bool:
@@ -382,19 +646,19 @@ class TransactionCache:
             for tx_hash, entry in self._get_entries(flags, mask, tx_hashes):
                 if entry.flags & TxFlags.HasByteData == 0:
                     continue
-                tx = self._txdata_cache.get(tx_hash)
+                tx = self._get_cached_transaction(tx_hash)
                 if tx is not None:
                     results.append((tx_hash, tx))
                 else:
                     missing_tx_hashes.append(tx_hash)
 
             if len(missing_tx_hashes):
-                for row in self._store.read(flags, mask, missing_tx_hashes):
-                    if row[2] & TxFlags.HasByteData != 0:
-                        bytedata = cast(bytes, row[1])
-                        tx = Transaction.from_bytes(bytedata)
-                        results.append((row[0], tx))  # type: ignore
-                        self._txdata_cache.set(row[0], tx)
+                # The cached metadata has already been matched against the filter, so only the
+                # bytes need to be fetched.
+                for tx_hash, bytedata in self._store.read_bytedata(missing_tx_hashes):
+                    tx = Transaction.from_bytes(bytedata)
+                    results.append((tx_hash, tx))
+                    self._set_cached_transaction(tx_hash, tx, bytedata)
         return results
 
     def get_entries(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None,
@@ -413,8 +677,10 @@ class TransactionCache:
 
         results = []
         if tx_hashes is not None:
+            tx_hashes = list(tx_hashes)
+            entries = self._lookup_entries(tx_hashes)
             for tx_hash in tx_hashes:
-                entry = self._cache.get(tx_hash)
+                entry = entries.get(tx_hash)
                 if entry is not None and self._entry_visible(entry.flags, flags, mask):
                     results.append((tx_hash, entry))
 
@@ -423,6 +689,8 @@ class TransactionCache:
                 have_hashes = set(t[0] for t in results)
                 if wanted_hashes != have_hashes:
                     raise MissingRowError(wanted_hashes - have_hashes)
+        elif self._metadata_cache_size is not None:
+            results = self._scan_entries(flags, mask)
         else:
             for tx_hash, entry in self._cache.items():
                 if self._entry_visible(entry.flags, flags, mask):
@@ -440,6 +708,10 @@ class TransactionCache:
     def _get_metadatas(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None,
             tx_hashes: Optional[Sequence[bytes]]=None,
             require_all: bool=True) -> List[Tuple[bytes, TxData]]:
+        if self._metadata_cache_size is not None:
+            return [ (tx_hash, entry.metadata) for tx_hash, entry
+                in self._get_entries(flags, mask, tx_hashes, require_all) ]
+
         if self._cache:
             if tx_hashes is not None:
                 matches = []
@@ -492,7 +764,8 @@ class TransactionCache:
         return results
 
     def get_height(self, tx_hash: bytes) -> Optional[int]:
-        entry = self._cache.get(tx_hash)
+        with self._lock:
+            entry = self._lookup_entry(tx_hash)
         if entry is not None and entry.flags & (TxFlags.StateSettled|TxFlags.StateCleared):
             return entry.metadata.height
         return None
@@ -503,13 +776,13 @@ class TransactionCache:
 
     def get_unverified_entries(self, watermark_height: int) \
             -> List[Tuple[bytes, TransactionCacheEntry]]:
-        results = self.get_metadatas(
+        results = self.get_entries(
             flags=TxFlags.HasByteData | TxFlags.HasHeight,
             mask=TxFlags.HasByteData | TxFlags.HasPosition | TxFlags.HasHeight)
         if len(results) > 200:
             results = results[:200]
-        return [ (tx_hash, self._cache[tx_hash]) for (tx_hash, metadata) in results
-            if 0 < cast(int, metadata.height) <= watermark_height ]
+        return [ (tx_hash, entry) for (tx_hash, entry) in results
+            if 0 < cast(int, entry.metadata.height) <= watermark_height ]
 
     def apply_reorg(self, reorg_height: int,
             completion_callback: Optional[CompletionCallbackType]=None) \
@@ -524,16 +797,21 @@ class TransactionCache:
             # This does not request bytedata so if all metadata is cached, will not hit the
             # database.
             store_updates = []
-            for (tx_hash, metadata) in self.get_metadatas(fetch_flags, fetch_mask):
+            updated_entries: List[Tuple[bytes, TransactionCacheEntry]] = []
+            for (tx_hash, entry) in self._get_entries(fetch_flags, fetch_mask):
+                metadata = entry.metadata
                 if cast(int, metadata.height) > reorg_height:
                     # Update the cached version to match the changes we are going to apply.
-                    entry = self._cache[tx_hash]
                     entry.flags = (entry.flags & unverify_mask) | TxFlags.StateCleared
                     # TODO(rt12) BACKLOG the real unconfirmed height may be -1 unconf parent
                     entry.metadata = TxData(height=0, fee=metadata.fee,
                         date_added=metadata.date_added, date_updated=date_updated)
                     store_updates.append((tx_hash, entry.metadata, entry.flags))
+                    updated_entries.append((tx_hash, entry))
             if len(store_updates):
-                self._store.update_metadata(store_updates,
+                future = self._store.update_metadata(store_updates,
                     completion_callback=completion_callback)
+                self._track_write([ t[0] for t in updated_entries ], future)
+                for tx_hash, entry in updated_entries:
+                    self._set_entry(tx_hash, entry)
             return len(store_updates), [tx_hash for tx_hash, metadata, flags in store_updates]
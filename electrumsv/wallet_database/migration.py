@@ -55,6 +55,9 @@ def create_database_file(wallet_path: str) -> None:
 def update_database(db: sqlite3.Connection) -> None:
     # This will error if the database has not been created correctly with the metadata.
     version = _get_migration(db)
+    # Moving the transaction bytes out of the transactions table leaves the space they used free
+    # but still allocated to the database file.
+    vacuum_required = version < 28
 
     from . import migrations
     with db:
@@ -70,12 +73,22 @@ def update_database(db: sqlite3.Connection) -> None:
         if version == 25:
             migrations.migration_0026_txo_coinbase_flag.execute(db)
             version += 1
+        if version == 26:
+            migrations.migration_0027_secondary_indexes.execute(db)
+            version += 1
+        if version == 27:
+            migrations.migration_0028_transaction_bytes.execute(db)
+            version += 1
 
         if version != MIGRATION_CURRENT:
             db.rollback()
             assert version == MIGRATION_CURRENT, \
                 f"Expected migration {MIGRATION_CURRENT}, got {version}"
 
+    if vacuum_required:
+        # This has to be done outside of a transaction.
+        db.execute("VACUUM")
+
     _ensure_matching_migration(db, MIGRATION_CURRENT)
 
 def update_database_file(wallet_path: str) -> None:
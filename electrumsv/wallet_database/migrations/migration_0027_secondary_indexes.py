@@ -0,0 +1,37 @@
+import json
+try:
+    # Linux expects the latest package version of 3.31.1 (as of p)
+    import pysqlite3 as sqlite3
+except ModuleNotFoundError:
+    # MacOS expects the latest brew version of 3.32.1 (as of 2020-07-10).
+    # Windows builds use the official Python 3.7.8 builds and version of 3.31.1.
+    import sqlite3 # type: ignore
+import time
+
+MIGRATION = 27
+
+def execute(conn: sqlite3.Connection) -> None:
+    # The account queries (history, key summaries, used key detection) all start from the keys
+    # in the account, and without this scan all the keys in the wallet.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_KeyInstances_account_id "
+        "ON KeyInstances(account_id, flags)")
+
+    # Lookups of the deltas for a given transaction, including the `AccountTransactions` view
+    # joins and transaction deletion. The value is included so the per-transaction totals are
+    # read from the index alone.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_TransactionDeltas_tx_hash "
+        "ON TransactionDeltas(tx_hash, keyinstance_id, value_delta)")
+
+    # Lookups of the outputs belonging to a given key.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_TransactionOutputs_keyinstance_id "
+        "ON TransactionOutputs(keyinstance_id)")
+
+    # Lookups of transactions in a given state, in block height order. This is deliberately kept
+    # narrow, the transaction rows are small once the bytes are moved out of them (migration 28)
+    # and an index covering all the metadata columns would be most of another copy of the table.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_Transactions_flags "
+        "ON Transactions(flags, block_height)")
+
+    date_updated = int(time.time())
+    conn.execute("UPDATE WalletData SET value=?, date_updated=? WHERE key=?",
+        [json.dumps(MIGRATION),date_updated,"migration"])
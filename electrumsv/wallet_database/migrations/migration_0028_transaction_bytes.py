@@ -0,0 +1,37 @@
+import json
+try:
+    # Linux expects the latest package version of 3.31.1 (as of p)
+    import pysqlite3 as sqlite3
+except ModuleNotFoundError:
+    # MacOS expects the latest brew version of 3.32.1 (as of 2020-07-10).
+    # Windows builds use the official Python 3.7.8 builds and version of 3.31.1.
+    import sqlite3 # type: ignore
+import time
+
+from electrumsv.constants import TxBytesEncoding
+
+MIGRATION = 28
+
+def execute(conn: sqlite3.Connection) -> None:
+    # Transaction bytes can be large, and when stored inline with the metadata every scan of the
+    # metadata has to page through them. They are kept separately from now on.
+    conn.execute("CREATE TABLE IF NOT EXISTS TransactionBytes ("
+        "tx_hash BLOB PRIMARY KEY,"
+        "encoding INTEGER NOT NULL,"
+        "tx_data BLOB NOT NULL,"
+        "FOREIGN KEY(tx_hash) REFERENCES Transactions (tx_hash) ON DELETE CASCADE"
+    ")")
+
+    # The existing bytes are moved as-is, compression only applies to new writes.
+    conn.execute("INSERT INTO TransactionBytes (tx_hash, encoding, tx_data) "
+        f"SELECT tx_hash, {TxBytesEncoding.RAW}, tx_data FROM Transactions "
+        "WHERE tx_data IS NOT NULL")
+    # The column cannot be dropped with the SQLite versions we support, so it is left unused.
+    # The pages the bytes occupied are only freed for reuse, and the file does not shrink until
+    # it is vacuumed. That cannot be done within the migration transaction, so `update_database`
+    # does it after committing this migration.
+    conn.execute("UPDATE Transactions SET tx_data=NULL WHERE tx_data IS NOT NULL")
+
+    date_updated = int(time.time())
+    conn.execute("UPDATE WalletData SET value=?, date_updated=? WHERE key=?",
+        [json.dumps(MIGRATION),date_updated,"migration"])
@@ -1,3 +1,7 @@
+import asyncio
+import bisect
+from collections import defaultdict
+import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import queue
@@ -11,11 +15,18 @@ except ModuleNotFoundError:
 import threading
 import time
 import traceback
-from typing import Any, Callable, List, NamedTuple, Optional, Tuple, Set
+import weakref
+from typing import (Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Set,
+    TYPE_CHECKING)
 
 from ..constants import DATABASE_EXT
 from ..logs import logs
 
+if TYPE_CHECKING:
+    from ..simple_config import SimpleConfig
+
+logger = logs.get_logger("sqlite-support")
+
 
 class LeakedSQLiteConnectionError(Exception):
     pass
@@ -73,13 +84,85 @@ class WriteDisabledError(Exception):
 
 WriteCallbackType = Callable[[sqlite3.Connection], None]
 CompletionCallbackType = Callable[[Optional[Exception]], None]
+WriteFutureType = concurrent.futures.Future
 class WriteEntryType(NamedTuple):
     write_callback: WriteCallbackType
     completion_callback: Optional[CompletionCallbackType]
     size_hint: int
+    future: Optional[WriteFutureType] = None
+    # The name of the store that made the write, for the metrics.
+    table_name: str = "unknown"
 
 CompletionEntryType = Tuple[CompletionCallbackType, Optional[Exception]]
 
+
+def _get_histogram(bounds: Sequence[int], counts: List[int]) -> Dict[str, int]:
+    histogram = { f"<={bound}": count for bound, count in zip(bounds, counts) }
+    histogram[f">{bounds[-1]}"] = counts[-1]
+    return histogram
+
+
+class SqliteWriteStats:
+    """
+    Metrics for the writes applied by the writer thread, for use in tuning the batching and
+    any caching layered above the database.
+
+    The writes and the bytes written are attributed to the table class that made each write. The
+    bytes written are what the writers hint their writes will add, which is zero for the tables
+    that only have small fixed size rows.
+    """
+    BATCH_SIZE_BOUNDS = (1, 10, 100, 1000)
+    COMMIT_LATENCY_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+        self._maximum_queue_depth = 0
+        self._batch_count = 0
+        self._write_count = 0
+        self._failed_write_count = 0
+        self._batch_size_counts = [ 0 ] * (len(self.BATCH_SIZE_BOUNDS) + 1)
+        self._commit_latency_counts = [ 0 ] * (len(self.COMMIT_LATENCY_BOUNDS_MS) + 1)
+        self._writes_by_table: Dict[str, int] = defaultdict(int)
+        self._bytes_by_table: Dict[str, int] = defaultdict(int)
+
+    def record_queue_depth(self, queue_depth: int) -> None:
+        # This is only ever increased, and is checked without the lock to keep puts cheap.
+        if queue_depth > self._maximum_queue_depth:
+            with self._lock:
+                self._maximum_queue_depth = max(self._maximum_queue_depth, queue_depth)
+
+    def record_batch(self, write_entries: List["WriteEntryType"], time_ms: int) -> None:
+        with self._lock:
+            self._batch_count += 1
+            self._write_count += len(write_entries)
+            self._batch_size_counts[bisect.bisect_left(self.BATCH_SIZE_BOUNDS,
+                len(write_entries))] += 1
+            self._commit_latency_counts[bisect.bisect_left(self.COMMIT_LATENCY_BOUNDS_MS,
+                time_ms)] += 1
+            for write_entry in write_entries:
+                self._writes_by_table[write_entry.table_name] += 1
+                self._bytes_by_table[write_entry.table_name] += write_entry.size_hint
+
+    def record_failed_write(self) -> None:
+        with self._lock:
+            self._failed_write_count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "maximum_queue_depth": self._maximum_queue_depth,
+                "batch_count": self._batch_count,
+                "write_count": self._write_count,
+                "failed_write_count": self._failed_write_count,
+                "batch_sizes": _get_histogram(self.BATCH_SIZE_BOUNDS, self._batch_size_counts),
+                "commit_latency_ms": _get_histogram(self.COMMIT_LATENCY_BOUNDS_MS,
+                    self._commit_latency_counts),
+                "writes_by_table": dict(self._writes_by_table),
+                "bytes_by_table": dict(self._bytes_by_table),
+            }
+
+
 class SqliteWriteDispatcher:
     """
     This is a relatively simple write batcher for Sqlite that keeps all the writes on one thread,
@@ -89,15 +172,31 @@ class SqliteWriteDispatcher:
 
     Completion notifications are done in a thread so as to not block the write dispatcher.
 
-    TODO: Allow writes to be wrapped with async logic so that async coroutines can do writes
-    in their natural fashion.
+    Any write entry can also carry a future, which is resolved directly by the writer thread
+    without going through the callback thread pool. Async coroutines can wrap this future with
+    `asyncio.wrap_future` and await the write in their natural fashion.
+
+    If the queue is given a maximum size, producers are held back while it is over that size.
+    Writes are always queued immediately, so that they are applied in the order they were made,
+    and it is the producer that then waits for the writer thread to catch up. Synchronous puts
+    block, except on an event loop thread, and asynchronous puts await it. Producers on an event
+    loop that use the synchronous puts, should either await their writes or `wait_for_room_async`.
     """
 
-    def __init__(self, db_context: "DatabaseContext") -> None:
+    # Batches are limited by whichever of these is reached first.
+    MAXIMUM_BATCH_ENTRIES = 1000
+    TARGET_BATCH_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, db_context: "DatabaseContext", maximum_queue_size: int=0) -> None:
         self._db_context = db_context
         self._logger = logs.get_logger("sqlite-writer")
+        self._stats = SqliteWriteStats()
 
+        # The queue itself is unbounded, the maximum size is applied by holding back producers.
         self._writer_queue: "queue.Queue[WriteEntryType]" = queue.Queue()
+        self._maximum_queue_size = maximum_queue_size
+        self._room_condition = threading.Condition()
+        self._async_room_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
         self._writer_thread = threading.Thread(target=self._writer_thread_main, daemon=True)
         self._writer_loop_event = threading.Event()
 
@@ -112,30 +211,24 @@ class SqliteWriteDispatcher:
     def _writer_thread_main(self) -> None:
         self._db: sqlite3.Connection = self._db_context.acquire_connection()
 
-        maximum_batch_size = 10
         write_entries: List[WriteEntryType] = []
-        write_entry_backlog: List[WriteEntryType] = []
+        # Batches that failed are split in half and retried, until the failing entry is isolated.
+        bisected_batches: List[List[WriteEntryType]] = []
         while self._is_alive:
             self._writer_loop_event.set()
 
-            if len(write_entry_backlog):
-                assert maximum_batch_size == 1
-                write_entries = [ write_entry_backlog.pop(0) ]
+            if len(bisected_batches):
+                write_entries = bisected_batches.pop(0)
             else:
-                # Block until we have at least one write action. If we already have write
-                # actions at this point, it is because we need to retry after a transaction
-                # was rolled back.
+                # Block until we have at least one write action.
                 try:
                     write_entry: WriteEntryType = self._writer_queue.get(timeout=0.1)
                 except queue.Empty:
                     if self._exit_when_empty:
                         return
                     continue
-                write_entries = [ write_entry ]
-
-            # Gather the rest of the batch for this transaction.
-            while len(write_entries) < maximum_batch_size and not self._writer_queue.empty():
-                write_entries.append(self._writer_queue.get_nowait())
+                write_entries = self._gather_batch(write_entry)
+                self._notify_room()
 
             # Using the connection as a context manager, apply the batch as a transaction.
             time_start = time.time()
@@ -145,36 +238,73 @@ class SqliteWriteDispatcher:
                 with self._db:
                     # We have to force a grouped statement transaction with the explicit 'begin'.
                     self._db.execute('begin')
-                    for write_callback, completion_callback, entry_size_hint in write_entries:
-                        write_callback(self._db)
-                        if completion_callback is not None:
-                            completion_callbacks.append((completion_callback, None))
-                        total_size_hint += entry_size_hint
+                    for write_entry in write_entries:
+                        write_entry.write_callback(self._db)
+                        if write_entry.completion_callback is not None:
+                            completion_callbacks.append((write_entry.completion_callback, None))
+                        total_size_hint += write_entry.size_hint
                 # The transaction was successfully committed.
             except Exception as e:
                 # Exception: This is caught because we need to relay any exception to the
                 # calling context's completion notification callback.
-                self._logger.exception("Database write failure", exc_info=e)
                 # The transaction was rolled back.
                 if len(write_entries) > 1:
-                    self._logger.debug("Retrying with batch size of 1")
-                    # We're going to try and reapply the write actions one by one.
-                    maximum_batch_size = 1
-                    write_entry_backlog = write_entries
+                    # Retry each half of the batch separately. The half without the failing write
+                    # will commit as a batch, and the other will be bisected further. The error
+                    # is logged in full once the failing write is isolated.
+                    middle_index = len(write_entries) // 2
+                    self._logger.debug("Database write failure (%r), retrying as batches of "
+                        "%d and %d", e, middle_index, len(write_entries) - middle_index)
+                    bisected_batches[0:0] = [ write_entries[:middle_index],
+                        write_entries[middle_index:] ]
                     continue
-                # We applied the batch actions one by one. If there was an error with this action
-                # then we've logged it, so we can discard it for lack of any other option.
-                if write_entries[0][1] is not None:
-                    completion_callbacks.append((write_entries[0][1], e))
+                # The failing write action has been isolated. We log the error, and discard it
+                # for lack of any other option.
+                self._logger.exception("Database write failure", exc_info=e)
+                if write_entries[0].completion_callback is not None:
+                    completion_callbacks.append((write_entries[0].completion_callback, e))
+                self._resolve_future(write_entries[0].future, e)
+                self._stats.record_failed_write()
             else:
+                for write_entry in write_entries:
+                    self._resolve_future(write_entry.future, None)
                 if len(write_entries):
                     time_ms = int((time.time() - time_start) * 1000)
+                    self._stats.record_batch(write_entries, time_ms)
                     self._logger.debug("Invoked %d write callbacks (hinted at %d bytes) in %d ms",
                         len(write_entries), total_size_hint, time_ms)
 
             for dispatchable_callback in completion_callbacks:
                 self._callback_thread_pool.submit(self._dispatch_callback, *dispatchable_callback)
 
+    def _gather_batch(self, write_entry: WriteEntryType) -> List[WriteEntryType]:
+        """
+        Extend the batch starting with the given entry with whatever other writes are already
+        queued. The more writes that are waiting, the larger the batch and the fewer commits,
+        up to the point where the batch reaches either the targeted number of bytes written
+        (as hinted by the writers) or the maximum number of entries.
+        """
+        write_entries = [ write_entry ]
+        total_size_hint = write_entry.size_hint
+        while len(write_entries) < self.MAXIMUM_BATCH_ENTRIES and \
+                total_size_hint < self.TARGET_BATCH_BYTES:
+            try:
+                write_entry = self._writer_queue.get_nowait()
+            except queue.Empty:
+                break
+            write_entries.append(write_entry)
+            total_size_hint += write_entry.size_hint
+        return write_entries
+
+    def _resolve_future(self, future: Optional[WriteFutureType],
+            exc_value: Optional[Exception]) -> None:
+        if future is None:
+            return
+        if exc_value is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exc_value)
+
     def _dispatch_callback(self, callback: CompletionCallbackType,
             exc_value: Optional[Exception]) -> None:
         try:
@@ -183,20 +313,94 @@ class SqliteWriteDispatcher:
             traceback.print_exc()
             self._logger.exception("Exception within completion callback", exc_info=e)
 
+    def _start_future(self, future: Optional[WriteFutureType]) -> None:
+        # The future is shared by everything that observes the write, and the write will be
+        # applied regardless. Running futures cannot be cancelled, so a cancelled awaiting
+        # coroutine cannot make it look like the write was cancelled to the other observers.
+        if future is not None:
+            future.set_running_or_notify_cancel()
+
     def put(self, write_entry: WriteEntryType) -> None:
         # If the writer is closed, then it is expected the caller should have made sure that
         # no more puts will be made, and the error will only be raised if something puts to
         # flag that it is wrong.
-        if not self._allow_puts:
-            raise WriteDisabledError()
+        self._enqueue(write_entry)
+
+        if self._maximum_queue_size > 0 and not self._is_event_loop_thread():
+            # Hold back the producer until the writer thread catches up.
+            with self._room_condition:
+                while self._has_no_room() and self._is_alive:
+                    self._room_condition.wait(0.1)
+
+    async def put_async(self, write_entry: WriteEntryType) -> None:
+        self._enqueue(write_entry)
+        await self.wait_for_room_async()
+
+    def _enqueue(self, write_entry: WriteEntryType) -> None:
+        # The check is made under the lock so that no write can be queued after `stop` has
+        # disallowed them, and the writer thread may already be draining the queue to exit.
+        with self._room_condition:
+            if not self._allow_puts:
+                raise WriteDisabledError()
+            self._start_future(write_entry.future)
+            self._writer_queue.put(write_entry)
+        self._stats.record_queue_depth(self._writer_queue.qsize())
+
+    async def wait_for_room_async(self) -> None:
+        """
+        Wait until the writer thread has caught up with the queued writes, if the queue is bounded.
+        The write has already been queued, so if the waiting coroutine is cancelled the write
+        still happens.
+        """
+        loop = asyncio.get_event_loop()
+        while self._maximum_queue_size > 0 and self._has_no_room() and self._is_alive:
+            waiter = loop.create_future()
+            with self._room_condition:
+                self._async_room_waiters.append((loop, waiter))
+            try:
+                # The writer thread may have made room before the waiter was registered.
+                if self._has_no_room():
+                    await waiter
+            finally:
+                with self._room_condition:
+                    self._async_room_waiters.remove((loop, waiter))
 
-        self._writer_queue.put_nowait(write_entry)
+    def _has_no_room(self) -> bool:
+        return self._writer_queue.qsize() > self._maximum_queue_size
+
+    def _is_event_loop_thread(self) -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    def _notify_room(self) -> None:
+        # This is called on the writer thread, after it takes writes off the queue.
+        if self._maximum_queue_size == 0:
+            return
+        with self._room_condition:
+            self._room_condition.notify_all()
+            for loop, waiter in self._async_room_waiters:
+                loop.call_soon_threadsafe(self._wake_waiter, waiter)
+
+    @staticmethod
+    def _wake_waiter(waiter: asyncio.Future) -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self._stats.to_dict()
+        stats["queue_depth"] = self._writer_queue.qsize()
+        stats["maximum_queue_size"] = self._maximum_queue_size
+        return stats
 
     def stop(self) -> None:
         if self._exit_when_empty:
             return
 
-        self._allow_puts = False
+        with self._room_condition:
+            self._allow_puts = False
         self._exit_when_empty = True
 
         # Wait for both threads to exit.
@@ -205,11 +409,63 @@ class SqliteWriteDispatcher:
         self._db_context.release_connection(self._db)
         self._callback_thread_pool.shutdown(wait=True)
         self._is_alive = False
+        # Nothing is left queued, but any held back producers need to know.
+        self._notify_room()
 
     def is_stopped(self) -> bool:
         return not self._is_alive
 
 
+# The accepted values for the pragmas that take names.
+TEMP_STORE_VALUES = { "DEFAULT", "FILE", "MEMORY" }
+SYNCHRONOUS_VALUES = { "OFF", "NORMAL", "FULL", "EXTRA" }
+
+
+class SqliteConnectionProfile(NamedTuple):
+    """
+    The performance related settings applied to every connection. Each can be overridden in the
+    application config with the field name prefixed by `sqlite_`, e.g. `sqlite_mmap_size`.
+    """
+    # The number of bytes of the database file that are memory mapped for reads, 0 disables it.
+    mmap_size: int = 256 * 1024 * 1024
+    # The maximum size of the page cache for each connection.
+    cache_size_kib: int = 16 * 1024
+    temp_store: str = "MEMORY"
+    # This only applies when the WAL journal mode is used, where it is safe from corruption and
+    # only the most recent commits can be lost on power failure.
+    synchronous: str = "NORMAL"
+    # The number of prepared statements cached by the Python sqlite3 module for each connection.
+    statement_cache_size: int = 256
+
+    @classmethod
+    def from_config(cls, config: "SimpleConfig") -> "SqliteConnectionProfile":
+        defaults = cls()
+        temp_store = str(config.get("sqlite_temp_store", defaults.temp_store)).upper()
+        if temp_store not in TEMP_STORE_VALUES:
+            logger.error("Ignoring invalid 'sqlite_temp_store' value %r", temp_store)
+            temp_store = defaults.temp_store
+        synchronous = str(config.get("sqlite_synchronous", defaults.synchronous)).upper()
+        if synchronous not in SYNCHRONOUS_VALUES:
+            logger.error("Ignoring invalid 'sqlite_synchronous' value %r", synchronous)
+            synchronous = defaults.synchronous
+        return cls(
+            mmap_size=max(0, int(config.get("sqlite_mmap_size", defaults.mmap_size))),
+            cache_size_kib=max(0, int(config.get("sqlite_cache_size_kib",
+                defaults.cache_size_kib))),
+            temp_store=temp_store,
+            synchronous=synchronous,
+            statement_cache_size=max(0, int(config.get("sqlite_statement_cache_size",
+                defaults.statement_cache_size))))
+
+
+class _ReadConnectionHolder:
+    # A thread's read connection is released when the thread exits and this is garbage collected.
+    __slots__ = ("connection", "__weakref__")
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+
+
 class JournalModes(Enum):
     DELETE = "DELETE"
     TRUNCATE = "TRUNCATE"
@@ -224,18 +480,31 @@ class DatabaseContext:
     JOURNAL_MODE = JournalModes.WAL
 
     SQLITE_CONN_POOL_SIZE = 0
+    # The number of writes that can be queued before producers are held back, 0 is unlimited.
+    WRITE_QUEUE_SIZE = 0
+    CONNECTION_PROFILE = SqliteConnectionProfile()
 
-    def __init__(self, wallet_path: str) -> None:
+    def __init__(self, wallet_path: str, write_queue_size: Optional[int]=None,
+            profile: Optional[SqliteConnectionProfile]=None) -> None:
         if not self.is_special_path(wallet_path) and not wallet_path.endswith(DATABASE_EXT):
             wallet_path += DATABASE_EXT
         self._db_path = wallet_path
+        self._profile = profile if profile is not None else self.CONNECTION_PROFILE
         self._connection_pool: queue.Queue = queue.Queue()
         self._active_connections: Set = set()
+        # Each thread that reads from the database has it's own connection for the duration of the
+        # thread. These come from a separate pool and are returned to it when the thread exits.
+        self._read_connection_pool: queue.Queue = queue.Queue()
+        self._read_connection_local = threading.local()
+        self._read_connections: Set[sqlite3.Connection] = set()
+        self._open_store_count = 0
         # self._debug_texts = {}
 
         self._logger = logs.get_logger("sqlite-context")
         self._lock = threading.Lock()
-        self._write_dispatcher = SqliteWriteDispatcher(self)
+        if write_queue_size is None:
+            write_queue_size = self.WRITE_QUEUE_SIZE
+        self._write_dispatcher = SqliteWriteDispatcher(self, write_queue_size)
 
     def acquire_connection(self) -> sqlite3.Connection:
         try:
@@ -257,17 +526,66 @@ class DatabaseContext:
         self.SQLITE_CONN_POOL_SIZE += 1
 
         # debug_text = traceback.format_stack()
+        connection = self._create_connection()
+        # self._debug_texts[connection] = debug_text
+        self._connection_pool.put(connection)
+
+    def get_read_connection(self) -> sqlite3.Connection:
+        """
+        Get the connection the calling thread uses for reads, acquiring it if necessary. It is
+        kept for the lifetime of the thread, and shared by all the stores used in that thread.
+        """
+        holder = getattr(self._read_connection_local, "holder", None)
+        if holder is None:
+            try:
+                connection = self._read_connection_pool.get_nowait()
+            except queue.Empty:
+                connection = self._create_connection()
+                with self._lock:
+                    self._read_connections.add(connection)
+            holder = _ReadConnectionHolder(connection)
+            weakref.finalize(holder, self._release_read_connection, connection)
+            self._read_connection_local.holder = holder
+        return holder.connection
+
+    def _release_read_connection(self, connection: sqlite3.Connection) -> None:
+        # This is called when the thread that had the connection exits. If the context has been
+        # closed in the meantime, the connection will have been closed with it.
+        with self._lock:
+            if connection in self._read_connections:
+                self._read_connection_pool.put(connection)
+
+    def get_read_connection_count(self) -> int:
+        with self._lock:
+            return len(self._read_connections)
+
+    def open_store(self) -> None:
+        with self._lock:
+            self._open_store_count += 1
+
+    def close_store(self) -> None:
+        with self._lock:
+            assert self._open_store_count > 0, "store closed twice"
+            self._open_store_count -= 1
+
+    def _create_connection(self) -> sqlite3.Connection:
+        profile = self._profile
         connection = sqlite3.connect(self._db_path, check_same_thread=False,
-            isolation_level=None)
+            isolation_level=None, cached_statements=profile.statement_cache_size)
         connection.execute("PRAGMA busy_timeout=5000;")
         connection.execute("PRAGMA foreign_keys=ON;")
         # We do not enable journaling for in-memory databases. It resulted in 'database is locked'
         # errors. Perhaps it works now with the locking and backoff retries.
         if not self.is_special_path(self._db_path):
             self._ensure_journal_mode(connection)
-
-        # self._debug_texts[connection] = debug_text
-        self._connection_pool.put(connection)
+            if self.JOURNAL_MODE == JournalModes.WAL:
+                connection.execute(f"PRAGMA synchronous={profile.synchronous};")
+        # These are applied after the journal mode, as some open the database file and any open
+        # connection prevents other connections from switching away from the WAL journal mode.
+        connection.execute(f"PRAGMA mmap_size={profile.mmap_size};")
+        connection.execute(f"PRAGMA cache_size={-profile.cache_size_kib};")
+        connection.execute(f"PRAGMA temp_store={profile.temp_store};")
+        return connection
 
     def decrease_connection_pool(self) -> None:
         """release 1 more connection from the pool - raises empty queue error"""
@@ -317,9 +635,36 @@ class DatabaseContext:
 
     def queue_write(self, write_callback: WriteCallbackType,
             completion_callback: Optional[CompletionCallbackType]=None,
-            size_hint: int=0) -> None:
+            size_hint: int=0, table_name: str="unknown") -> WriteFutureType:
+        """
+        Queue a write to be applied in a batch on the writer thread.
+
+        The returned future is resolved when the write is committed, or with the exception if it
+        failed. If the write queue is full this blocks until there is room, except on an event
+        loop thread where the caller should await the future or `wait_for_write_room_async`.
+        """
+        future: WriteFutureType = concurrent.futures.Future()
         self._write_dispatcher.put(WriteEntryType(write_callback, completion_callback,
-            size_hint))
+            size_hint, future, table_name))
+        return future
+
+    async def queue_write_async(self, write_callback: WriteCallbackType,
+            completion_callback: Optional[CompletionCallbackType]=None,
+            size_hint: int=0, table_name: str="unknown") -> None:
+        """
+        Queue a write and wait until it has been committed, raising the exception if it failed.
+        If the write queue is full, this also waits until there is room.
+        """
+        future: WriteFutureType = concurrent.futures.Future()
+        await self._write_dispatcher.put_async(WriteEntryType(write_callback, completion_callback,
+            size_hint, future, table_name))
+        await asyncio.wrap_future(future)
+
+    async def wait_for_write_room_async(self) -> None:
+        await self._write_dispatcher.wait_for_room_async()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self._write_dispatcher.get_stats()
 
     def close(self) -> None:
         self._write_dispatcher.stop()
@@ -332,13 +677,23 @@ class DatabaseContext:
         for conn in range(self.SQLITE_CONN_POOL_SIZE):
             self.decrease_connection_pool()
 
-        if len(outstanding_connections) != 0:
+        with self._lock:
+            read_connections = self._read_connections
+            self._read_connections = set()
+            open_store_count = self._open_store_count
+        for connection in read_connections:
+            connection.close()
+        while self._read_connection_pool.qsize():
+            self._read_connection_pool.get_nowait()
+
+        if len(outstanding_connections) != 0 or open_store_count != 0:
             raise LeakedSQLiteConnectionError("There were still outstanding SQLite connections "
                 "when attempting to close DatabaseContext! Force closed all connections.")
         assert self.is_closed(), f"{self._write_dispatcher.is_stopped()}"
 
     def is_closed(self) -> bool:
-        return self._connection_pool.qsize() == 0 and self._write_dispatcher.is_stopped()
+        return self._connection_pool.qsize() == 0 and self._write_dispatcher.is_stopped() and \
+            len(self._read_connections) == 0
 
     def is_special_path(self, path: str) -> bool:
         # Each connection has a private database.
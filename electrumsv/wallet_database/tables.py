@@ -9,14 +9,16 @@ except ModuleNotFoundError:
     import sqlite3 # type: ignore
 import time
 from typing import Any, Dict, Iterable, NamedTuple, Optional, List, Sequence, Tuple, Type, TypeVar
+import zlib
 
 import bitcoinx
 from bitcoinx import hash_to_hex_str
 
-from ..constants import (TxFlags, ScriptType, DerivationType, TransactionOutputFlag,
-    KeyInstanceFlag, PaymentFlag, WalletEventFlag, WalletEventType)
+from ..constants import (TxBytesEncoding, TxFlags, ScriptType, DerivationType,
+    TransactionOutputFlag, KeyInstanceFlag, PaymentFlag, WalletEventFlag, WalletEventType)
 from ..logs import logs
-from .sqlite_support import SQLITE_MAX_VARS, DatabaseContext, CompletionCallbackType
+from .sqlite_support import (SQLITE_MAX_VARS, DatabaseContext, CompletionCallbackType,
+    WriteCallbackType, WriteFutureType)
 
 
 # TODO(rt12) The rows should be turned into NamedTuples?
@@ -90,10 +92,15 @@ class BaseWalletStore:
     def __init__(self, db_context: DatabaseContext) -> None:
         self._logger = logs.get_logger(self.LOGGER_NAME)
         self._db_context = db_context
-        self._db: sqlite3.Connection = db_context.acquire_connection()
+        self._db_context.open_store()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # Reads are done on the calling thread's connection, writes on the writer thread's.
+        return self._db_context.get_read_connection()
 
     def close(self) -> None:
-        self._db_context.release_connection(self._db)
+        self._db_context.close_store()
 
     def __enter__(self):
         return self
@@ -101,6 +108,19 @@ class BaseWalletStore:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def _queue_write(self, write_callback: WriteCallbackType,
+            completion_callback: Optional[CompletionCallbackType]=None,
+            size_hint: int=0) -> WriteFutureType:
+        # The writes are attributed to the store that made them in the write statistics.
+        return self._db_context.queue_write(write_callback, completion_callback, size_hint,
+            type(self).__name__)
+
+    async def _queue_write_async(self, write_callback: WriteCallbackType,
+            completion_callback: Optional[CompletionCallbackType]=None,
+            size_hint: int=0) -> None:
+        await self._db_context.queue_write_async(write_callback, completion_callback, size_hint,
+            type(self).__name__)
+
     def _get_column_types(self, db: sqlite3.Connection, table_name: str) -> Dict[str, Any]:
         column_types = {}
         for row in db.execute(f"PRAGMA table_info({table_name});"):
@@ -143,7 +163,7 @@ class WalletDataTable(BaseWalletStore):
             self._logger.debug("create '%s'", [t.key for t in entries])
             db.executemany(self.CREATE_SQL, datas)
 
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def get_value(self, key: str) -> Optional[Any]:
         cursor = self._db.execute(self.READ_SQL +" WHERE key=?", [key])
@@ -192,7 +212,7 @@ class WalletDataTable(BaseWalletStore):
             self._logger.debug("upsert %s", [ t.key for t in entries ])
             db.executemany(self.UPSERT_SQL, datas)
 
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update(self, entries: Iterable[WalletDataRow],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
@@ -205,7 +225,7 @@ class WalletDataTable(BaseWalletStore):
             self._logger.debug("update %s", [t.key for t in entries])
             db.executemany(self.UPDATE_SQL, datas)
 
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, key: str,
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
@@ -215,7 +235,7 @@ class WalletDataTable(BaseWalletStore):
             self._logger.debug("deleted %s", key)
             db.execute(self.DELETE_SQL, [key])
 
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class TxData(NamedTuple):
@@ -252,13 +272,17 @@ class TransactionRow(NamedTuple):
 class TransactionTable(BaseWalletStore):
     LOGGER_NAME = "db-table-tx"
 
-    CREATE_SQL = ("INSERT INTO Transactions (tx_hash, tx_data, flags, "
+    CREATE_SQL = ("INSERT INTO Transactions (tx_hash, flags, "
         "block_height, block_position, fee_value, description, date_created, date_updated) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+    CREATE_BYTES_SQL = ("INSERT INTO TransactionBytes (tx_hash, encoding, tx_data) "
+        "VALUES (?, ?, ?)")
+    READ_BYTES_SQL = "SELECT tx_hash, encoding, tx_data FROM TransactionBytes"
     READ_DESCRIPTION_SQL = ("SELECT tx_hash, description FROM Transactions T "
         "WHERE description IS NOT NULL")
-    READ_MANY_BASE_SQL = ("SELECT tx_hash, tx_data, flags, block_height, block_position, "
-        "fee_value, date_created, date_updated FROM Transactions T")
+    READ_MANY_BASE_SQL = ("SELECT tx_hash, TB.encoding, TB.tx_data, flags, block_height, "
+        "block_position, fee_value, date_created, date_updated FROM Transactions T "
+        "LEFT JOIN TransactionBytes TB USING(tx_hash)")
     READ_METADATA_BASE_SQL = ("SELECT flags, block_height, block_position, fee_value, "
         "date_created, date_updated FROM Transactions T WHERE tx_hash=?")
     READ_METADATA_MANY_BASE_SQL = ("SELECT tx_hash, flags, block_height, block_position, "
@@ -266,14 +290,18 @@ class TransactionTable(BaseWalletStore):
     READ_PROOF_SQL = "SELECT tx_hash, proof_data FROM Transactions T"
     UPDATE_DESCRIPTION_SQL = "UPDATE Transactions SET date_updated=?, description=? WHERE tx_hash=?"
     UPDATE_FLAGS_SQL = "UPDATE Transactions SET flags=((flags&?)|?),date_updated=? WHERE tx_hash=?"
-    UPDATE_MANY_SQL = ("UPDATE Transactions SET tx_data=?,flags=?,block_height=?,"
-        "block_position=?,fee_value=?,date_updated=? WHERE tx_hash=?")
+    UPSERT_BYTES_SQL = (CREATE_BYTES_SQL +" ON CONFLICT(tx_hash) DO UPDATE "
+        "SET encoding=excluded.encoding, tx_data=excluded.tx_data")
+    DELETE_BYTES_SQL = "DELETE FROM TransactionBytes WHERE tx_hash=?"
     UPDATE_METADATA_MANY_SQL = ("UPDATE Transactions SET flags=?,block_height=?,"
         "block_position=?,fee_value=?,date_updated=? WHERE tx_hash=?")
     UPDATE_PROOF_SQL = ("UPDATE Transactions SET proof_data=?,date_updated=?,flags=(flags|?) "
         "WHERE tx_hash=?")
     DELETE_SQL = "DELETE FROM Transactions WHERE tx_hash=?"
 
+    # Transaction bytes at least this large are compressed if it is worthwhile, `None` disables it.
+    COMPRESSION_MINIMUM_SIZE: Optional[int] = 1024
+
     @staticmethod
     def _apply_flags(data: TxData, flags: TxFlags) -> TxFlags:
         flags &= ~TxFlags.METADATA_FIELD_MASK
@@ -305,6 +333,24 @@ class TransactionTable(BaseWalletStore):
             return TxProof(position, merkle_branch)
         raise DataPackingError(f"Unhandled packing format {pack_version}")
 
+    def _pack_bytedata(self, bytedata: bytes) -> Tuple[TxBytesEncoding, bytes]:
+        if self.COMPRESSION_MINIMUM_SIZE is not None and \
+                len(bytedata) >= self.COMPRESSION_MINIMUM_SIZE:
+            compressed_bytedata = zlib.compress(bytedata)
+            # Signatures and hashes do not compress, so most transactions will not benefit. But
+            # data carrier payloads often do.
+            if len(compressed_bytedata) < len(bytedata) * 0.9:
+                return TxBytesEncoding.ZLIB, compressed_bytedata
+        return TxBytesEncoding.RAW, bytedata
+
+    @staticmethod
+    def _unpack_bytedata(encoding: int, data: bytes) -> bytes:
+        if encoding == TxBytesEncoding.RAW:
+            return data
+        if encoding == TxBytesEncoding.ZLIB:
+            return zlib.decompress(data)
+        raise DataPackingError(f"Unhandled transaction encoding {encoding}")
+
     def _get_many_common(self, query: str, flags: Optional[int]=None, mask: Optional[int]=None,
             tx_hashes: Optional[Sequence[bytes]]=None, account_id: Optional[int]=None) -> List[Any]:
         params = []
@@ -345,32 +391,54 @@ class TransactionTable(BaseWalletStore):
         return results
 
     def create(self, entries: List[TransactionRow], completion_callback: Optional[
-            CompletionCallbackType]=None) -> None:
+            CompletionCallbackType]=None) -> WriteFutureType:
+        write_callback, size_hint = self._get_create_write(entries)
+        return self._queue_write(write_callback, completion_callback, size_hint)
+
+    async def create_async(self, entries: List[TransactionRow]) -> None:
+        write_callback, size_hint = self._get_create_write(entries)
+        await self._queue_write_async(write_callback, size_hint=size_hint)
+
+    def _get_create_write(self, entries: List[TransactionRow]) -> Tuple[WriteCallbackType, int]:
         datas = []
+        bytedata_rows = []
         size_hint = 0
         for tx_hash, metadata, bytedata, flags, description in entries:
             assert type(tx_hash) is bytes
             flags &= ~TxFlags.HasByteData
             if bytedata is not None:
                 flags |= TxFlags.HasByteData
-                size_hint += len(bytedata)
+                encoding, packed_bytedata = self._pack_bytedata(bytedata)
+                bytedata_rows.append((tx_hash, encoding, packed_bytedata))
+                size_hint += len(packed_bytedata)
             flags = self._apply_flags(metadata, flags)
             assert metadata.date_added is not None and metadata.date_updated is not None
-            datas.append((tx_hash, bytedata, flags, metadata.height, metadata.position,
+            datas.append((tx_hash, flags, metadata.height, metadata.position,
                 metadata.fee, description, metadata.date_added, metadata.date_updated))
 
         def _write(db: sqlite3.Connection) -> None:
             self._logger.debug("add %d transactions", len(datas))
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback, size_hint)
+            if len(bytedata_rows):
+                db.executemany(self.CREATE_BYTES_SQL, bytedata_rows)
+        return _write, size_hint
 
     def read(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None,
             tx_hashes: Optional[Sequence[bytes]]=None, account_id: Optional[int]=None) \
             -> List[Tuple[bytes, Optional[bytes], TxFlags, TxData]]:
         query = self.READ_MANY_BASE_SQL
-        return [ (row[0], row[1], TxFlags(row[2]), TxData(row[3], row[4], row[5], row[6], row[7]))
+        return [ (row[0], self._unpack_bytedata(row[1], row[2]) if row[2] is not None else None,
+            TxFlags(row[3]), TxData(row[4], row[5], row[6], row[7], row[8]))
             for row in self._get_many_common(query, flags, mask, tx_hashes, account_id) ]
 
+    def read_bytedata(self, tx_hashes: Sequence[bytes]) -> List[Tuple[bytes, bytes]]:
+        """
+        Read only the bytes for the given transactions, for callers that already have the
+        metadata. Transactions without bytes are omitted.
+        """
+        return [ (row[0], self._unpack_bytedata(row[1], row[2]))
+            for row in self._get_many_common(self.READ_BYTES_SQL, tx_hashes=tx_hashes) ]
+
     def read_metadata(self, flags: Optional[TxFlags]=None, mask: Optional[TxFlags]=None,
             tx_hashes: Optional[Sequence[bytes]]=None, account_id: Optional[int]=None) \
                 -> List[Tuple[bytes, TxFlags, TxData]]:
@@ -392,9 +460,20 @@ class TransactionTable(BaseWalletStore):
             for row in self._get_many_common(query, None, None, tx_hashes) ]
 
     def update(self, entries: List[Tuple[bytes, TxData, Optional[bytes], TxFlags]],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
-        data_rows = []
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
+        write_callback, size_hint = self._get_update_write(entries)
+        return self._queue_write(write_callback, completion_callback, size_hint)
+
+    async def update_async(self, entries: List[Tuple[bytes, TxData, Optional[bytes], TxFlags]]) \
+            -> None:
+        write_callback, size_hint = self._get_update_write(entries)
+        await self._queue_write_async(write_callback, size_hint=size_hint)
+
+    def _get_update_write(self, entries: List[Tuple[bytes, TxData, Optional[bytes], TxFlags]]) \
+            -> Tuple[WriteCallbackType, int]:
         metadata_rows = []
+        bytedata_rows = []
+        bytedata_deletes = []
         size_hint = 0
         for tx_hash, metadata, bytedata, flags in entries:
             assert type(tx_hash) is bytes
@@ -405,16 +484,16 @@ class TransactionTable(BaseWalletStore):
                 # changing, but we don't want to still have to  pass it into the update call to
                 # avoid changing it.
                 assert flags & TxFlags.HasByteData != 0, f"{hash_to_hex_str(tx_hash)} flag wrong"
-                metadata_rows.append((flags, metadata.height, metadata.position,
-                    metadata.fee, metadata.date_updated, tx_hash))
+            elif bytedata is None:
+                assert flags & TxFlags.HasByteData == 0, f"{hash_to_hex_str(tx_hash)} no flag"
+                bytedata_deletes.append((tx_hash,))
             else:
-                if bytedata is None:
-                    assert flags & TxFlags.HasByteData == 0, f"{hash_to_hex_str(tx_hash)} no flag"
-                else:
-                    assert flags & TxFlags.HasByteData != 0, f"{hash_to_hex_str(tx_hash)} flag"
-                    size_hint += len(bytedata)
-                data_rows.append((bytedata, flags, metadata.height, metadata.position,
-                    metadata.fee, metadata.date_updated, tx_hash))
+                assert flags & TxFlags.HasByteData != 0, f"{hash_to_hex_str(tx_hash)} flag"
+                encoding, packed_bytedata = self._pack_bytedata(bytedata)
+                bytedata_rows.append((tx_hash, encoding, packed_bytedata))
+                size_hint += len(packed_bytedata)
+            metadata_rows.append((flags, metadata.height, metadata.position,
+                metadata.fee, metadata.date_updated, tx_hash))
 
         def _write(db: sqlite3.Connection) -> None:
             if len(entries) < 20:
@@ -423,15 +502,15 @@ class TransactionTable(BaseWalletStore):
                     in entries ])
             else:
                 self._logger.debug("update %d transactions (too many to show)", len(entries))
-            if len(data_rows):
-                db.executemany(self.UPDATE_MANY_SQL, data_rows)
-            if len(metadata_rows):
-                db.executemany(self.UPDATE_METADATA_MANY_SQL, metadata_rows)
-
-        self._db_context.queue_write(_write, completion_callback, size_hint)
+            db.executemany(self.UPDATE_METADATA_MANY_SQL, metadata_rows)
+            if len(bytedata_rows):
+                db.executemany(self.UPSERT_BYTES_SQL, bytedata_rows)
+            if len(bytedata_deletes):
+                db.executemany(self.DELETE_BYTES_SQL, bytedata_deletes)
+        return _write, size_hint
 
     def update_metadata(self, entries: List[Tuple[bytes, TxData, TxFlags]],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
         datas = []
         for tx_hash, metadata, flags in entries:
             assert type(tx_hash) is bytes
@@ -441,18 +520,18 @@ class TransactionTable(BaseWalletStore):
             self._logger.debug("update %d tx metadatas: %s", len(entries),
                 [ (hash_to_hex_str(a), b, TxFlags.to_repr(c)) for (a, b, c) in entries ])
             db.executemany(self.UPDATE_METADATA_MANY_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        return self._queue_write(_write, completion_callback)
 
     def update_flags(self, entries: Iterable[Tuple[bytes, TxFlags, TxFlags, int]],
             # tx_hash: bytes, flags: int, mask: int, date_updated: int,
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
         datas = [ (mask, flags, date_updated, tx_hash)
             for (tx_hash, flags, mask, date_updated) in entries ]
         def _write(db: sqlite3.Connection) -> None:
             log_entries = [ (*entry[:3], hash_to_hex_str(entry[3])) for entry in datas ]
             self._logger.debug("update_flags %r", log_entries)
             db.executemany(self.UPDATE_FLAGS_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        return self._queue_write(_write, completion_callback)
 
     def update_descriptions(self, entries: Iterable[Tuple[str, bytes]],
             date_updated: Optional[int]=None,
@@ -463,10 +542,10 @@ class TransactionTable(BaseWalletStore):
         def _write(db: sqlite3.Connection) -> None:
             self._logger.debug("updating %d transaction descriptions", len(datas))
             db.executemany(self.UPDATE_DESCRIPTION_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_proof(self, entries: Iterable[Tuple[bytes, TxProof, int]],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
         datas = [ (self._pack_proof(proof), date_updated, TxFlags.HasProofData, tx_hash)
             for (tx_hash, proof, date_updated) in entries ]
         size_hint = sum(len(t[0]) for t in datas)
@@ -474,17 +553,17 @@ class TransactionTable(BaseWalletStore):
             tx_ids = [ hash_to_hex_str(entry[0]) for entry in entries ]
             self._logger.debug("updating %d transaction proof '%s'", 1, tx_ids)
             db.executemany(self.UPDATE_PROOF_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback, size_hint)
+        return self._queue_write(_write, completion_callback, size_hint)
 
     def delete(self, tx_hashes: Sequence[bytes],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
         datas = [(tx_hash,) for tx_hash in tx_hashes]
         def _write(db: sqlite3.Connection):
             self._logger.debug("deleting transactions %s", [hash_to_hex_str(b[0]) for b in datas])
             db.executemany(TransactionDeltaTable.DELETE_TRANSACTION_SQL, datas)
             db.executemany(TransactionOutputTable.DELETE_TRANSACTION_SQL, datas)
             db.executemany(self.DELETE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        return self._queue_write(_write, completion_callback)
 
 
 class MasterKeyRow(NamedTuple):
@@ -511,7 +590,7 @@ class MasterKeyTable(BaseWalletStore):
         size_hint = sum(len(t[3]) for t in entries)
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback, size_hint)
+        self._queue_write(_write, completion_callback, size_hint)
 
     def read(self) -> List[MasterKeyRow]:
         cursor = self._db.execute(self.READ_SQL)
@@ -531,14 +610,14 @@ class MasterKeyTable(BaseWalletStore):
             size_hint += len(t[0])
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback, size_hint)
+        self._queue_write(_write, completion_callback, size_hint)
 
     def delete(self, key_ids: Iterable[int],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         manyparams = [ (key_id,) for key_id in key_ids ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, manyparams)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class AccountRow(NamedTuple):
@@ -569,7 +648,7 @@ class AccountTable(BaseWalletStore):
         datas = [ (*t, timestamp, timestamp) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def read(self) -> List[AccountRow]:
         cursor = self._db.execute(self.READ_SQL)
@@ -586,7 +665,7 @@ class AccountTable(BaseWalletStore):
             datas.append((date_updated, masterkey_id, script_type, account_id))
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_MASTERKEY_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_name(self, entries: Iterable[Tuple[int, str]],
             date_updated: Optional[int]=None,
@@ -597,7 +676,7 @@ class AccountTable(BaseWalletStore):
             datas.append((date_updated, account_name, account_id))
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_NAME_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_script_type(self, entries: Iterable[Tuple[ScriptType, int]],
             date_updated: Optional[int]=None,
@@ -608,14 +687,14 @@ class AccountTable(BaseWalletStore):
             datas.append((date_updated, *entry))
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_SCRIPT_TYPE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, account_ids: Iterable[int],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         manyparams = [ (account_id,) for account_id in account_ids ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, manyparams)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class KeyInstanceRow(NamedTuple):
@@ -656,7 +735,7 @@ class KeyInstanceTable(BaseWalletStore):
         size_hint = sum(len(t[4]) for t in entries)
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback, size_hint)
+        self._queue_write(_write, completion_callback, size_hint)
 
     # We cannot take Sequence in place of List, because Sequences are not addable.
     def read(self, mask: Optional[KeyInstanceFlag]=None, key_ids: Optional[List[int]]=None) \
@@ -696,10 +775,10 @@ class KeyInstanceTable(BaseWalletStore):
         if date_updated is None:
             date_updated = self._get_current_timestamp()
         datas = [(date_updated,) + entry for entry in entries]
-        size_hint = sum(len(entry[0]) for entry in entries)
+        size_hint = sum(len(data[1]) for data in datas)
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_DERIVATION_DATA_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback, size_hint)
 
     def update_descriptions(self, entries: Iterable[Tuple[str, int]],
             date_updated: Optional[int]=None,
@@ -709,7 +788,7 @@ class KeyInstanceTable(BaseWalletStore):
         datas = [(date_updated,) + entry for entry in entries]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_DESCRIPTION_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_flags(self, entries: Iterable[Tuple[KeyInstanceFlag, int]],
             date_updated: Optional[int]=None,
@@ -719,7 +798,7 @@ class KeyInstanceTable(BaseWalletStore):
         datas = [(date_updated,) + entry for entry in entries]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_FLAGS_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_script_types(self, entries: Iterable[Tuple[ScriptType, int]],
             date_updated: Optional[int]=None,
@@ -729,14 +808,14 @@ class KeyInstanceTable(BaseWalletStore):
         datas = [(date_updated,) + entry for entry in entries]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_SCRIPT_TYPE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, key_ids: Iterable[int],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         datas = [ (key_id,) for key_id in key_ids ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class TransactionOutputRow(NamedTuple):
@@ -764,7 +843,7 @@ class TransactionOutputTable(BaseWalletStore):
         datas = [ (*t, timestamp, timestamp) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     # We cannot take Sequence in place of List, because Sequences are not addable.
     def read(self, mask: Optional[TransactionOutputFlag]=None,
@@ -805,13 +884,13 @@ class TransactionOutputTable(BaseWalletStore):
         datas = [(date_updated,) + entry for entry in entries]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_FLAGS_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, entries: Iterable[Tuple[bytes, int]],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, entries)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class TransactionDeltaSumRow(NamedTuple):
@@ -916,6 +995,16 @@ class TransactionDeltaTable(BaseWalletStore):
         "INNER JOIN KeyInstances AS KI ON TD.keyinstance_id = KI.keyinstance_id AND "
             "KI.account_id = ?"
         "GROUP BY TD.tx_hash, TD.keyinstance_id")
+    READ_KEY_HISTORY_DOMAIN_SQL = ("SELECT TD.tx_hash, TD.keyinstance_id "
+        "FROM TransactionDeltas AS TD "
+        "INNER JOIN KeyInstances AS KI ON TD.keyinstance_id = KI.keyinstance_id AND "
+            "KI.account_id = ? "
+        "WHERE TD.keyinstance_id IN ({})")
+    READ_TRANSACTION_KEYS_SQL = ("SELECT TD.keyinstance_id "
+        "FROM TransactionDeltas AS TD "
+        "INNER JOIN KeyInstances AS KI ON TD.keyinstance_id = KI.keyinstance_id AND "
+            "KI.account_id = ? "
+        "WHERE TD.tx_hash = ?")
     READ_CANDIDATE_USED_KEYS = (f"""
         WITH active_keys AS (
                 SELECT keyinstance_id
@@ -999,7 +1088,7 @@ class TransactionDeltaTable(BaseWalletStore):
                     self.DEACTIVATE_KEYINSTANCE_FLAGS.format(",".join("?" for k in batch_keys)))
                 db.execute(batch_query, params + batch_keys) # type: ignore
                 keys = keys[batch_size:]
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
         return key_ids
 
@@ -1009,17 +1098,27 @@ class TransactionDeltaTable(BaseWalletStore):
         datas = [ (*t, timestamp, timestamp) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def create_or_update_relative_values(self, entries: Iterable[TransactionDeltaRow],
-            completion_callback: Optional[CompletionCallbackType]=None) -> None:
+            completion_callback: Optional[CompletionCallbackType]=None) -> WriteFutureType:
+        return self._queue_write(
+            self._get_create_or_update_relative_values_write(entries), completion_callback)
+
+    async def create_or_update_relative_values_async(self,
+            entries: Iterable[TransactionDeltaRow]) -> None:
+        await self._queue_write_async(
+            self._get_create_or_update_relative_values_write(entries))
+
+    def _get_create_or_update_relative_values_write(self,
+            entries: Iterable[TransactionDeltaRow]) -> WriteCallbackType:
         timestamp = self._get_current_timestamp()
         update_datas = [ (timestamp, r.value_delta, r.tx_hash, r.keyinstance_id) for r in entries ]
         insert_datas = [ (*t, timestamp, timestamp) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_RELATIVE_SQL, update_datas)
             db.executemany(self.CREATE_OR_IGNORE_SQL, insert_datas)
-        self._db_context.queue_write(_write, completion_callback)
+        return _write
 
     def read(self) -> List[TransactionDeltaRow]:
         cursor = self._db.execute(self.READ_ALL_SQL)
@@ -1027,12 +1126,21 @@ class TransactionDeltaTable(BaseWalletStore):
         cursor.close()
         return [ TransactionDeltaRow(*t) for t in rows ]
 
-    def read_key_history(self, account_id: int) -> List[TransactionKeyHistoryRow]:
+    def read_key_history(self, account_id: int,
+            keyinstance_ids: Optional[Sequence[int]]=None) -> List[TransactionKeyHistoryRow]:
+        if keyinstance_ids is not None:
+            return read_rows_by_id(TransactionKeyHistoryRow, self._db,
+                self.READ_KEY_HISTORY_DOMAIN_SQL, [ account_id ], keyinstance_ids)
+
         results: List[TransactionKeyHistoryRow] = []
         for row in self._get_many_common(self.READ_KEY_HISTORY_SQL, [ account_id ]):
             results.append(TransactionKeyHistoryRow(*row))
         return results
 
+    def read_transaction_keys(self, account_id: int, tx_hash: bytes) -> List[int]:
+        return [ t[0] for t in self._get_many_common(self.READ_TRANSACTION_KEYS_SQL,
+            [ account_id, tx_hash ]) ]
+
     def read_key_summary(self, account_id: int,
             keyinstance_ids: Optional[Sequence[int]]=None) -> List[TransactionDeltaKeySummaryRow]:
         params = [ account_id ]
@@ -1101,7 +1209,7 @@ class TransactionDeltaTable(BaseWalletStore):
         datas = [ (date_updated,) + entry for entry in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, entries: Iterable[Tuple[bytes, int]],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
@@ -1110,7 +1218,7 @@ class TransactionDeltaTable(BaseWalletStore):
             datas.append((key_id, tx_hash))
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class PaymentRequestRow(NamedTuple):
@@ -1145,7 +1253,7 @@ class PaymentRequestTable(BaseWalletStore):
         datas = [ (*t, t[-1]) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def read_one(self, request_id: Optional[int]=None, keyinstance_id: Optional[int]=None) \
             -> Optional[PaymentRequestRow]:
@@ -1194,7 +1302,7 @@ class PaymentRequestTable(BaseWalletStore):
         datas = [ (date_updated, *entry) for entry in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_state(self,
             entries: Iterable[Tuple[Optional[PaymentFlag], int]],
@@ -1205,13 +1313,13 @@ class PaymentRequestTable(BaseWalletStore):
         datas = [ (date_updated, *entry) for entry in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_STATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, entries: Iterable[Tuple[int]],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, entries)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class InvoiceRow(NamedTuple):
@@ -1268,7 +1376,7 @@ class InvoiceTable(BaseWalletStore):
         datas = [ (*t[1:], t[-1]) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def _read_one(self, query: str, params: List[Any]) -> Optional[InvoiceRow]:
         cursor = self._db.execute(query, params)
@@ -1327,7 +1435,7 @@ class InvoiceTable(BaseWalletStore):
         def _write(db: sqlite3.Connection) -> None:
             nonlocal payment_datas
             db.executemany(self.CLEAR_TRANSACTION_SQL, payment_datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_transaction(self, entries: Iterable[Tuple[Optional[bytes], int]],
             date_updated: Optional[int]=None,
@@ -1338,7 +1446,7 @@ class InvoiceTable(BaseWalletStore):
         def _write(db: sqlite3.Connection) -> None:
             nonlocal payment_datas
             db.executemany(self.UPDATE_TRANSACTION_SQL, payment_datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_description(self, entries: Iterable[Tuple[Optional[str], int]],
             date_updated: Optional[int]=None,
@@ -1348,7 +1456,7 @@ class InvoiceTable(BaseWalletStore):
         datas = [ (date_updated, *entry) for entry in entries ]
         def _write(db: sqlite3.Connection) -> None:
             db.executemany(self.UPDATE_DESCRIPTION_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def update_flags(self, entries: Iterable[Tuple[PaymentFlag, PaymentFlag, int]],
             date_updated: Optional[int]=None,
@@ -1358,13 +1466,13 @@ class InvoiceTable(BaseWalletStore):
         datas = [ (date_updated, *entry) for entry in entries ]
         def _write(db: sqlite3.Connection) -> None:
             db.executemany(self.UPDATE_FLAGS_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, entries: Iterable[Tuple[int]],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         def _write(db: sqlite3.Connection) -> None:
             db.executemany(self.DELETE_SQL, entries)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
 
 class WalletEventRow(NamedTuple):
@@ -1401,7 +1509,7 @@ class WalletEventTable(BaseWalletStore):
         datas = [ (*t, t[-1]) for t in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.CREATE_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def read(self, account_id: Optional[int]=None,
             mask: WalletEventFlag=WalletEventFlag.NONE) -> List[WalletEventRow]:
@@ -1424,11 +1532,11 @@ class WalletEventTable(BaseWalletStore):
         datas = [ (date_updated, *entry) for entry in entries ]
         def _write(db: sqlite3.Connection):
             db.executemany(self.UPDATE_FLAGS_SQL, datas)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
     def delete(self, entries: Iterable[Tuple[int]],
             completion_callback: Optional[CompletionCallbackType]=None) -> None:
         def _write(db: sqlite3.Connection):
             db.executemany(self.DELETE_SQL, entries)
-        self._db_context.queue_write(_write, completion_callback)
+        self._queue_write(_write, completion_callback)
 
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from pathlib import Path
 from typing import Union, Any
@@ -295,6 +296,12 @@ class ExtensionEndpoints(ExtendedHandlerUtils):
         except Fault as e:
             return fault_to_http_response(e)
 
+    async def _sign_transaction(self, account, tx: Transaction, password: str) -> None:
+        # Signing a transaction with many inputs can take a while, and would otherwise block the
+        # event loop and all the other requests that are being served.
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, account.sign_transaction, tx, password)
+
     async def create_tx(self, request):
         """
         General purpose transaction builder.
@@ -304,7 +311,7 @@ class ExtensionEndpoints(ExtendedHandlerUtils):
         try:
             tx, account, password = await self._create_tx_helper(request)
             self.raise_for_duplicate_tx(tx)
-            account.sign_transaction(tx, password)
+            await self._sign_transaction(account, tx, password)
 
             _frozen_utxos = self.app_state.app.get_and_set_frozen_utxos_for_tx(tx, account)
             response = {"value": {"txid": tx.txid(),
@@ -317,7 +324,7 @@ class ExtensionEndpoints(ExtendedHandlerUtils):
         try:
             tx, account, password = await self._create_tx_helper(request)
             self.raise_for_duplicate_tx(tx)
-            account.sign_transaction(tx, password)
+            await self._sign_transaction(account, tx, password)
             frozen_utxos = self.app_state.app.get_and_set_frozen_utxos_for_tx(tx, account)
             result = await self._broadcast_transaction(str(tx), tx.hash(), account)
             self.prev_transaction = result